@@ -0,0 +1,98 @@
+"""Concurrent-update throughput of the async pipeline against the thread-pool one.
+
+Queues updates from many chats on the Telegram stub and drains them once
+with the threaded TelegramPoller (one thread per worker) and once with the
+AsyncTelegramPoller (one event loop, aiohttp), both through the Dialogflow
+stub and the real fulfillment handlers. Every message goes through
+Dialogflow (the local fast path is turned off). Reports updates/second per
+process and the "typing…" actions sent while Dialogflow was answering.
+
+Usage: python bench_async.py [--count 1000] [--chats 200] [--workers 8] [--max-inflight 256]
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+from harness import Harness
+
+
+def make_updates(harness, first_update_id, count, chats):
+    return [
+        harness.telegram_update(update_id, 1000 + update_id % chats, f"add item{update_id}")
+        for update_id in range(first_update_id, first_update_id + count)
+    ]
+
+
+def run_sync(harness, updates, workers):
+    from polling_worker import TelegramPoller, telegram_get_updates
+
+    poller = TelegramPoller(telegram_get_updates, harness.main.parse_telegram_update, harness.main.process_telegram_message,
+                            workers=workers, batch_size=100, poll_timeout=1)
+    poller.offset = updates[0]["update_id"]
+    last_update_id = updates[-1]["update_id"]
+    thread = threading.Thread(target=poller.run, daemon=True)
+    start = time.perf_counter()
+    harness.telegram.push_updates(updates)
+    thread.start()
+    while poller.offset <= last_update_id:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    poller.stop()
+    thread.join()
+    return elapsed
+
+
+def run_async(harness, updates, max_inflight):
+    from polling_worker import AsyncTelegramPoller, telegram_get_updates_async
+
+    async def drain():
+        poller = AsyncTelegramPoller(telegram_get_updates_async, harness.main.parse_telegram_update,
+                                     harness.main.process_telegram_message_async,
+                                     max_inflight=max_inflight, batch_size=100, poll_timeout=1)
+        poller.offset = updates[0]["update_id"]
+        task = asyncio.create_task(poller.run())
+        start = time.perf_counter()
+        harness.telegram.push_updates(updates)
+        while poller.offset <= updates[-1]["update_id"]:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        poller.stop()
+        await task
+        return elapsed
+
+    return asyncio.run(drain())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8, help="threads of the sync poller")
+    parser.add_argument("--max-inflight", type=int, default=256, help="updates in flight in the async poller")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--dialogflow-latency", type=float, default=0.08)
+    parser.add_argument("--rtdb-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    os.environ["FOODMATE_FAST_PATH"] = "0"
+    harness = Harness(telegram_latency=args.telegram_latency, dialogflow_latency=args.dialogflow_latency,
+                      rtdb_latency=args.rtdb_latency)
+    import metrics
+
+    first_update_id = 1
+    for name, run, concurrency in (("sync", run_sync, args.workers), ("async", run_async, args.max_inflight)):
+        metrics.reset()
+        updates = make_updates(harness, first_update_id, args.count, args.chats)
+        first_update_id += args.count
+        elapsed = run(harness, updates, concurrency)
+        chat_actions = metrics.snapshot()["counters"].get("telegram.chat_actions", 0)
+        print(f"{name:6} (concurrency {concurrency:>4}): {args.count} updates in {elapsed:.1f} s, "
+              f"{args.count / elapsed:.1f} updates/s, {chat_actions} typing actions")
+    harness.stop()
+
+
+if __name__ == "__main__":
+    main()
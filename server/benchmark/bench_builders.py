@@ -0,0 +1,93 @@
+"""Microbenchmarks of the reply builders and formatters.
+
+Times create_dialogflow_response, the nutrition and recipe formatters and
+the grocery list renderer, and compares them with a stored baseline.
+
+Usage: python bench_builders.py [--save-baseline] [--tolerance 0.5]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+from common import compare_with_baseline, prepare_environment, save_results
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_builders.json")
+
+SAMPLE_NUTRITION = {
+    "food_name": "chicken breast",
+    "cautions": ["SULFITES"],
+    "calories": {"quantity": 120.0, "unit": "kcal"},
+    "FAT": {"quantity": 2.6, "unit": "g"},
+    "Carbohydrates (net)": {"quantity": 0.0, "unit": "g"},
+    "Protein": {"quantity": 22.5, "unit": "g"},
+    "Sodium (NA)": {"quantity": 45.0, "unit": "mg"},
+    "totalNutrientsKCal": {
+        "ENERC_KCAL": {"quantity": 120, "unit": "kcal"},
+        "PROCNT_KCAL": {"quantity": 90, "unit": "kcal"},
+        "FAT_KCAL": {"quantity": 23, "unit": "kcal"},
+        "CHOCDF_KCAL": {"quantity": 0, "unit": "kcal"},
+    },
+}
+
+SAMPLE_RECIPE = {
+    "name": "Chicken Vesuvio",
+    "image_url": None,
+    "calories": {"quantity": 4228.04, "unit": ""},
+    "ingredients": ["1/2 cup olive oil", "5 cloves garlic, peeled", "2 large russet potatoes", "1 3-4 pound chicken"],
+    "recipe_url": "https://example.org/chicken-vesuvio",
+}
+
+SAMPLE_ITEMS = ["Milk", "Bread", "Apples", "Eggs", "beer", "almonds", "juice", "quinoa", "chicken breast", "tomatoes",
+                "toilet paper", "shampoo", "frozen peas", "olive oil", "coffee", "pasta", "yogurt", "salmon",
+                "cookies", "cat food"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    prepare_environment()
+    import main as functions_main
+    from edamam_nutrition_api_script import format_nutrition_data
+    from edamam_recipe_api_script import format_recipes
+    from grocery_categorizer import group_by_section, render_sections
+    from local_categorizer import LocalCategorizer
+
+    logging.getLogger().setLevel(logging.WARNING)
+    local = LocalCategorizer.from_file()
+    categories = {item: local.categorize(item) or "Other" for item in SAMPLE_ITEMS}
+    long_text = "Recipe 1:\n" + "- ingredient line\n" * 200
+
+    cases = {
+        "create_dialogflow_response": lambda: functions_main.create_dialogflow_response(long_text),
+        "format_nutrition_data": lambda: format_nutrition_data(SAMPLE_NUTRITION),
+        "format_recipes": lambda: format_recipes([SAMPLE_RECIPE] * 4),
+        "render_grocery_list": lambda: render_sections(group_by_section(categories)),
+        "local_categorize_list": lambda: [local.categorize(item) for item in SAMPLE_ITEMS],
+    }
+
+    results = {}
+    for name, func in cases.items():
+        best = min(timeit.repeat(func, number=args.number, repeat=5)) / args.number
+        results[name] = {"us_per_call": best * 1e6}
+        print(f"{name:30} {best * 1e6:10.2f} us/call")
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        regressions = compare_with_baseline(results, args.baseline, "us_per_call", args.tolerance, min_delta=5.0)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Upstream calls and function-seconds saved by per-chat message coalescing.
+
+Replays a simulated stream of typing bursts ("add milk", "and eggs", "and
+bread", ...) from many chats through telegram_webhook in async mode, once
+without and once with the MessageCoalescer, against the local stubs.
+Every message goes through Dialogflow (the local fast path is turned off).
+Reports detectIntent calls, Telegram replies, the total processing time of
+the turns and the delay added by the debounce window.
+
+Usage: python bench_coalesce.py [--chats 30] [--bursts 4]
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+
+from harness import Harness
+
+# Raffiche tipiche: più messaggi brevi scritti uno dopo l'altro
+BURSTS = [
+    ["add milk", "and eggs", "and bread"],
+    ["add apples", "add pears"],
+    ["remove milk", "and eggs"],
+    ["show my list"],
+    ["add rice", "and beans", "show my list"],
+]
+
+
+def burst_stream(rng, chats, bursts, first_chat_id, min_gap, max_gap, pause):
+    """Returns (seconds from start, chat_id, text) events sorted by time."""
+
+    events = []
+    for chat_id in range(first_chat_id, first_chat_id + chats):
+        at = rng.uniform(0, pause)
+        for _ in range(bursts):
+            for text in rng.choice(BURSTS):
+                events.append((at, chat_id, text))
+                at += rng.uniform(min_gap, max_gap)
+            at += pause
+    return sorted(events)
+
+
+def replay(harness, events, first_update_id):
+    start = time.perf_counter()
+    threads = []
+    for update_id, (at, chat_id, text) in enumerate(events, first_update_id):
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        update = harness.telegram_update(update_id, chat_id, text)
+        thread = threading.Thread(target=harness.call_handler, args=("telegram_webhook", update))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def run(harness, events, first_update_id, coalesce, max_window):
+    import metrics
+
+    main = harness.main
+    main.COALESCE_MESSAGES = coalesce
+    metrics.reset()
+    dialogflow_before = harness.dialogflow.requests
+    sent_before = len(harness.telegram.sent)
+    replay(harness, events, first_update_id)
+    # Attende la scadenza delle ultime finestre e lo svuotamento della coda
+    time.sleep(max_window + 0.5)
+    main.get_update_queue().join()
+
+    snapshot = metrics.snapshot()
+    turn = snapshot["timings"].get("request.telegram_update", {"count": 0, "avg": 0.0})
+    delay = snapshot["timings"].get("coalescer.delay")
+    return {
+        "messages": len(events),
+        "detect_intent": harness.dialogflow.requests - dialogflow_before,
+        "replies": len(harness.telegram.sent) - sent_before,
+        "function_seconds": turn["count"] * turn["avg"],
+        "delay_p50": delay["p50"] if delay else 0.0,
+        "delay_p95": delay["p95"] if delay else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=30)
+    parser.add_argument("--bursts", type=int, default=4)
+    parser.add_argument("--min-gap", type=float, default=0.3, help="shortest gap between messages of a burst (s)")
+    parser.add_argument("--max-gap", type=float, default=0.9)
+    parser.add_argument("--pause", type=float, default=5.0, help="pause between the bursts of a chat (s)")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--dialogflow-latency", type=float, default=0.08)
+    parser.add_argument("--rtdb-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    os.environ["FOODMATE_FAST_PATH"] = "0"
+    os.environ["FOODMATE_WEBHOOK_MODE"] = "async"
+    os.environ["FOODMATE_WEBHOOK_WORKERS"] = "16"
+    harness = Harness(telegram_latency=args.telegram_latency, dialogflow_latency=args.dialogflow_latency,
+                      rtdb_latency=args.rtdb_latency)
+    from message_coalescer import COALESCE_MAX_WINDOW, coalescing_savings
+
+    rng = random.Random(7)
+    results = {}
+    first_update_id = 1
+    events = burst_stream(rng, args.chats, args.bursts, 1000, args.min_gap, args.max_gap, args.pause)
+    for name, coalesce, chat_offset in (("off", False, 0), ("on", True, 1000)):
+        # Stessa sequenza di messaggi, su chat diverse perché le liste partano vuote
+        events = [(at, chat_id + chat_offset, text) for at, chat_id, text in events]
+        results[name] = run(harness, events, first_update_id, coalesce, COALESCE_MAX_WINDOW)
+        first_update_id += len(events)
+        if coalesce:
+            savings = coalescing_savings()
+    harness.stop()
+
+    print(f"{'coalescing':10} {'messages':>9} {'detectIntent':>13} {'replies':>8} {'function s':>11} {'delay p50':>10} {'delay p95':>10}")
+    for name, result in results.items():
+        print(f"{name:10} {result['messages']:>9} {result['detect_intent']:>13} {result['replies']:>8} "
+              f"{result['function_seconds']:>11.1f} {result['delay_p50']:>9.2f}s {result['delay_p95']:>9.2f}s")
+    off, on = results["off"], results["on"]
+    print(f"saved: {off['detect_intent'] - on['detect_intent']} detectIntent calls "
+          f"({100 * (1 - on['detect_intent'] / off['detect_intent']):.0f}%), "
+          f"{off['function_seconds'] - on['function_seconds']:.1f} function-seconds")
+    print(f"coalescer estimate: {savings['saved_turns']} turns, {savings['saved_upstream_calls']:.0f} upstream calls, "
+          f"{savings['saved_function_seconds']:.1f} function-seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""End-to-end load test of telegram_webhook against local stand-ins of every upstream.
+
+Synthetic conversations (or updates recorded in a JSON-lines file) are
+replayed at a target rate; every update goes through the real webhook,
+the Dialogflow stub, the fulfillment handlers, Edamam/Gemini/RTDB fakes
+and the Telegram stub. Reports throughput and latency percentiles for the
+whole webhook and for each upstream stage.
+
+Usage: python bench_e2e.py [--rate 20] [--count 400] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import compare_with_baseline, save_results, summarize
+from harness import Harness
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_e2e.json")
+
+# Conversazione sintetica ripetuta da ogni chat
+CONVERSATION = [
+    "hello",
+    "add milk, eggs and bread",
+    "add quinoa and dragon fruit",
+    "show list",
+    "nutrition 100g chicken breast",
+    "recipes chicken",
+    "remove milk",
+    "list",
+]
+
+
+def synthetic_updates(harness, count, chats):
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = 1000 + (update_id - 1) % chats
+        text = CONVERSATION[((update_id - 1) // chats) % len(CONVERSATION)]
+        updates.append(harness.telegram_update(update_id, chat_id, text))
+    return updates
+
+
+def recorded_updates(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(harness, updates, rate, concurrency):
+    """Sends the updates at `rate` per second; returns (latencies, elapsed seconds, errors)."""
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def send(update, scheduled_at):
+        result = harness.call_handler("telegram_webhook", update)
+        # La latenza parte dall'istante previsto, non da quando un thread si libera
+        latency = time.perf_counter() - scheduled_at
+        status = result[1] if isinstance(result, tuple) else 200
+        with lock:
+            latencies.append(latency)
+            if status != 200:
+                errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, update in enumerate(updates):
+            scheduled_at = start + index / rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, update, scheduled_at)
+    return latencies, time.perf_counter() - start, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20.0, help="updates per second")
+    parser.add_argument("--count", type=int, default=400)
+    parser.add_argument("--chats", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--updates", help="JSON-lines file of recorded Telegram updates")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--dialogflow-latency", type=float, default=0.08)
+    parser.add_argument("--edamam-latency", type=float, default=0.15)
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--rtdb-latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    harness = Harness(
+        telegram_latency=args.telegram_latency, dialogflow_latency=args.dialogflow_latency,
+        edamam_latency=args.edamam_latency, gemini_latency=args.gemini_latency,
+        rtdb_latency=args.rtdb_latency, error_rate=args.error_rate,
+    )
+    import metrics
+
+    updates = recorded_updates(args.updates) if args.updates else synthetic_updates(harness, args.count, args.chats)
+    metrics.reset()
+    latencies, elapsed, errors = run(harness, updates, args.rate, args.concurrency)
+    harness.stop()
+
+    results = {"webhook": summarize(latencies)}
+    for name, timing in metrics.snapshot()["timings"].items():
+        results[name] = {
+            "count": timing["count"],
+            "mean_ms": 1000 * timing["avg"],
+            "p50_ms": 1000 * timing["p50"],
+            "p95_ms": 1000 * timing["p95"],
+            "p99_ms": 1000 * timing["p99"],
+        }
+
+    print(f"{len(updates)} updates in {elapsed:.1f} s: {len(updates) / elapsed:.1f} updates/s "
+          f"(target {args.rate:.1f}), {len(errors)} errors")
+    from intent_router import fast_path_share
+    print(f"fast path (no Dialogflow call): {100 * fast_path_share():.0f}% of messages")
+    print(f"{'stage':45} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, summary in sorted(results.items()):
+        print(f"{name:45} {summary['count']:>6} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f}")
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        regressions = compare_with_baseline(results, args.baseline, "p95_ms", args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
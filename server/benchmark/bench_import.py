@@ -0,0 +1,65 @@
+"""Measures the cold import time of the Cloud Functions module.
+
+Each run imports main.py in a fresh interpreter, as a cold start does. The
+script exits with status 1 if the median import time exceeds the budget or
+if a module that should be loaded lazily is imported eagerly.
+
+Usage: python bench_import.py [--runs 5] [--budget 1.5]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import FUNCTIONS_DIR
+
+# Moduli che devono essere caricati solo al primo utilizzo
+LAZY_MODULES = ["google.generativeai", "firebase_admin.db", "dialogflow_auth"]
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {functions_dir!r})
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "eager": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_once():
+    probe = _PROBE.format(functions_dir=FUNCTIONS_DIR, lazy=LAZY_MODULES)
+    # Nessun file di chiavi nella cartella di lavoro: l'import non deve leggerli
+    output = subprocess.run(
+        [sys.executable, "-c", probe], cwd=tempfile.gettempdir(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="maximum median import time in seconds")
+    args = parser.parse_args()
+
+    results = [measure_once() for _ in range(args.runs)]
+    times = [result["seconds"] for result in results]
+    eager = sorted({module for result in results for module in result["eager"]})
+    median = statistics.median(times)
+
+    print(f"cold import of main: median {median * 1000:.0f} ms, min {min(times) * 1000:.0f} ms, "
+          f"max {max(times) * 1000:.0f} ms over {args.runs} runs (budget {args.budget * 1000:.0f} ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: modules imported eagerly: {', '.join(eager)}")
+        failed = True
+    if median > args.budget:
+        print("FAIL: cold import exceeds the budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Latency of nutrition lookups through an Edamam incident, with circuit breaker and hedging.
+
+Three phases against the local Edamam stub:
+- healthy: a few requests are slow (a latency tail), which hedged requests cut;
+- incident: every request hangs for --incident-latency seconds, the cached
+  results have expired; the circuit opens and users get the stale results;
+- recovery: Edamam is healthy again, the half-open probe closes the circuit.
+
+Usage: python bench_incident.py [--requests 200] [--incident-latency 3]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import prepare_environment, summarize
+from stubs import EdamamStub
+
+
+def run_phase(nutrition, ingredients, requests, concurrency):
+    """Looks up the ingredients `requests` times; returns (latencies, stale answers)."""
+
+    def lookup(index):
+        start = time.perf_counter()
+        text = nutrition.get_nutrition_data(ingredients[index % len(ingredients)])
+        return time.perf_counter() - start, text.startswith(nutrition.STALE_NOTE)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lookup, range(requests)))
+    return [latency for latency, _ in results], sum(stale for _, stale in results)
+
+
+def expire(cache):
+    # Fa scadere tutte le voci, che restano disponibili come risultati "stale"
+    for key, (value, _) in list(cache._entries.items()):
+        cache._entries[key] = (value, 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--ingredients", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-latency", type=float, default=0.6)
+    parser.add_argument("--incident-latency", type=float, default=3.0)
+    parser.add_argument("--slow-call", type=float, default=0.5, help="breaker slow-call threshold (s)")
+    parser.add_argument("--open-for", type=float, default=2.0, help="seconds before the half-open probe")
+    parser.add_argument("--deadline", type=float, default=1.0, help="maximum wait for an Edamam call (s)")
+    args = parser.parse_args()
+
+    os.environ["FOODMATE_EDAMAM_SLOW_CALL"] = str(args.slow_call)
+    os.environ["FOODMATE_EDAMAM_OPEN_FOR"] = str(args.open_for)
+    os.environ["FOODMATE_EDAMAM_DEADLINE"] = str(args.deadline)
+    stub = EdamamStub(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency).start()
+    prepare_environment(EDAMAM_API_URL=stub.url)
+    import edamam_nutrition_api_script as nutrition
+    import metrics
+    from upstream_guard import get_breaker
+
+    ingredients = [f"{100 + i} g ingredient {i}" for i in range(args.ingredients)]
+    print(f"{'phase':10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'stale':>6}")
+
+    phases = [
+        ("healthy", args.latency, args.slow_rate),
+        ("incident", args.incident_latency, 0.0),
+        ("recovery", args.latency, 0.0),
+    ]
+    for name, latency, slow_rate in phases:
+        stub.latency, stub.slow_rate = latency, slow_rate
+        if name == "recovery":
+            # Le chiamate abbandonate durante l'incidente terminano, poi parte la prova
+            time.sleep(args.open_for + args.incident_latency)
+        metrics.reset()
+        latencies = []
+        stale = 0
+        # Ogni giro trova la cache scaduta e deve chiedere di nuovo a Edamam
+        for _ in range(max(1, args.requests // args.ingredients)):
+            expire(nutrition.nutrition_cache)
+            round_latencies, round_stale = run_phase(nutrition, ingredients, args.ingredients, args.concurrency)
+            latencies += round_latencies
+            stale += round_stale
+        summary = summarize(latencies)
+        print(f"{name:10} {summary['count']:>6} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} "
+              f"{summary['p99_ms']:>9.1f} {1000 * max(latencies):>9.1f} {stale:>6}")
+        counters = metrics.snapshot()["counters"]
+        print(f"{'':10} hedged {counters.get('upstream.edamam.hedged', 0)}, "
+              f"hedge wins {counters.get('upstream.edamam.hedge_wins', 0)}, "
+              f"timeouts {counters.get('upstream.edamam.timeouts', 0)}, "
+              f"rejected by open circuit {counters.get('upstream.edamam.circuit.rejected', 0)}, "
+              f"circuit state {['closed', 'half-open', 'open'][get_breaker('edamam').state]}")
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compares sequential and batched nutrition analysis against a local Edamam stub.
+
+Usage: python bench_nutrition_batch.py [--items 8] [--latency 0.2]
+"""
+
+import argparse
+import time
+
+from common import prepare_environment
+from stubs import EdamamStub
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub = EdamamStub(latency=args.latency).start()
+    prepare_environment(EDAMAM_API_URL=stub.url)
+    import edamam_nutrition_api_script as nutrition
+
+    ingredients = [f"{100 + i} g ingredient {i}" for i in range(args.items)]
+
+    nutrition.nutrition_cache._entries.clear()
+    start = time.perf_counter()
+    for ingredient in ingredients:
+        nutrition.get_nutrition_data(ingredient)
+    sequential = time.perf_counter() - start
+
+    nutrition.nutrition_cache._entries.clear()
+    start = time.perf_counter()
+    nutrition.get_nutrition_data_batch(ingredients)
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nutrition.get_nutrition_data_batch(ingredients)
+    cached = time.perf_counter() - start
+
+    print(f"items: {args.items}, upstream latency: {args.latency * 1000:.0f} ms")
+    print(f"sequential:     {sequential * 1000:8.1f} ms")
+    print(f"batched:        {batched * 1000:8.1f} ms")
+    print(f"batched cached: {cached * 1000:8.1f} ms")
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
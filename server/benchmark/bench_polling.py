@@ -0,0 +1,93 @@
+"""Sustained throughput of the getUpdates long-polling worker against the local stubs.
+
+Queues updates from many chats on the Telegram stub, lets a TelegramPoller
+drain them through the real pipeline (Dialogflow stub, fulfillment
+handlers, Telegram stub) and reports updates/second for one worker and for
+the configured number of workers. Also checks that the replies of every
+chat came back in the order of its messages.
+
+Usage: python bench_polling.py [--count 400] [--chats 25] [--workers 8]
+"""
+
+import argparse
+import re
+import sys
+import threading
+import time
+
+from harness import Harness
+
+
+def run(harness, first_update_id, count, chats, workers, batch_size):
+    """Processes `count` updates with a new poller; returns the elapsed seconds."""
+
+    from polling_worker import TelegramPoller, telegram_get_updates
+
+    updates = [
+        harness.telegram_update(update_id, 1000 + update_id % chats, f"add item{update_id}")
+        for update_id in range(first_update_id, first_update_id + count)
+    ]
+    poller = TelegramPoller(telegram_get_updates, harness.main.parse_telegram_update, harness.main.process_telegram_message,
+                            workers=workers, batch_size=batch_size, poll_timeout=1)
+    poller.offset = first_update_id
+    thread = threading.Thread(target=poller.run, daemon=True)
+
+    start = time.perf_counter()
+    harness.telegram.push_updates(updates)
+    thread.start()
+    while poller.offset < first_update_id + count:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    poller.stop()
+    thread.join()
+    return elapsed
+
+
+def out_of_order_chats(sent):
+    """Returns the chats whose replies do not follow the order of their messages."""
+
+    last_seen = {}
+    out_of_order = set()
+    for message in sent:
+        match = re.search(r"item(\d+)", message.get("text", ""))
+        if not match:
+            continue
+        update_id = int(match.group(1))
+        chat_id = message["chat_id"]
+        if update_id < last_seen.get(chat_id, 0):
+            out_of_order.add(chat_id)
+        last_seen[chat_id] = update_id
+    return out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=400)
+    parser.add_argument("--chats", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--dialogflow-latency", type=float, default=0.08)
+    parser.add_argument("--rtdb-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    harness = Harness(telegram_latency=args.telegram_latency, dialogflow_latency=args.dialogflow_latency,
+                      rtdb_latency=args.rtdb_latency)
+
+    first_update_id = 1
+    for workers in sorted({1, args.workers}):
+        harness.telegram.sent.clear()
+        elapsed = run(harness, first_update_id, args.count, args.chats, workers, args.batch_size)
+        first_update_id += args.count
+        print(f"workers {workers:>3}: {args.count} updates in {elapsed:.1f} s, {args.count / elapsed:.1f} updates/s")
+
+    out_of_order = out_of_order_chats(harness.telegram.sent)
+    harness.stop()
+    if out_of_order:
+        print(f"replies out of order in {len(out_of_order)} chats")
+        sys.exit(1)
+    print("replies in order in every chat")
+
+
+if __name__ == "__main__":
+    main()
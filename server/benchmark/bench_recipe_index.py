@@ -0,0 +1,93 @@
+"""Ranking of stored recipes by grocery list coverage with the local inverted index.
+
+Fills a RecipeIndex with synthetic recipes built from the common foods of
+the nutrient index, then reports the size of the file, the cold load time
+and the latency of rank() for random grocery lists, compared with a scan
+that intersects the list with the ingredients of every recipe.
+
+Usage: python bench_recipe_index.py [--recipes 30000] [--lists 200]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import prepare_environment, summarize
+
+
+def synthetic_recipes(foods, count, rng):
+    for number in range(count):
+        ingredients = rng.sample(foods, rng.randint(4, 12))
+        yield {
+            "name": f"recipe {number}",
+            "calories": {"quantity": rng.randint(200, 900), "unit": "kcal"},
+            "ingredients": [f"{rng.randint(1, 500)} g {food}" for food in ingredients],
+            "foods": ingredients,
+            "uri": f"https://example.org/recipes#{number}",
+            "recipe_url": f"https://example.org/{number}",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipes", type=int, default=30000)
+    parser.add_argument("--lists", type=int, default=200)
+    parser.add_argument("--list-size", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=20.0, help="maximum p95 of rank()")
+    args = parser.parse_args()
+
+    prepare_environment()
+    from nutrient_index import FOODS_PATH
+    from recipe_index import RecipeIndex, ingredient_term, recipe_terms
+
+    with open(FOODS_PATH, "r") as f:
+        foods = list(json.load(f)["foods"])
+    rng = random.Random(42)
+    path = os.path.join(tempfile.mkdtemp(prefix="foodmate-bench-"), "recipes.sqlite")
+
+    index = RecipeIndex(path)
+    recipes = list(synthetic_recipes(foods, args.recipes, rng))
+    start = time.perf_counter()
+    for offset in range(0, len(recipes), 20):
+        # Come da Edamam: una pagina di 20 ricette alla volta
+        index.add(recipes[offset:offset + 20])
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = RecipeIndex(path)
+    stored = len(index)
+    load_time = time.perf_counter() - start
+
+    lists = [rng.sample(foods, args.list_size) for _ in range(args.lists)]
+    rank_latencies = []
+    for items in lists:
+        start = time.perf_counter()
+        index.rank(items, 4, min_matched=2)
+        rank_latencies.append(time.perf_counter() - start)
+
+    # Confronto: intersezione della lista con gli ingredienti di ogni ricetta
+    recipe_sets = [set(recipe_terms(recipe)) for recipe in recipes]
+    scan_latencies = []
+    for items in lists[:20]:
+        start = time.perf_counter()
+        wanted = {ingredient_term(item) for item in items}
+        sorted(((len(terms & wanted), number) for number, terms in enumerate(recipe_sets)), reverse=True)[:4]
+        scan_latencies.append(time.perf_counter() - start)
+
+    rank = summarize(rank_latencies)
+    scan = summarize(scan_latencies)
+    print(f"{stored} recipes, {os.path.getsize(path) / 1e6:.1f} MB on disk, "
+          f"built in {build_time:.1f} s, loaded in {1000 * load_time:.0f} ms")
+    print(f"rank():     p50 {rank['p50_ms']:.2f} ms, p95 {rank['p95_ms']:.2f} ms ({args.list_size} items per list)")
+    print(f"full scan:  p50 {scan['p50_ms']:.2f} ms, p95 {scan['p95_ms']:.2f} ms")
+    if rank["p95_ms"] > args.budget_ms:
+        print(f"REGRESSION rank p95 above the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
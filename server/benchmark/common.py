@@ -0,0 +1,76 @@
+"""Helpers shared by the benchmark scripts."""
+
+import json
+import os
+import sys
+import tempfile
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions")
+
+# Chiavi fittizie lette dai moduli delle Cloud Functions
+FAKE_KEY_FILES = {
+    "edamam_nutritionAPI_key.json": {"Application_ID": "bench", "Application_Key": "bench"},
+    "edamam_recipeAPI_key.json": {"Application_ID": "bench", "Application_Key": "bench"},
+    "gemini-key.json": {"gemini_api_key": "bench"},
+    "telegram_bot_father_key.json": {"TELEGRAM_BOT_KEY": "bench"},
+    "dialogflow_infos.json": {"PROJECT_ID": "bench", "AGENT_ID": "bench"},
+}
+
+
+def prepare_environment(**upstream_urls):
+    """Points the functions at local stubs and runs them from a temp dir with fake keys."""
+
+    for name, url in upstream_urls.items():
+        os.environ[name] = url
+    work_dir = tempfile.mkdtemp(prefix="foodmate-bench-")
+    for file_name, content in FAKE_KEY_FILES.items():
+        with open(os.path.join(work_dir, file_name), "w") as f:
+            json.dump(content, f)
+    os.chdir(work_dir)
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    return work_dir
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    """Returns count, mean and p50/p95/p99 (in milliseconds) of durations in seconds."""
+
+    return {
+        "count": len(samples),
+        "mean_ms": 1000 * sum(samples) / len(samples) if samples else 0.0,
+        "p50_ms": 1000 * percentile(samples, 0.50),
+        "p95_ms": 1000 * percentile(samples, 0.95),
+        "p99_ms": 1000 * percentile(samples, 0.99),
+    }
+
+
+def compare_with_baseline(results, baseline_path, metric, tolerance, min_delta=2.0):
+    """Compares `metric` of every entry of results with a stored baseline.
+
+    Returns the list of regressions: entries whose value grew by more than
+    `tolerance` (a fraction) and by more than `min_delta` (absolute).
+    """
+
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, values in results.items():
+        if name not in baseline or metric not in values:
+            continue
+        before, after = baseline[name][metric], values[metric]
+        if after > before * (1 + tolerance) and after - before > min_delta:
+            regressions.append(f"{name}: {metric} {before:.3f} -> {after:.3f}")
+    return regressions
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,162 @@
+"""In-memory stand-in for the firebase_admin Realtime Database references."""
+
+import copy
+import threading
+import time
+
+
+class Event:
+    """Mirrors firebase_admin.db.Event."""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class _Registration:
+
+    def __init__(self, database, path, callback):
+        self._database = database
+        self.path = path
+        self.callback = callback
+
+    def close(self):
+        self._database.remove_listener(self)
+
+
+class FakeDatabase:
+    """A JSON tree with optional latency per operation and listen() support."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.operations = 0
+        self._root = {}
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def reference(self, path="/"):
+        return FakeReference(self, _split(path))
+
+    def remove_listener(self, registration):
+        with self._lock:
+            if registration in self._listeners:
+                self._listeners.remove(registration)
+
+    def _round_trip(self):
+        with self._lock:
+            self.operations += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, parts):
+        node = self._root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return copy.deepcopy(node)
+
+    def _set(self, parts, value):
+        if not parts:
+            self._root = value if isinstance(value, dict) else {}
+            return
+        node = self._root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+        self._prune(parts[:-1])
+
+    def _prune(self, parts):
+        # Come nel database reale, i nodi vuoti spariscono
+        while parts:
+            parent = self._root
+            for part in parts[:-1]:
+                parent = parent.get(part, {})
+            if parent.get(parts[-1]) == {}:
+                parent.pop(parts[-1], None)
+            parts = parts[:-1]
+
+    def _notify(self, parts, event_type, data):
+        with self._lock:
+            listeners = list(self._listeners)
+        for registration in listeners:
+            prefix = registration.path
+            if parts[:len(prefix)] == prefix:
+                relative = "/" + "/".join(parts[len(prefix):])
+                registration.callback(Event(event_type, relative, copy.deepcopy(data)))
+            elif prefix[:len(parts)] == parts:
+                registration.callback(Event("put", "/", self._get(prefix)))
+
+
+class FakeReference:
+    """Subset of firebase_admin.db.Reference used by the Cloud Functions."""
+
+    def __init__(self, database, parts, order_by_value=False, end_at=None):
+        self._database = database
+        self._parts = parts
+        self._order_by_value = order_by_value
+        self._end_at = end_at
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    def child(self, path):
+        return FakeReference(self._database, self._parts + _split(path))
+
+    def get(self, shallow=False):
+        self._database._round_trip()
+        with self._database._lock:
+            value = self._database._get(self._parts)
+        if self._end_at is not None and isinstance(value, dict):
+            value = {key: item for key, item in value.items() if item <= self._end_at}
+        if shallow and isinstance(value, dict):
+            value = {key: True for key in value}
+        return value
+
+    def set(self, value):
+        self._database._round_trip()
+        with self._database._lock:
+            self._database._set(self._parts, value)
+        self._database._notify(self._parts, "put", value)
+
+    def delete(self):
+        self.set(None)
+
+    def update(self, values):
+        self._database._round_trip()
+        with self._database._lock:
+            for path, value in values.items():
+                self._database._set(self._parts + _split(path), value)
+        self._database._notify(self._parts, "patch", values)
+
+    def transaction(self, transaction_update):
+        self._database._round_trip()
+        with self._database._lock:
+            value = transaction_update(self._database._get(self._parts))
+            self._database._set(self._parts, value)
+        return value
+
+    def order_by_value(self):
+        return FakeReference(self._database, self._parts, order_by_value=True)
+
+    def end_at(self, value):
+        return FakeReference(self._database, self._parts, self._order_by_value, value)
+
+    def listen(self, callback):
+        registration = _Registration(self._database, self._parts, callback)
+        with self._database._lock:
+            self._database._listeners.append(registration)
+            initial = self._database._get(self._parts)
+        callback(Event("put", "/", initial))
+        return registration
+
+
+def _split(path):
+    return [part for part in str(path).split("/") if part]
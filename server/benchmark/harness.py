@@ -0,0 +1,115 @@
+"""Runs the real Cloud Functions handlers against local stand-ins of every upstream."""
+
+import json
+import logging
+import re
+
+from common import prepare_environment
+from fake_rtdb import FakeDatabase
+from stubs import DialogflowStub, EdamamStub, FakeGeminiModel, TelegramStub
+
+
+class FakeRequest:
+    """The part of flask.Request used by the handlers."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def get_json(self, silent=False):
+        return self._data
+
+
+class FakeTokenManager:
+
+    def get_token(self):
+        return "bench-token"
+
+
+def _response_messages(result):
+    # I fulfillment restituiscono una stringa JSON, eventualmente con lo status HTTP
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result.get("fulfillment_response", {}).get("messages", [])
+
+
+class Harness:
+    """Starts the stubs, imports main.py against them and routes intents to its handlers.
+
+    The Dialogflow stub recognizes a handful of intents by keyword and calls
+    the matching fulfillment handler in-process, like the real agent does
+    through its webhooks.
+    """
+
+    INTENTS = [
+        (re.compile(r"^add (?P<items>.+)$", re.I), "add_to_grocery_list"),
+        (re.compile(r"^remove (?P<items>.+)$", re.I), "remove_from_grocery_list"),
+        (re.compile(r"^(show )?(my )?list$", re.I), "view_grocery_list"),
+        (re.compile(r"^clear( list)?$", re.I), "clear_grocery_list"),
+        (re.compile(r"^nutrition (?P<items>.+)$", re.I), "get_nutrition_analysis_single_ingredient"),
+        (re.compile(r"^(/cook|what can i cook.*|recipes? from my list)$", re.I), "get_recipes_from_grocery_list"),
+        (re.compile(r"^recipes? (?P<items>.+)$", re.I), "get_recipes_search"),
+    ]
+
+    def __init__(self, telegram_latency=0.0, dialogflow_latency=0.0, edamam_latency=0.0,
+                 gemini_latency=0.0, rtdb_latency=0.0, error_rate=0.0):
+        self.telegram = TelegramStub(latency=telegram_latency, error_rate=error_rate).start()
+        self.dialogflow = DialogflowStub(self.webhook, latency=dialogflow_latency, error_rate=error_rate).start()
+        self.edamam = EdamamStub(latency=edamam_latency, error_rate=error_rate).start()
+        self.database = FakeDatabase(latency=rtdb_latency)
+        self.gemini = FakeGeminiModel(latency=gemini_latency, chunk_latency=gemini_latency / 10)
+
+        prepare_environment(
+            TELEGRAM_API_URL=self.telegram.url,
+            DIALOGFLOW_API_URL=self.dialogflow.url,
+            EDAMAM_API_URL=self.edamam.url,
+        )
+        import main
+        import gemini_api_script
+
+        # Il logging di debug delle funzioni falserebbe le misure
+        logging.getLogger().setLevel(logging.WARNING)
+
+        main.db_reference = self.database.reference
+        main.get_dialogflow_token_manager = FakeTokenManager
+        gemini_api_script._model = self.gemini
+        self.main = main
+
+    def call_handler(self, name, request_data):
+        """Calls a Cloud Function handler directly, bypassing the Flask/CORS wrapper."""
+
+        handler = getattr(self.main, name)
+        return getattr(handler, "__wrapped__", handler)(FakeRequest(request_data))
+
+    def webhook(self, session_id, text, payload):
+        for pattern, handler_name in self.INTENTS:
+            match = pattern.match(text.strip())
+            if not match:
+                continue
+            items = [item.strip() for item in re.split(r",| and ", match.groupdict().get("items") or "") if item.strip()]
+            request_data = {
+                "sessionInfo": {"session": f"projects/bench/locations/bench/agents/bench/sessions/{session_id}"},
+                "intentInfo": {"parameters": {"item": {"resolvedValue": items}}},
+                "payload": payload,
+            }
+            return _response_messages(self.call_handler(handler_name, request_data))
+        return [{"text": {"text": ["Hi! I'm Foodmate. I can manage your grocery list, find recipes and analyze food."]}}]
+
+    def telegram_update(self, update_id, chat_id, text):
+        """Builds a Telegram update like the ones sent to the webhook."""
+
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "from": {"id": chat_id, "is_bot": False, "username": f"user{chat_id}"},
+                "chat": {"id": chat_id, "type": "private"},
+                "date": 0,
+                "text": text,
+            },
+        }
+
+    def stop(self):
+        for stub in (self.telegram, self.dialogflow, self.edamam):
+            stub.stop()
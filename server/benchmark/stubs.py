@@ -0,0 +1,252 @@
+"""Local stand-ins for the upstream HTTP APIs used by the Cloud Functions."""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubServer:
+    """Runs a stub HTTP API on a local port in a background thread.
+
+    Every response is delayed by `latency` seconds (plus up to `jitter`
+    seconds, plus `slow_latency` seconds with probability `slow_rate`) and
+    fails with HTTP 500 with probability `error_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, slow_rate=0.0, slow_latency=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                with stub._lock:
+                    stub.requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                slow = stub.slow_latency if stub.slow_rate and random.random() < stub.slow_rate else 0.0
+                time.sleep(stub.latency + random.uniform(0, stub.jitter) + slow)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    status, payload = 500, {"error": "injected failure"}
+                else:
+                    url = urlparse(self.path)
+                    status, payload = stub.handle(method, url.path, parse_qs(url.query), body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def handle(self, method, path, query, body):
+        """Returns (status, json_payload) for a request; overridden by each stub."""
+
+        return 404, {"error": f"Unknown path {path}"}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _nutrients(seed):
+    return {
+        "ENERC_KCAL": {"label": "Energy", "quantity": 50.0 + seed, "unit": "kcal"},
+        "FAT": {"label": "Fat", "quantity": 1.0 + seed / 10, "unit": "g"},
+        "CHOCDF.net": {"label": "Carbohydrates (net)", "quantity": 5.0 + seed / 10, "unit": "g"},
+        "PROCNT": {"label": "Protein", "quantity": 3.0 + seed / 10, "unit": "g"},
+        "NA": {"label": "Sodium", "quantity": 10.0 + seed, "unit": "mg"},
+    }
+
+
+class EdamamStub(StubServer):
+    """Edamam nutrition-data, nutrition-details and recipes v2 endpoints."""
+
+    def handle(self, method, path, query, body):
+        if path == "/api/nutrition-data":
+            ingredient = query.get("ingr", [""])[0]
+            if ingredient.startswith("unknown"):
+                return 200, {"calories": 0, "totalNutrients": {}, "ingredients": [{"parsed": []}]}
+            nutrients = _nutrients(len(ingredient))
+            return 200, {
+                "calories": nutrients["ENERC_KCAL"]["quantity"],
+                "cautions": [],
+                "totalWeight": 100.0,
+                "totalNutrients": nutrients,
+                "totalNutrientsKCal": {"ENERC_KCAL": {"label": "Energy", "quantity": nutrients["ENERC_KCAL"]["quantity"], "unit": "kcal"}},
+                "ingredients": [{"text": ingredient, "parsed": [{"foodMatch": ingredient, "nutrients": nutrients}]}],
+            }
+        if path == "/api/nutrition-details" and method == "POST":
+            return 200, {
+                "ingredients": [
+                    {"text": item, "parsed": [] if item.startswith("unknown") else [{"foodMatch": item, "nutrients": _nutrients(len(item))}]}
+                    for item in body.get("ingr", [])
+                ]
+            }
+        if path == "/api/recipes/v2":
+            page = int(query.get("page", ["0"])[0])
+            q = query.get("q", [""])[0]
+            hits = [
+                {"recipe": {
+                    "label": f"{q} recipe {page * 20 + i}",
+                    "image": None,
+                    "calories": 400.0 + i,
+                    "ingredientLines": [q, "salt", "olive oil"],
+                    "ingredients": [{"food": food} for food in q.split() + ["salt", "olive oil"]],
+                    "uri": f"https://example.org/recipes#{q.replace(' ', '-')}-{page * 20 + i}",
+                    "url": f"https://example.org/{page * 20 + i}",
+                }}
+                for i in range(20)
+            ]
+            links = {}
+            if page < 4:
+                links["next"] = {"href": f"{self.url}/api/recipes/v2?type=public&q={q}&page={page + 1}"}
+            return 200, {"hits": hits, "_links": links}
+        return super().handle(method, path, query, body)
+
+
+class TelegramStub(StubServer):
+    """Telegram Bot API methods used by the bot (sendMessage, editMessageText,
+    sendChatAction, and getUpdates over the updates given to push_updates)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = []
+        self.edited = []
+        self.confirmed_offset = 0
+        self._message_id = 0
+        self._updates = []
+        self._updates_changed = threading.Condition(self._lock)
+
+    def push_updates(self, updates):
+        """Queues updates to be returned by getUpdates."""
+
+        with self._updates_changed:
+            self._updates.extend(updates)
+            self._updates_changed.notify_all()
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        with self._updates_changed:
+            # Come Telegram: un offset conferma (ed elimina) tutti gli update precedenti
+            if offset:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+                self.confirmed_offset = max(self.confirmed_offset, offset)
+            self._updates_changed.wait_for(lambda: self._updates, timeout=timeout)
+            return 200, {"ok": True, "result": self._updates[:limit]}
+
+    def handle(self, method, path, query, body):
+        api_method = path.rsplit("/", 1)[-1]
+        if api_method == "getUpdates":
+            params = {key: values[0] for key, values in query.items()}
+            params.update(body or {})
+            return self._get_updates(params)
+        if api_method == "sendMessage":
+            with self._lock:
+                self._message_id += 1
+                self.sent.append(body)
+                message_id = self._message_id
+            return 200, {"ok": True, "result": {"message_id": message_id, "chat": {"id": body.get("chat_id")}, "text": body.get("text")}}
+        if api_method == "editMessageText":
+            with self._lock:
+                self.edited.append(body)
+            return 200, {"ok": True, "result": {"message_id": body.get("message_id"), "text": body.get("text")}}
+        if api_method == "sendChatAction":
+            return 200, {"ok": True, "result": True}
+        return super().handle(method, path, query, body)
+
+
+class DialogflowStub(StubServer):
+    """Dialogflow CX detectIntent endpoint.
+
+    `webhook(session_id, text, payload)` plays the agent and its fulfillment:
+    it returns the list of responseMessages for the query.
+    """
+
+    def __init__(self, webhook, **kwargs):
+        super().__init__(**kwargs)
+        self.webhook = webhook
+
+    def handle(self, method, path, query, body):
+        if path.endswith(":detectIntent") and method == "POST":
+            session_id = path.split("/sessions/", 1)[1].rsplit(":", 1)[0]
+            text = body["query_input"]["text"]["text"]
+            payload = body.get("query_params", {}).get("payload", {})
+            messages = self.webhook(session_id, text, payload)
+            return 200, {"queryResult": {"text": text, "responseMessages": messages}}
+        return super().handle(method, path, query, body)
+
+
+class _FakeChunk:
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """In-process stand-in for google.generativeai.GenerativeModel.
+
+    Assigns every item of the prompt to a section after `latency` seconds;
+    streamed answers produce one line every `chunk_latency` seconds. With
+    `fail_after`, a streamed answer breaks with an error after that many
+    lines.
+    """
+
+    SECTIONS = ["Pantry", "Fresh Produce", "Household", "Drinks"]
+
+    def __init__(self, latency=0.0, chunk_latency=0.0, fail_after=None):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def _items(self, prompt):
+        start = prompt.index("includes: ") + len("includes: ")
+        end = prompt.index("]", start) + 1
+        return json.loads(prompt[start:end])
+
+    def _section(self, item):
+        return self.SECTIONS[sum(map(ord, item)) % len(self.SECTIONS)]
+
+    def generate_content(self, prompt, stream=False, generation_config=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        items = self._items(prompt)
+        if not stream:
+            return _FakeChunk(json.dumps({item: self._section(item) for item in items}))
+        return self._stream(items)
+
+    def _stream(self, items):
+        for number, item in enumerate(items):
+            time.sleep(self.chunk_latency)
+            if self.fail_after is not None and number >= self.fail_after:
+                raise ConnectionError("injected stream failure")
+            yield _FakeChunk(json.dumps({"item": item, "section": self._section(item)}) + "\n")
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+
+import aiohttp
+
+import metrics
+from http_client import DEFAULT_TIMEOUT, MAX_RETRIES, RETRY_STATUS_CODES, UPSTREAM_TIMEOUTS, _backoff
+from instrumentation import span
+
+# Connessioni aperte contemporaneamente verso ogni upstream, per event loop
+CONNECTION_LIMIT = int(os.environ.get("FOODMATE_ASYNC_HTTP_CONNECTIONS", "100"))
+
+# Le sessioni aiohttp appartengono a un event loop: una serie di sessioni per ogni loop
+_sessions = weakref.WeakKeyDictionary()
+
+
+class Response:
+    """The part of requests.Response used by the callers, read completely."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def get_session(upstream):
+    """Returns the keep-alive session for an upstream in the running event loop."""
+
+    sessions = _sessions.setdefault(asyncio.get_running_loop(), {})
+    session = sessions.get(upstream)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT))
+        sessions[upstream] = session
+    return session
+
+
+async def close():
+    """Closes the sessions of the running event loop."""
+
+    sessions = _sessions.pop(asyncio.get_running_loop(), {})
+    for session in sessions.values():
+        await session.close()
+
+
+async def request(upstream, method, url, idempotent=None, **kwargs):
+    """Sends an HTTP request without blocking the event loop.
+
+    Same timeouts, retries and metrics as http_client.request(); the whole
+    call is timed as the `upstream` stage of the current request.
+    """
+
+    with span(upstream):
+        return await _request(upstream, method, url, idempotent, **kwargs)
+
+
+async def _request(upstream, method, url, idempotent, timeout=None, **kwargs):
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD")
+    connect_timeout, read_timeout = timeout or UPSTREAM_TIMEOUTS.get(upstream, DEFAULT_TIMEOUT)
+    kwargs["timeout"] = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    session = get_session(upstream)
+    attempts = MAX_RETRIES + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as raw_response:
+                response = Response(raw_response.status, await raw_response.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            metrics.increment(f"http.{upstream}.errors")
+            if attempt + 1 >= attempts:
+                raise
+            logging.warning(f"Request to {upstream} failed ({e}), retrying")
+        else:
+            metrics.observe(f"http.{upstream}.latency", time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUS_CODES or attempt + 1 >= attempts:
+                return response
+            logging.warning(f"Request to {upstream} returned {response.status_code}, retrying")
+        metrics.increment(f"http.{upstream}.retries")
+        await asyncio.sleep(_backoff(attempt))
+
+
+async def get(upstream, url, **kwargs):
+    return await request(upstream, "GET", url, **kwargs)
+
+
+async def post(upstream, url, **kwargs):
+    return await request(upstream, "POST", url, **kwargs)
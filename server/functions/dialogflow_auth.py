@@ -0,0 +1,89 @@
+import datetime
+import logging
+import threading
+import time
+
+from google.auth.transport.requests import Request
+
+import http_client
+import metrics
+
+# Il token viene rinnovato in background quando mancano meno di
+# BACKGROUND_REFRESH_MARGIN secondi alla scadenza, e in modo bloccante
+# solo quando ne mancano meno di BLOCKING_REFRESH_MARGIN.
+BACKGROUND_REFRESH_MARGIN = 600
+BLOCKING_REFRESH_MARGIN = 60
+
+
+def _pooled_request():
+    # Il rinnovo del token riusa la connessione keep-alive verso oauth2.googleapis.com
+    return Request(session=http_client.get_session("google_oauth"))
+
+
+class DialogflowTokenManager:
+    """Keeps a Dialogflow CX access token in memory and refreshes it before it expires."""
+
+    def __init__(self, credentials, background_margin=BACKGROUND_REFRESH_MARGIN,
+                 blocking_margin=BLOCKING_REFRESH_MARGIN, request_factory=_pooled_request):
+        self._credentials = credentials
+        self._background_margin = background_margin
+        self._blocking_margin = blocking_margin
+        self._request_factory = request_factory
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def _seconds_left(self):
+        token = self._credentials.token
+        expiry = self._credentials.expiry
+        if not token or expiry is None:
+            return 0
+        # google-auth usa datetime UTC "naive" per expiry
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds()
+
+    def _refresh(self, margin):
+        # Un solo rinnovo alla volta: chi arriva dopo ricontrolla la scadenza
+        with self._refresh_lock:
+            if self._seconds_left() > margin:
+                return
+            start = time.perf_counter()
+            try:
+                self._credentials.refresh(self._request_factory())
+            except Exception:
+                metrics.increment("dialogflow_token.refresh_errors")
+                raise
+            finally:
+                metrics.observe("dialogflow_token.refresh_latency", time.perf_counter() - start)
+            metrics.increment("dialogflow_token.refreshes")
+
+    def _background_refresh(self):
+        try:
+            self._refresh(self._background_margin)
+        except Exception as e:
+            logging.warning(f"Background refresh of Dialogflow token failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get_token(self):
+        """Returns a valid access token, refreshing it only when close to expiry."""
+
+        seconds_left = self._seconds_left()
+        if seconds_left > self._background_margin:
+            metrics.increment("dialogflow_token.cache_hits")
+            return self._credentials.token
+
+        if seconds_left > self._blocking_margin:
+            # Token ancora valido: lo usiamo subito e lo rinnoviamo in background
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+            metrics.increment("dialogflow_token.cache_hits")
+            return self._credentials.token
+
+        metrics.increment("dialogflow_token.blocking_waits")
+        self._refresh(self._blocking_margin)
+        return self._credentials.token
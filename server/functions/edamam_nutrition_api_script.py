@@ -1,6 +1,80 @@
-import requests
+import contextvars
+import functools
 import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
+import http_client
+from nutrient_index import NutrientIndex
+from ttl_cache import MISSING, SQLiteCacheTier, TTLCache
+from upstream_guard import OVERLOAD_MESSAGE, UpstreamOverloaded, guarded
+
+EDAMAM_API_URL = os.environ.get("EDAMAM_API_URL", "https://api.edamam.com")
+
+# Cache dei risultati: durata (secondi) per i risultati trovati e per quelli "Unknown"
+NUTRITION_CACHE_SIZE = int(os.environ.get("FOODMATE_NUTRITION_CACHE_SIZE", "2048"))
+NUTRITION_CACHE_TTL = 7 * 24 * 60 * 60
+NUTRITION_NEGATIVE_CACHE_TTL = 6 * 60 * 60
+# Percorso del file SQLite per la cache persistente (opzionale)
+NUTRITION_CACHE_DB = os.environ.get("FOODMATE_NUTRITION_CACHE_DB")
+
+nutrition_cache = TTLCache(
+    "nutrition_cache",
+    maxsize=NUTRITION_CACHE_SIZE,
+    ttl=NUTRITION_CACHE_TTL,
+    persistent=SQLiteCacheTier(NUTRITION_CACHE_DB, "nutrition") if NUTRITION_CACHE_DB else None,
+)
+# I risultati di nutrition-details non hanno avvertenze né kcal per nutriente:
+# restano in una cache separata, usata solo dalle analisi di più ingredienti
+nutrition_details_cache = TTLCache(
+    "nutrition_details_cache",
+    maxsize=NUTRITION_CACHE_SIZE,
+    ttl=NUTRITION_CACHE_TTL,
+    persistent=SQLiteCacheTier(NUTRITION_CACHE_DB, "nutrition_details") if NUTRITION_CACHE_DB else None,
+)
+
+# Indice locale degli alimenti comuni, consultato prima di Edamam (FOODMATE_NUTRIENT_INDEX=0 lo disattiva);
+# con FOODMATE_NUTRIENT_WRITEBACK=1 i risultati di Edamam vi vengono aggiunti
+NUTRIENT_INDEX_ENABLED = os.environ.get("FOODMATE_NUTRIENT_INDEX", "1") == "1"
+NUTRIENT_INDEX_WRITEBACK = os.environ.get("FOODMATE_NUTRIENT_WRITEBACK") == "1"
+
+# Analisi di più ingredienti: numero massimo di richieste parallele e
+# numero di ingredienti da cui conviene una sola POST a nutrition-details
+BATCH_MAX_WORKERS = int(os.environ.get("FOODMATE_NUTRITION_BATCH_WORKERS", "8"))
+BATCH_DETAILS_THRESHOLD = int(os.environ.get("FOODMATE_NUTRITION_DETAILS_THRESHOLD", "12"))
+
+# Nutrienti riportati per ogni ingrediente e sommati nei totali
+NUTRIENT_FIELDS = {
+    "FAT": "FAT",
+    "Carbohydrates (net)": "CHOCDF.net",
+    "Protein": "PROCNT",
+    "Sodium (NA)": "NA",
+}
+
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS)
+
+# Risposte mostrate quando Edamam non è disponibile
+STALE_NOTE = "(Edamam.com is not reachable right now: these values were saved earlier and may be out of date.)\n"
+NUTRITION_ERROR_MESSAGE = "Sorry, the nutrition analysis is not available right now. Please try again later."
+
+# Quantità che precedono un'unità di misura: "2", "1.5", "1/2"
+_QUANTITY = re.compile(r"^\d+([./]\d+)?$")
+# Grafie alternative delle unità di misura
+UNIT_ALIASES = {
+    "g": "g", "gr": "g", "grs": "g", "gram": "g", "grams": "g", "gramme": "g", "grammes": "g",
+    "kg": "kg", "kgs": "kg", "kilo": "kg", "kilos": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg", "milligram": "mg", "milligrams": "mg",
+    "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "l": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "cup": "cup", "cups": "cup",
+}
+
+@functools.lru_cache(maxsize=None)
 def load_api_key(file_path):
     """Loads the Edamam Nutrition API Id and key from a JSON file."""
 
@@ -12,102 +86,361 @@ def load_api_key(file_path):
         raise ValueError(f"Missing 'Application_ID' or 'Application_Key' in {file_path}.")
     return app_id, api_key
 
-def get_nutrition_data(ingredient):
+@functools.lru_cache(maxsize=None)
+def get_nutrient_index():
+    # Condiviso da tutte le richieste; il database viene aperto alla prima ricerca
+    return NutrientIndex()
+
+def lookup_local(key):
+    """Returns the nutrition fields of a normalized ingredient from the local index, or None."""
+
+    if not NUTRIENT_INDEX_ENABLED:
+        return None
+    return get_nutrient_index().lookup(key)
+
+def learn_locally(key, filtered_data):
+    """Writes an Edamam result back into the local index, if enabled."""
+
+    if NUTRIENT_INDEX_WRITEBACK and filtered_data.get("food_name") not in (None, "Unknown"):
+        get_nutrient_index().learn(key, filtered_data)
+
+def ingredient_text(ingredient):
+    """Returns the ingredient query as the user wrote it (Dialogflow may pass a list of words)."""
+
+    if isinstance(ingredient, (list, tuple)):
+        ingredient = " ".join(str(item) for item in ingredient)
+    return " ".join(str(ingredient).split())
+
+def normalize_ingredient(ingredient):
+    """Normalizes case, whitespace and unit spelling of an ingredient query.
+
+    The result is the cache key; only a unit right after a quantity is
+    respelled ("2 pounds flour" -> "2 lb flour", but "pound cake" stays).
+    """
+
+    text = ingredient_text(ingredient).lower()
+    # Separa quantità e unità attaccate ("100g" -> "100 g")
+    text = re.sub(r"(\d)([a-z])", r"\1 \2", text)
+    text = text.replace(",", " , ")
+    tokens = text.split()
+    for index in range(1, len(tokens)):
+        if _QUANTITY.match(tokens[index - 1]):
+            tokens[index] = UNIT_ALIASES.get(tokens[index], tokens[index])
+    return " ".join(tokens).replace(" , ", ", ")
+
+@guarded("edamam", key=normalize_ingredient)
+def fetch_nutrition_data(ingredient):
+    """Queries the Edamam nutrition-data API and returns the parsed fields.
+
+    Returns an error dictionary if the API does not answer with status 200.
+    """
+
+    app_id, app_key = load_api_key("edamam_nutritionAPI_key.json")
+    url = f'{EDAMAM_API_URL}/api/nutrition-data?app_id={app_id}&app_key={app_key}&nutrition-type=logging&ingr={ingredient}'
+
+    headers = {
+        'accept': 'application/json'
+    }
+
+    response = http_client.get("edamam", url, headers=headers)
+
+    if response.status_code != 200:
+        return {"success": False, "error": f"Error: {response.status_code}"}
+
+    data = response.json()
+    # Selezioniamo solo i campi desiderati con quantitativo e unità di misura
+    filtered_data = {
+        "food_name": data["ingredients"][0]["parsed"][0]["foodMatch"] if data.get("ingredients") and data["ingredients"][0].get("parsed") else "Unknown",
+        "cautions": data.get("cautions", []),
+        "calories": {
+            "quantity": data["calories"],
+            "unit": "kcal"
+        } if data.get("calories") else None,
+        "FAT": {
+            "quantity": data["totalNutrients"]["FAT"]["quantity"],
+            "unit": data["totalNutrients"]["FAT"]["unit"]
+        } if data.get("totalNutrients") and data["totalNutrients"].get("FAT") else None,
+        "Carbohydrates (net)": {
+            "quantity": data["totalNutrients"]["CHOCDF.net"]["quantity"],
+            "unit": data["totalNutrients"]["CHOCDF.net"]["unit"]
+        } if data.get("totalNutrients") and data["totalNutrients"].get("CHOCDF.net") else None,
+        "Protein": {
+            "quantity": data["totalNutrients"]["PROCNT"]["quantity"],
+            "unit": data["totalNutrients"]["PROCNT"]["unit"]
+        } if data.get("totalNutrients") and data["totalNutrients"].get("PROCNT") else None,
+        "Sodium (NA)": {
+            "quantity": data["totalNutrients"]["NA"]["quantity"],
+            "unit": data["totalNutrients"]["NA"]["unit"]
+        } if data.get("totalNutrients") and data["totalNutrients"].get("NA") else None,
+        "totalNutrientsKCal": data.get("totalNutrientsKCal", {})
+    }
+    return filtered_data
+
+def format_nutrition_data(filtered_data):
+    """Renders the parsed nutrition fields as the chatbot reply text."""
+
+    if filtered_data["food_name"] == "Unknown":
+        out = (f"Sorry, the database of Edamam.com "
+               f"did not find what you were looking for.")
+        return out
+
+    formatted_text = STALE_NOTE if filtered_data.get("stale") else ""
+    formatted_text += f"Food Name Matched: {filtered_data['food_name']}\n"
+
+    if filtered_data["cautions"]:
+        formatted_text += "Cautions: " + ", ".join(filtered_data["cautions"]) + "\n"
+    else:
+        formatted_text += "Cautions: None\n"
+
+    if filtered_data["calories"]:
+        formatted_text += f"Calories: {filtered_data['calories']['quantity']} {filtered_data['calories']['unit']}\n"
+    else:
+        formatted_text += "Calories: Not available\n"
+
+    if filtered_data["FAT"]:
+        formatted_text += f"Fat: {filtered_data['FAT']['quantity']} {filtered_data['FAT']['unit']}\n"
+    else:
+        formatted_text += "Fat: Not available\n"
+
+    if filtered_data["Carbohydrates (net)"]:
+        formatted_text += f"Carbohydrates (net): {filtered_data['Carbohydrates (net)']['quantity']} {filtered_data['Carbohydrates (net)']['unit']}\n"
+    else:
+        formatted_text += "Carbohydrates (net): Not available\n"
+
+    if filtered_data["Protein"]:
+        formatted_text += f"Protein: {filtered_data['Protein']['quantity']} {filtered_data['Protein']['unit']}\n"
+    else:
+        formatted_text += "Protein: Not available\n"
+
+    if filtered_data["Sodium (NA)"]:
+        formatted_text += f"Sodium (NA): {filtered_data['Sodium (NA)']['quantity']} {filtered_data['Sodium (NA)']['unit']}\n"
+    else:
+        formatted_text += "Sodium (NA): Not available\n"
+
+    nutrient_mapping = {
+        "ENERC_KCAL": "Total Kcal",
+        "PROCNT_KCAL": "Kcal from protein",
+        "FAT_KCAL": "Kcal from fat",
+        "CHOCDF_KCAL": "Kcal from carbohydrates"
+    }
+
+    formatted_text += "------------------\n"
+    formatted_text += "Total Nutrients KCal.\n"
+    for nutrient, value in filtered_data["totalNutrientsKCal"].items():
+        nutrient_name = nutrient_mapping.get(nutrient, nutrient)
+        formatted_text += f" {nutrient_name}: {value['quantity']} {value['unit']}\n"
+
+    return formatted_text
+
+def lookup_nutrition_data(ingredient):
+    """Returns the parsed nutrition fields for an ingredient.
+
+    Common foods are resolved by the local nutrient index; the others are
+    asked to Edamam, through the cache. "Unknown" matches are cached too, for a shorter time. If Edamam fails
+    or its circuit is open, the last cached result is returned even if
+    expired, marked with "stale": True; without one, an error dictionary is
+    returned (or UpstreamOverloaded raised).
+    """
+
+    key = normalize_ingredient(ingredient)
+    filtered_data = nutrition_cache.get(key)
+    if filtered_data is not MISSING:
+        return filtered_data
+    filtered_data = lookup_local(key)
+    if filtered_data is not None:
+        return filtered_data
+    return fetch_and_cache_nutrition_data(key, ingredient_text(ingredient))
+
+def fetch_and_cache_nutrition_data(key, text):
+    """Asks Edamam about an ingredient that is neither cached nor in the local index.
+
+    `text` is sent as the query, as the user wrote it; the result is cached
+    under the normalized `key`, or the expired one is used instead, as
+    described in lookup_nutrition_data().
+    """
 
     try:
-        app_id, app_key = load_api_key("edamam_nutritionAPI_key.json")
-        url = f'https://api.edamam.com/api/nutrition-data?app_id={app_id}&app_key={app_key}&nutrition-type=logging&ingr={ingredient}'
-        
-        headers = {
-            'accept': 'application/json'
+        filtered_data = fetch_nutrition_data(text)
+    except UpstreamOverloaded:
+        stale_data = nutrition_cache.get_stale(key)
+        if stale_data is MISSING:
+            raise
+        return dict(stale_data, stale=True)
+    if "food_name" not in filtered_data:
+        stale_data = nutrition_cache.get_stale(key)
+        return filtered_data if stale_data is MISSING else dict(stale_data, stale=True)
+
+    ttl = NUTRITION_NEGATIVE_CACHE_TTL if filtered_data["food_name"] == "Unknown" else None
+    nutrition_cache.set(key, filtered_data, ttl=ttl)
+    learn_locally(key, filtered_data)
+    return filtered_data
+
+@guarded("edamam", key=lambda ingredients: tuple(ingredients))
+def fetch_nutrition_details(ingredients):
+    """Analyzes several ingredients with one POST to the Edamam nutrition-details API.
+
+    Returns the parsed fields of each ingredient, in input order, or an
+    error dictionary if the API does not answer with status 200.
+    """
+
+    app_id, app_key = load_api_key("edamam_nutritionAPI_key.json")
+    url = f'{EDAMAM_API_URL}/api/nutrition-details?app_id={app_id}&app_key={app_key}'
+
+    headers = {
+        'accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+
+    response = http_client.post("edamam", url, headers=headers, json={"ingr": ingredients}, idempotent=True)
+    if response.status_code != 200:
+        return {"success": False, "error": f"Error: {response.status_code}"}
+
+    items = []
+    for ingredient in response.json().get("ingredients", []):
+        parsed = ingredient.get("parsed") or [{}]
+        nutrients = parsed[0].get("nutrients", {})
+        filtered_data = {
+            "food_name": parsed[0].get("foodMatch", "Unknown"),
+            "cautions": [],
+            "calories": {
+                "quantity": nutrients["ENERC_KCAL"]["quantity"],
+                "unit": "kcal"
+            } if nutrients.get("ENERC_KCAL") else None,
+            "totalNutrientsKCal": {}
         }
+        for field, code in NUTRIENT_FIELDS.items():
+            filtered_data[field] = {
+                "quantity": nutrients[code]["quantity"],
+                "unit": nutrients[code]["unit"]
+            } if nutrients.get(code) else None
+        items.append(filtered_data)
+    return items
 
-        response = requests.get(url, headers=headers)
-    
-        if response.status_code == 200:
-            data = response.json()
-            # Selezioniamo solo i campi desiderati con quantitativo e unità di misura
-            filtered_data = {
-                "food_name": data["ingredients"][0]["parsed"][0]["foodMatch"] if data.get("ingredients") and data["ingredients"][0].get("parsed") else "Unknown",
-                "cautions": data.get("cautions", []),
-                "calories": {
-                    "quantity": data["calories"],
-                    "unit": "kcal"
-                } if data.get("calories") else None,
-                "FAT": {
-                    "quantity": data["totalNutrients"]["FAT"]["quantity"],
-                    "unit": data["totalNutrients"]["FAT"]["unit"]
-                } if data.get("totalNutrients") and data["totalNutrients"].get("FAT") else None,
-                "Carbohydrates (net)": {
-                    "quantity": data["totalNutrients"]["CHOCDF.net"]["quantity"],
-                    "unit": data["totalNutrients"]["CHOCDF.net"]["unit"]
-                } if data.get("totalNutrients") and data["totalNutrients"].get("CHOCDF.net") else None,
-                "Protein": {
-                    "quantity": data["totalNutrients"]["PROCNT"]["quantity"],
-                    "unit": data["totalNutrients"]["PROCNT"]["unit"]
-                } if data.get("totalNutrients") and data["totalNutrients"].get("PROCNT") else None,
-                "Sodium (NA)": {
-                    "quantity": data["totalNutrients"]["NA"]["quantity"],
-                    "unit": data["totalNutrients"]["NA"]["unit"]
-                } if data.get("totalNutrients") and data["totalNutrients"].get("NA") else None,
-                "totalNutrientsKCal": data.get("totalNutrientsKCal", {})
-            }
-            
-            formatted_text = f"Food Name Matched: {filtered_data['food_name']}\n"
-    
-            if filtered_data["cautions"]:
-                formatted_text += "Cautions: " + ", ".join(filtered_data["cautions"]) + "\n"
-            else:
-                formatted_text += "Cautions: None\n"
+def _fetch_in_batch(key, text):
+    # Un ingrediente senza risposta non fa fallire l'intera analisi
+    try:
+        return fetch_and_cache_nutrition_data(key, text)
+    except UpstreamOverloaded as e:
+        return {"success": False, "error": str(e)}
 
-            if filtered_data["calories"]:
-                formatted_text += f"Calories: {filtered_data['calories']['quantity']} {filtered_data['calories']['unit']}\n"
-            else:
-                formatted_text += "Calories: Not available\n"
+def lookup_nutrition_batch(ingredients):
+    """Returns the parsed nutrition fields of every ingredient, in input order.
 
-            if filtered_data["FAT"]:
-                formatted_text += f"Fat: {filtered_data['FAT']['quantity']} {filtered_data['FAT']['unit']}\n"
-            else:
-                formatted_text += "Fat: Not available\n"
+    Cached ingredients and foods of the local nutrient index are served
+    locally. The others are looked up in
+    parallel on a bounded thread pool, or with a single nutrition-details
+    request when there are at least BATCH_DETAILS_THRESHOLD of them. An
+    ingredient that cannot be looked up gets an error dictionary.
 
-            if filtered_data["Carbohydrates (net)"]:
-                formatted_text += f"Carbohydrates (net): {filtered_data['Carbohydrates (net)']['quantity']} {filtered_data['Carbohydrates (net)']['unit']}\n"
-            else:
-                formatted_text += "Carbohydrates (net): Not available\n"
+    The nutrition-details results lack cautions and the kcal breakdown, so
+    they go to nutrition_details_cache and never answer single lookups.
+    """
 
-            if filtered_data["Protein"]:
-                formatted_text += f"Protein: {filtered_data['Protein']['quantity']} {filtered_data['Protein']['unit']}\n"
-            else:
-                formatted_text += "Protein: Not available\n"
+    keys = [normalize_ingredient(ingredient) for ingredient in ingredients]
+    # A Edamam va il testo originale della prima occorrenza di ogni chiave
+    texts = {}
+    for key, ingredient in zip(keys, ingredients):
+        texts.setdefault(key, ingredient_text(ingredient))
+    results = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        filtered_data = nutrition_cache.get(key)
+        if filtered_data is MISSING:
+            filtered_data = nutrition_details_cache.get(key)
+        if filtered_data is MISSING:
+            filtered_data = lookup_local(key)
+        if filtered_data is None:
+            missing.append(key)
+        else:
+            results[key] = filtered_data
 
-            if filtered_data["Sodium (NA)"]:
-                formatted_text += f"Sodium (NA): {filtered_data['Sodium (NA)']['quantity']} {filtered_data['Sodium (NA)']['unit']}\n"
-            else:
-                formatted_text += "Sodium (NA): Not available\n"
-
-            nutrient_mapping = {
-                "ENERC_KCAL": "Total Kcal",
-                "PROCNT_KCAL": "Kcal from protein",
-                "FAT_KCAL": "Kcal from fat",
-                "CHOCDF_KCAL": "Kcal from carbohydrates"
-            }
-
-            formatted_text += "------------------\n"
-            formatted_text += "Total Nutrients KCal.\n"
-            for nutrient, value in filtered_data["totalNutrientsKCal"].items():
-                nutrient_name = nutrient_mapping.get(nutrient, nutrient)
-                formatted_text += f" {nutrient_name}: {value['quantity']} {value['unit']}\n"
-
-            if filtered_data["food_name"] == "Unknown":
-                out = (f"Sorry, the database of Edamam.com "
-                       f"did not find what you were looking for.")
-                return out
-            else:
-                return formatted_text
-        
+    if len(missing) >= BATCH_DETAILS_THRESHOLD:
+        try:
+            details = fetch_nutrition_details([texts[key] for key in missing])
+        except UpstreamOverloaded:
+            # Si ripiega sulle ricerche singole, che possono usare i risultati scaduti
+            details = None
+        if isinstance(details, list) and len(details) == len(missing):
+            for key, filtered_data in zip(missing, details):
+                ttl = NUTRITION_NEGATIVE_CACHE_TTL if filtered_data["food_name"] == "Unknown" else None
+                nutrition_details_cache.set(key, filtered_data, ttl=ttl)
+                learn_locally(key, filtered_data)
+                results[key] = filtered_data
+            missing = []
+
+    # Ogni ricerca gira in una copia del contesto della richiesta (per le metriche per fase)
+    context = contextvars.copy_context()
+    lookups = _batch_executor.map(lambda key: context.copy().run(_fetch_in_batch, key, texts[key]), missing)
+    for key, filtered_data in zip(missing, lookups):
+        results[key] = filtered_data
+
+    return [results[key] for key in keys]
+
+def aggregate_nutrition(items):
+    """Sums calories and nutrients over the ingredients that were matched."""
+
+    totals = {"calories": {"quantity": 0.0, "unit": "kcal"}}
+    for field in NUTRIENT_FIELDS:
+        totals[field] = None
+    for filtered_data in items:
+        if "food_name" not in filtered_data or filtered_data["food_name"] == "Unknown":
+            continue
+        if filtered_data["calories"]:
+            totals["calories"]["quantity"] += filtered_data["calories"]["quantity"]
+        for field in NUTRIENT_FIELDS:
+            value = filtered_data.get(field)
+            if not value:
+                continue
+            if totals[field] is None:
+                totals[field] = {"quantity": 0.0, "unit": value["unit"]}
+            totals[field]["quantity"] += value["quantity"]
+    return totals
+
+def format_nutrition_totals(totals):
+    """Renders the aggregated nutrition totals as reply text."""
+
+    formatted_text = "Totals:\n"
+    formatted_text += f"Calories: {round(totals['calories']['quantity'], 2)} {totals['calories']['unit']}\n"
+    for field in NUTRIENT_FIELDS:
+        if totals[field]:
+            formatted_text += f"{field}: {round(totals[field]['quantity'], 2)} {totals[field]['unit']}\n"
         else:
-            return {"success": False, "error": f"Error: {response.status_code}"}
-        
+            formatted_text += f"{field}: Not available\n"
+    return formatted_text
+
+def get_nutrition_data_batch(ingredients):
+    """Analyzes several ingredients and returns per-item results plus totals."""
+
+    try:
+        items = lookup_nutrition_batch(ingredients)
+        formatted_text = ""
+        for ingredient, filtered_data in zip(ingredients, items):
+            formatted_text += f"{ingredient}:\n"
+            if "food_name" in filtered_data:
+                formatted_text += format_nutrition_data(filtered_data)
+            else:
+                formatted_text += f"{NUTRITION_ERROR_MESSAGE}\n"
+            formatted_text += "\n"
+        formatted_text += format_nutrition_totals(aggregate_nutrition(items))
+        return formatted_text
+
+    except UpstreamOverloaded:
+        return OVERLOAD_MESSAGE
+    except Exception as e:  # Catch any unexpected errors
+        print(f"Error using Edamam Nutrition API: {e}")
+        return NUTRITION_ERROR_MESSAGE
+
+def get_nutrition_data(ingredient):
+
+    try:
+        filtered_data = lookup_nutrition_data(ingredient)
+        if "food_name" not in filtered_data:
+            print(f"Error using Edamam Nutrition API: {filtered_data['error']}")
+            return NUTRITION_ERROR_MESSAGE
+        return format_nutrition_data(filtered_data)
+
+    except UpstreamOverloaded:
+        return OVERLOAD_MESSAGE
     except Exception as e:  # Catch any unexpected errors
         print(f"Error using Edamam Nutrition API: {e}")
-        return e
\ No newline at end of file
+        return NUTRITION_ERROR_MESSAGE
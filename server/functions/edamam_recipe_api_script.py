@@ -1,6 +1,42 @@
-import requests
+import functools
 import json
+import logging
+import os
+import threading
 
+import http_client
+import metrics
+from recipe_index import RecipeIndex
+from ttl_cache import MISSING, TTLCache
+from upstream_guard import OVERLOAD_MESSAGE, UpstreamOverloaded, guarded
+
+EDAMAM_API_URL = os.environ.get("EDAMAM_API_URL", "https://api.edamam.com")
+
+# Numero di ricette mostrate per ogni pagina di risultati
+RECIPES_PER_PAGE = 4
+# Cache delle ricerche: numero massimo di query in memoria e durata (secondi)
+RECIPE_CACHE_SIZE = int(os.environ.get("FOODMATE_RECIPE_CACHE_SIZE", "256"))
+RECIPE_CACHE_TTL = int(os.environ.get("FOODMATE_RECIPE_CACHE_TTL", str(6 * 60 * 60)))
+# Le ricette scaricate vengono indicizzate per ingrediente (FOODMATE_RECIPE_INDEX=0 lo disattiva)
+RECIPE_INDEX_ENABLED = os.environ.get("FOODMATE_RECIPE_INDEX", "1") == "1"
+# Ricette dalla lista della spesa: elementi della lista che una ricetta deve usare e
+# numero di elementi cercati su Edamam quando le ricette locali non bastano
+LIST_RECIPES_MIN_MATCHED = int(os.environ.get("FOODMATE_LIST_RECIPES_MIN_MATCHED", "2"))
+LIST_RECIPES_QUERY_ITEMS = int(os.environ.get("FOODMATE_LIST_RECIPES_QUERY_ITEMS", "3"))
+
+# Per ogni query: le ricette già scaricate e il cursore della pagina successiva
+recipe_cache = TTLCache("recipe_cache", maxsize=RECIPE_CACHE_SIZE, ttl=RECIPE_CACHE_TTL)
+_prefetching = set()
+
+# Risposte mostrate quando Edamam non è disponibile
+STALE_NOTE = "(Edamam.com is not reachable right now: these recipes were saved earlier and may be out of date.)\n\n"
+RECIPE_ERROR_MESSAGE = "Sorry, the recipe search is not available right now. Please try again later."
+NO_LIST_RECIPES_MESSAGE = "I couldn't find recipes that use the items in your grocery list."
+NO_RECIPES_MESSAGE = "I couldn't find recipes for that."
+NO_MORE_RECIPES_MESSAGE = "There are no more recipes for that search."
+_prefetch_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
 def load_api_key(file_path):
     """Loads the Edamam Recipe API Id and key from a JSON file."""
 
@@ -12,68 +48,231 @@ def load_api_key(file_path):
         raise ValueError(f"Missing 'Application_ID' or 'Application_Key' in {file_path}.")
     return app_id, api_key
 
+@functools.lru_cache(maxsize=None)
+def get_recipe_index():
+    # Condiviso da tutte le richieste; il database viene caricato al primo utilizzo
+    return RecipeIndex()
 
-def get_recipe_data(ingredient):
+def index_recipes(recipes):
+    """Adds downloaded recipes to the local index, if enabled; never fails the search."""
 
+    if not RECIPE_INDEX_ENABLED:
+        return
     try:
+        get_recipe_index().add(recipes)
+    except Exception as e:
+        logging.warning(f"Indexing of recipes failed: {e}")
+
+
+def normalize_query(ingredient):
+    """Normalizes a recipe search query so equivalent searches share a cache entry."""
+
+    if isinstance(ingredient, (list, tuple)):
+        ingredient = " ".join(str(item) for item in ingredient)
+    return " ".join(str(ingredient).lower().split())
+
+def parse_recipe(recipe_data):
+    """Selects the fields shown to the user from an Edamam recipe."""
+
+    # Controllo se il valore delle calorie è un dizionario
+    if isinstance(recipe_data.get("calories"), dict):
+        calories_quantity = recipe_data["calories"].get("quantity", "N/A")
+        calories_unit = recipe_data["calories"].get("unit", "")
+    else:
+        calories_quantity = recipe_data.get("calories", "N/A")
+        calories_unit = ""
+
+    # Seleziono solo i campi desiderati con quantitativo e unità di misura
+    return {
+        "name": recipe_data.get("label", "Unknown"),
+        "image_url": recipe_data.get("image"),
+        "calories": {
+            "quantity": calories_quantity,
+            "unit": calories_unit
+        },
+        "ingredients": recipe_data.get("ingredientLines", []),
+        # Alimenti riconosciuti da Edamam, usati dall'indice locale
+        "foods": [ingredient["food"] for ingredient in recipe_data.get("ingredients", []) if ingredient.get("food")],
+        "uri": recipe_data.get("uri"),
+        "recipe_url": recipe_data.get("url", "N/A")
+    }
+
+@guarded("edamam")
+def fetch_recipe_page(url):
+    """Downloads one page of Edamam recipe hits.
+
+    Returns (recipes, next_url), or an error dictionary if the API does not
+    answer with status 200.
+    """
+
+    headers = {
+        'accept': 'application/json'
+    }
+
+    response = http_client.get("edamam", url, headers=headers)
+    if response.status_code != 200:
+        return {"success": False, "error": f"Error: {response.status_code}"}
+
+    data = response.json()
+    recipes = [parse_recipe(hit["recipe"]) for hit in data.get("hits", [])]
+    next_url = data.get("_links", {}).get("next", {}).get("href")
+    return recipes, next_url
+
+def format_recipes(recipes_info, first_number=1, matches=None):
+    """Renders a list of parsed recipes as the chatbot reply text.
+
+    `matches`, if given, lists for every recipe the grocery list items it uses.
+    """
+
+    formatted_text = ""
+    for i, recipe_info in enumerate(recipes_info, first_number):
+        formatted_text += f"Recipe {i}:\n"
+        formatted_text += f"Name: {recipe_info['name']}\n"
+        if matches and matches[i - first_number]:
+            formatted_text += f"From your list: {', '.join(matches[i - first_number])}\n"
+        # formatted_text += f"Image URL: {recipe_info['image_url']}\n"
+        formatted_text += f"Calories: {recipe_info['calories']['quantity']} {recipe_info['calories']['unit']}\n"
+        formatted_text += "Ingredients:\n"
+        for ingredient in recipe_info["ingredients"]:
+            formatted_text += f"- {ingredient}\n"
+        formatted_text += f"Recipe URL: {recipe_info['recipe_url']}\n"
+        formatted_text += "\n"
+    return formatted_text
+
+def _extend_with_next_page(key, entry):
+    # Scarica la pagina successiva e la aggiunge alla voce in cache
+    page = fetch_recipe_page(entry["next_url"])
+    if isinstance(page, dict):
+        return page
+    recipes, next_url = page
+    index_recipes(recipes)
+    entry = {"recipes": entry["recipes"] + recipes, "next_url": next_url}
+    recipe_cache.set(key, entry)
+    return entry
+
+def _prefetch_next_page(key, entry):
+    try:
+        _extend_with_next_page(key, entry)
+    except Exception as e:
+        logging.warning(f"Prefetch of recipes for '{key}' failed: {e}")
+    finally:
+        with _prefetch_lock:
+            _prefetching.discard(key)
+
+def _start_prefetch(key, entry):
+    with _prefetch_lock:
+        if key in _prefetching:
+            return
+        _prefetching.add(key)
+    threading.Thread(target=_prefetch_next_page, args=(key, entry), daemon=True).start()
+
+def lookup_recipes(ingredient, page=1):
+    """Returns the parsed recipes of a result page, using the cache.
+
+    Missing pages are downloaded following the Edamam next-page cursor; when
+    the requested page reaches the end of the cached hits, the following
+    upstream page is prefetched in the background. Returns an error
+    dictionary if Edamam could not be queried.
+    """
+
+    key = normalize_query(ingredient)
+    entry = recipe_cache.get(key)
+    if entry is MISSING:
         app_id, app_key = load_api_key("edamam_recipeAPI_key.json")
-        
-        url = f'https://api.edamam.com/api/recipes/v2?type=public&q={ingredient}&app_id={app_id}&app_key={app_key}'
-        
-        headers = {
-            'accept': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
-    
-        if response.status_code == 200:
-            data = response.json()
-
-            recipes_info = []
-            for i, recipe in enumerate(data.get("hits", [])[:4], 1):
-                recipe_data = recipe["recipe"]
-
-                # Controllo se il valore delle calorie è un dizionario
-                if isinstance(recipe_data.get("calories"), dict):
-                    calories_quantity = recipe_data["calories"].get("quantity", "N/A")
-                    calories_unit = recipe_data["calories"].get("unit", "")
-                else:
-                    calories_quantity = recipe_data.get("calories", "N/A")
-                    calories_unit = ""
-
-                # Seleziono solo i campi desiderati con quantitativo e unità di misura
-                recipe_info = {
-                    "name": recipe_data.get("label", "Unknown"),
-                    "image_url": recipe_data.get("image"),
-                    "calories": {
-                        "quantity": calories_quantity,
-                        "unit": calories_unit
-                    },
-                    "ingredients": recipe_data.get("ingredientLines", []),
-                    "recipe_url": recipe_data.get("url", "N/A")
-                }
-
-                recipes_info.append(recipe_info)
-
-            formatted_text = ""
-            for i, recipe_info in enumerate(recipes_info, 1):
-                formatted_text += f"Recipe {i}:\n"
-                formatted_text += f"Name: {recipe_info['name']}\n"
-                # formatted_text += f"Image URL: {recipe_info['image_url']}\n"
-                formatted_text += f"Calories: {recipe_info['calories']['quantity']} {recipe_info['calories']['unit']}\n"
-                formatted_text += "Ingredients:\n"
-                for ingredient in recipe_info["ingredients"]:
-                    formatted_text += f"- {ingredient}\n"
-                formatted_text += f"Recipe URL: {recipe_info['recipe_url']}\n"
-                formatted_text += "\n"
-
-            return formatted_text
-        else:
-            return {"success": False, "error": f"Error: {response.status_code}"}
-        
+        url = f'{EDAMAM_API_URL}/api/recipes/v2?type=public&q={key}&app_id={app_id}&app_key={app_key}'
+        first_page = fetch_recipe_page(url)
+        if isinstance(first_page, dict):
+            return first_page
+        index_recipes(first_page[0])
+        entry = {"recipes": first_page[0], "next_url": first_page[1]}
+        recipe_cache.set(key, entry)
+
+    start = (page - 1) * RECIPES_PER_PAGE
+    end = start + RECIPES_PER_PAGE
+    while len(entry["recipes"]) < end and entry["next_url"]:
+        entry = _extend_with_next_page(key, entry)
+        if isinstance(entry, dict) and "recipes" not in entry:
+            return entry
+
+    if entry["next_url"] and len(entry["recipes"]) < end + RECIPES_PER_PAGE:
+        _start_prefetch(key, entry)
+
+    return entry["recipes"][start:end]
+
+def lookup_stale_recipes(ingredient, page=1):
+    """Returns the recipes of a page from the cache even if expired, or None."""
+
+    entry = recipe_cache.get_stale(normalize_query(ingredient))
+    if entry is MISSING:
+        return None
+    start = (page - 1) * RECIPES_PER_PAGE
+    return entry["recipes"][start:start + RECIPES_PER_PAGE] or None
+
+def format_recipe_page(recipes_info, first_number):
+    # Una pagina vuota (ricerca senza risultati o oltre l'ultima pagina) non deve dare una risposta vuota
+    if not recipes_info:
+        return NO_RECIPES_MESSAGE if first_number == 1 else NO_MORE_RECIPES_MESSAGE
+    return format_recipes(recipes_info, first_number)
+
+def get_recipe_data(ingredient, page=1):
+
+    first_number = (page - 1) * RECIPES_PER_PAGE + 1
+    try:
+        recipes_info = lookup_recipes(ingredient, page)
+        if isinstance(recipes_info, dict):
+            print(f"Error using Edamam Recipe API: {recipes_info['error']}")
+            stale_recipes = lookup_stale_recipes(ingredient, page)
+            if stale_recipes is None:
+                return RECIPE_ERROR_MESSAGE
+            return STALE_NOTE + format_recipes(stale_recipes, first_number)
+        return format_recipe_page(recipes_info, first_number)
+
+    except UpstreamOverloaded:
+        stale_recipes = lookup_stale_recipes(ingredient, page)
+        if stale_recipes is None:
+            return OVERLOAD_MESSAGE
+        return STALE_NOTE + format_recipes(stale_recipes, first_number)
     except Exception as e:  # Catch any unexpected errors
         print(f"Error using Edamam Recipe API: {e}")
-        return e
+        return RECIPE_ERROR_MESSAGE
+
+def rank_list_recipes(items, min_matched=LIST_RECIPES_MIN_MATCHED):
+    """Returns (recipe, matched items) pairs of stored recipes that use at least min_matched list items."""
+
+    if not RECIPE_INDEX_ENABLED:
+        return []
+    return get_recipe_index().rank(items, RECIPES_PER_PAGE, min(min_matched, len(items)))
+
+def get_recipes_from_list(items):
+    """Suggests recipes that use as many items of a grocery list as possible.
+
+    Recipes already downloaded from Edamam are ranked locally by how many
+    list items they use; Edamam is searched (and the results indexed) only
+    when fewer than a page of stored recipes use enough items.
+    """
+
+    try:
+        ranked = rank_list_recipes(items)
+        if len(ranked) >= RECIPES_PER_PAGE:
+            metrics.increment("recipe_index.local_answers")
+        else:
+            # Copertura locale insufficiente: si cercano ricette con i primi elementi della lista
+            metrics.increment("recipe_index.edamam_fallbacks")
+            found = lookup_recipes(items[:LIST_RECIPES_QUERY_ITEMS])
+            if isinstance(found, dict):
+                print(f"Error using Edamam Recipe API: {found['error']}")
+            elif RECIPE_INDEX_ENABLED:
+                # Meglio ricette che usano un solo elemento che nessuna risposta
+                ranked = rank_list_recipes(items, min_matched=1)
+            else:
+                ranked = [(recipe, []) for recipe in found]
+    except UpstreamOverloaded:
+        if not ranked:
+            return OVERLOAD_MESSAGE
+    except Exception as e:  # Catch any unexpected errors
+        print(f"Error searching recipes for the grocery list: {e}")
+        return RECIPE_ERROR_MESSAGE
 
-# Example usage
-print(get_recipe_data("chicken breast"))
\ No newline at end of file
+    if not ranked:
+        return NO_LIST_RECIPES_MESSAGE
+    return format_recipes([recipe for recipe, _ in ranked], matches=[matched for _, matched in ranked])
@@ -1,6 +1,10 @@
-import google.generativeai as genai
 import json
 
+from instrumentation import span
+from upstream_guard import UpstreamOverloaded, guarded_stream
+
+_model = None
+
 def load_api_key(file_path):
     """Loads the Gemini API key from a JSON file."""
 
@@ -11,36 +15,91 @@ def load_api_key(file_path):
         raise ValueError(f"Missing 'gemini_api_key' key in {file_path}.")
     return api_key
 
-def categorize_grocery_list(grocery_list):
-    """Categorizes a grocery list into supermarket sections using Gemini."""
+def get_model():
+    """Returns the Gemini model, configuring it on first use."""
 
-    try:
-        api_key = load_api_key("gemini-key.json") 
+    global _model
+    if _model is None:
+        # Import rimandato: google.generativeai è pesante e serve solo a questa funzione
+        import google.generativeai as genai
+
+        api_key = load_api_key("gemini-key.json")
         genai.configure(api_key=api_key)
+        # Risposta in righe JSON, una per elemento, lette man mano che arrivano
+        _model = genai.GenerativeModel(generation_config={"response_mime_type": "text/plain"})
+    return _model
+
+def parse_category_line(line):
+    """Parses a line of the streamed answer, {"item": ..., "section": ...}, into (item, section).
+
+    Returns None for lines that are not a complete item/section object.
+    """
+
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or not entry.get("item") or not entry.get("section"):
+        return None
+    return str(entry["item"]).strip(), str(entry["section"]).strip()
+
+@guarded_stream("gemini", key=lambda grocery_list: tuple(sorted(map(str, grocery_list))))
+def request_categories_stream(grocery_list):
+    """Asks Gemini for the supermarket section of every item, streamed.
+
+    Gemini answers with one JSON object per line; (item, section) pairs are
+    yielded as soon as each line arrives. Raises on any error, so that the
+    circuit breaker of Gemini sees it. Identical concurrent requests share
+    one streamed answer.
+    """
+
+    model = get_model()
 
-        model = genai.GenerativeModel()
+    prompt = (
+        f"You have to categorize items in a grocery list "
+        f"to help a customer finding the right "
+        f"supermarket section for every product in the list. "
+        f"The grocery list includes: {json.dumps(list(grocery_list))}. "
+        f"Answer with one line per item, each line being a JSON "
+        f"object with the keys \"item\", the item written exactly "
+        f"as given, and \"section\", its supermarket section, "
+        f"and nothing else. Be careful to be "
+        f"precise in your categorization")
 
-        prompt = (
-            f"You have to categorize items in a grocery list "
-            f"to help a customer finding the right "
-            f"supermarket section for every product in the list. "
-            f"I will give you in input the list "
-            f"and you have to return more list divided by " 
-            f"category (supermarket section). The grocery "
-            f"list includes: {grocery_list}. "
-            f"Please categorize the items by supermarket " 
-            f"section. Be careful to be "
-            f"precise in your categorization")
+    # Misura il tempo fino al primo chunk della risposta
+    with span("gemini"):
+        response = model.generate_content(prompt, stream=True)
 
-        response = model.generate_content(prompt)
+    buffer = ""
+    for chunk in response:
+        buffer += chunk.text
+        # Le righe complete vengono restituite subito, l'ultima resta nel buffer
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            pair = parse_category_line(line)
+            if pair is not None:
+                yield pair
+    pair = parse_category_line(buffer)
+    if pair is not None:
+        yield pair
 
-        return response.text
+def categorize_grocery_list_stream(grocery_list):
+    """Categorizes grocery items with a streamed Gemini answer.
+
+    Yields (item, section) pairs as they arrive and stops early if the model
+    failed. Raises UpstreamOverloaded (or CircuitOpen) when Gemini is not
+    being called.
+    """
+
+    try:
+        yield from request_categories_stream(grocery_list)
 
+    except UpstreamOverloaded:
+        raise
     except Exception as e:  # Catch any unexpected errors
         print(f"Error categorizing grocery list: {e}")
-        return []  # Return an empty list on error
 
 # Example usage
 # grocery_list = ["Milk", "Bread", "Apples", "Eggs", "beer", "almonds", "juice"]
-# categorized_list = categorize_grocery_list(grocery_list)
-# print(categorized_list)
+# for item, section in categorize_grocery_list_stream(grocery_list):
+#     print(item, "=>", section)
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+
+import metrics
+from instrumentation import span
+from gemini_api_script import categorize_grocery_list_stream
+from upstream_guard import UpstreamOverloaded
+
+# Sezione usata per gli elementi che il modello non ha categorizzato
+OTHER_SECTION = "Other"
+# Sezione provvisoria degli elementi in attesa della risposta del modello
+PENDING_SECTION = "Categorizing..."
+
+# Caratteri non ammessi nelle chiavi del Realtime Database
+_FORBIDDEN_KEY_CHARS = {".": "%2E", "$": "%24", "#": "%23", "[": "%5B", "]": "%5D", "/": "%2F"}
+
+
+def normalize_item(item):
+    """Normalizes a grocery item name (case and whitespace)."""
+
+    return " ".join(str(item).lower().split())
+
+
+def encode_key(name):
+    """Turns a normalized item name into a valid Realtime Database key."""
+
+    key = name.replace("%", "%25")
+    for char, replacement in _FORBIDDEN_KEY_CHARS.items():
+        key = key.replace(char, replacement)
+    return key
+
+
+class CategoryCache:
+    """Remembers the supermarket section of every item categorized so far.
+
+    Entries live in memory and, when a database reference is given, are
+    persisted under it (normalized item -> section) so that every function
+    instance shares them.
+    """
+
+    def __init__(self, ref=None):
+        self._ref = ref
+        self._categories = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._categories is None:
+            stored = None
+            if self._ref is not None:
+                try:
+                    with span("rtdb"):
+                        stored = self._ref.get()
+                except Exception as e:
+                    logging.warning(f"Loading item categories failed: {e}")
+            self._categories = dict(stored or {})
+        return self._categories
+
+    def get(self, item):
+        with self._lock:
+            return self._load().get(encode_key(normalize_item(item)))
+
+    def update(self, categories):
+        """Stores item -> section pairs with a single database write."""
+
+        entries = {encode_key(normalize_item(item)): section for item, section in categories.items()}
+        if not entries:
+            return
+        with self._lock:
+            self._load().update(entries)
+        if self._ref is not None:
+            try:
+                with span("rtdb"):
+                    self._ref.update(entries)
+            except Exception as e:
+                logging.warning(f"Saving item categories failed: {e}")
+
+
+def resolve_known_items(items, cache, local=None):
+    """Splits items into (item -> section of the known ones, unseen items).
+
+    Items known to the local lexicon categorizer are resolved first, then
+    items in the cache.
+    """
+
+    categories = {}
+    unseen = []
+    local_hits = 0
+    for item in items:
+        section = local.categorize(item) if local is not None else None
+        if section is not None:
+            local_hits += 1
+        else:
+            section = cache.get(item)
+        if section is None:
+            unseen.append(item)
+        else:
+            categories[item] = section
+
+    metrics.increment("grocery_categorizer.items", len(items))
+    metrics.increment("grocery_categorizer.local_hits", local_hits)
+    metrics.increment("grocery_categorizer.hits", len(categories) - local_hits)
+    metrics.increment("grocery_categorizer.misses", len(unseen))
+    return categories, unseen
+
+
+def categorize_items_stream(items, cache, local=None):
+    """Yields item -> section snapshots while Gemini categorizes the unseen items.
+
+    The first snapshot is produced without calling the model: known items
+    are already in their section, unseen ones are in PENDING_SECTION. Each
+    following snapshot adds an item from the streamed model answer. Items
+    the model did not answer (failure, open circuit, load shed) stay in
+    PENDING_SECTION in the last snapshot, so that a view stored from it
+    asks again; use with_fallback() to show them.
+    """
+
+    categories, unseen = resolve_known_items(items, cache, local)
+
+    pending = {normalize_item(item): item for item in unseen}
+    snapshot = dict(categories, **{item: PENDING_SECTION for item in unseen})
+    yield dict(snapshot)
+    if not unseen:
+        if categories:
+            # Chiamata al modello evitata: stimiamo il tempo risparmiato con la latenza media del modello
+            model_latency = metrics.average("grocery_categorizer.model_latency")
+            if model_latency is not None:
+                metrics.observe("grocery_categorizer.latency_saved", model_latency)
+        return
+
+    metrics.increment("grocery_categorizer.model_calls")
+    start = time.perf_counter()
+    learned = {}
+    try:
+        for answered_item, section in categorize_grocery_list_stream(unseen):
+            item = pending.pop(normalize_item(answered_item), None)
+            if item is None or not section:
+                continue
+            learned[item] = section
+            snapshot[item] = section
+            yield dict(snapshot)
+    except UpstreamOverloaded:
+        # Gemini non risponde (circuito aperto o limiter saturo): gli elementi mai visti restano senza sezione
+        metrics.increment("grocery_categorizer.degraded")
+    else:
+        # Durata dell'intera risposta in streaming
+        metrics.observe("grocery_categorizer.model_latency", time.perf_counter() - start)
+
+    cache.update(learned)
+    if local is not None:
+        local.learn(learned)
+
+
+def with_fallback(categories):
+    """Returns the categories with the items still in PENDING_SECTION moved to OTHER_SECTION."""
+
+    return {item: OTHER_SECTION if section == PENDING_SECTION else section for item, section in categories.items()}
+
+
+def local_resolution_rate():
+    """Returns the share of categorized items resolved by the local lexicon."""
+
+    counters = metrics.snapshot()["counters"]
+    items = counters.get("grocery_categorizer.items", 0)
+    return counters.get("grocery_categorizer.local_hits", 0) / items if items else 0.0
+
+
+def group_by_section(categories):
+    """Groups item -> section pairs into section -> items, sections sorted by name."""
+
+    sections = {}
+    for item, section in categories.items():
+        sections.setdefault(section, []).append(item)
+    ordered = sorted(sections, key=lambda section: (section == PENDING_SECTION, section == OTHER_SECTION, section.lower()))
+    return {section: sorted(sections[section], key=str.lower) for section in ordered}
+
+
+def render_sections(sections):
+    """Renders section -> items as the grocery list reply text."""
+
+    formatted_text = ""
+    for section, items in sections.items():
+        formatted_text += f"{section}:\n"
+        for item in items:
+            formatted_text += f"- {item}\n"
+        formatted_text += "\n"
+    return formatted_text.rstrip("\n")
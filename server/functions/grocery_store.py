@@ -0,0 +1,336 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+from instrumentation import span
+from grocery_categorizer import PENDING_SECTION, encode_key, group_by_section, normalize_item, render_sections
+
+# Numero massimo di liste tenute in memoria da ogni istanza
+GROCERY_CACHE_SIZE = int(os.environ.get("FOODMATE_GROCERY_CACHE_SIZE", "256"))
+# Identifica le scritture di questa istanza negli eventi del database
+INSTANCE_ID = uuid.uuid4().hex
+
+
+class _CachedList:
+
+    def __init__(self, items, version=None, view=None):
+        self.items = items
+        self.version = version
+        self.view = view
+        self.listener = None
+        self.primed = False
+
+
+class GroceryListCache:
+    """Instance-local LRU cache of grocery lists kept fresh by RTDB listeners.
+
+    Each cached list has a listen() stream on its database node. Events
+    written by this instance are ignored (the cache was already updated
+    write-through); any other change invalidates the cached list, and the
+    time since the remote write is recorded as the stale-read window.
+    Evicted lists have their listener closed.
+    """
+
+    def __init__(self, maxsize=GROCERY_CACHE_SIZE):
+        self._maxsize = maxsize
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns a copy of the cached items, or None if the list is not cached."""
+
+        with self._lock:
+            cached = self._lists.get(session_id)
+            if cached is None:
+                metrics.increment("grocery_cache.misses")
+                return None
+            self._lists.move_to_end(session_id)
+            metrics.increment("grocery_cache.hits")
+            return dict(cached.items)
+
+    def get_node(self, session_id):
+        """Returns a copy of the cached list node (items, version, view), or None."""
+
+        with self._lock:
+            cached = self._lists.get(session_id)
+            if cached is None:
+                metrics.increment("grocery_cache.misses")
+                return None
+            self._lists.move_to_end(session_id)
+            metrics.increment("grocery_cache.hits")
+            return _node(cached.items, cached.version, cached.view)
+
+    def put(self, session_id, items, list_ref, version=None, view=None):
+        """Caches a list read from the database and starts listening for changes."""
+
+        with self._lock:
+            if session_id in self._lists:
+                cached = self._lists[session_id]
+                cached.items, cached.version, cached.view = dict(items), version, _copy_view(view)
+                return
+            cached = _CachedList(dict(items), version, _copy_view(view))
+            self._lists[session_id] = cached
+            evicted = []
+            while len(self._lists) > self._maxsize:
+                evicted.append(self._lists.popitem(last=False)[1])
+                metrics.increment("grocery_cache.evictions")
+        for old in evicted:
+            self._close(old)
+        try:
+            cached.listener = list_ref.listen(lambda event: self._on_event(session_id, cached, event))
+        except Exception as e:
+            logging.warning(f"Listening to grocery list {session_id} failed: {e}")
+            self.invalidate(session_id)
+
+    def apply(self, session_id, updates, version=None, view=None):
+        """Applies our own key -> item writes (None deletes) to a cached list.
+
+        `version` and `view` are the new version stamp and materialized view
+        written with the items (a view of None leaves the cached one as is).
+        """
+
+        with self._lock:
+            cached = self._lists.get(session_id)
+            if cached is None:
+                return
+            for key, item in updates.items():
+                if item is None:
+                    cached.items.pop(key, None)
+                else:
+                    cached.items[key] = item
+            if version is not None:
+                cached.version = version
+            if view is not None:
+                cached.view = _copy_view(view)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            cached = self._lists.pop(session_id, None)
+        if cached is not None:
+            self._close(cached)
+
+    def _close(self, cached):
+        if cached.listener is not None:
+            try:
+                cached.listener.close()
+            except Exception as e:
+                logging.warning(f"Closing grocery list listener failed: {e}")
+
+    def _on_event(self, session_id, cached, event):
+        data = event.data
+        if not cached.primed:
+            # Il primo evento è lo stato iniziale del nodo: copre le scritture
+            # avvenute tra la lettura e l'apertura dello stream
+            cached.primed = True
+            with self._lock:
+                if isinstance(data, dict):
+                    cached.items = dict(data.get("items") or {})
+                    cached.version, cached.view = data.get("version"), _copy_view(data.get("view"))
+                elif data is None:
+                    cached.items, cached.version, cached.view = {}, None, None
+            return
+        if isinstance(data, dict) and data.get("writer") == INSTANCE_ID:
+            return
+        with self._lock:
+            if self._lists.get(session_id) is not cached:
+                return
+            del self._lists[session_id]
+        metrics.increment("grocery_cache.invalidations")
+        if isinstance(data, dict) and data.get("updated_at"):
+            metrics.observe("grocery_cache.stale_window", max(0.0, time.time() - data["updated_at"]))
+        # Chiusura in un altro thread: non si può chiudere lo stream dal suo callback
+        threading.Thread(target=self._close, args=(cached,), daemon=True).start()
+
+
+def _copy_view(view):
+    if not isinstance(view, dict):
+        return None
+    return dict(view, sections=dict(view.get("sections") or {}))
+
+
+def _node(items, version, view):
+    return {"items": dict(items), "version": version, "view": _copy_view(view)}
+
+
+def render_view(items, sections):
+    """Renders the stored sections as the reply text, or "" while some items are uncategorized."""
+
+    if PENDING_SECTION in sections.values():
+        return ""
+    return render_sections(group_by_section({items[key]: section for key, section in sections.items()}))
+
+
+class GroceryStore:
+    """Grocery lists sharded by chat session in the Realtime Database.
+
+    Each list lives under <root>/<session_id>/items as a map from the
+    normalized item name to the name the user typed, so duplicates and
+    removals are direct key operations. Every operation costs at most one
+    read and one (multi-path) write, whatever the size of the list; with a
+    GroceryListCache, reads of a warm list cost no round trip at all.
+
+    With a `categorize` function (items -> item -> known section, without
+    calling a model) the store also keeps a materialized view of each list
+    under <root>/<session_id>/view: the section of every item and the
+    rendered reply text. Every write changes the list's version stamp and,
+    in the same multi-path update, the affected sections, the text and the
+    view's stamp; a view whose stamp differs from the list's is stale and
+    is rebuilt by the reader with save_view().
+    """
+
+    def __init__(self, root_ref, cache=None, categorize=None):
+        self._root_ref = root_ref
+        self._cache = cache
+        self._categorize = categorize
+
+    def _list_ref(self, session_id):
+        return self._root_ref.child(encode_key(str(session_id)))
+
+    def _get_node(self, session_id):
+        if self._cache is not None:
+            node = self._cache.get_node(session_id)
+            if node is not None:
+                return node
+        list_ref = self._list_ref(session_id)
+        with span("rtdb"):
+            # Elementi e vista in un'unica lettura del nodo della lista
+            data = list_ref.get() or {}
+        node = _node(data.get("items") or {}, data.get("version"), data.get("view"))
+        if self._cache is not None:
+            self._cache.put(session_id, node["items"], list_ref, node["version"], node["view"])
+        return node
+
+    def get_items(self, session_id):
+        """Returns the list as a dictionary key -> item name (empty if there is no list)."""
+
+        return self._get_node(session_id)["items"]
+
+    def _fresh_view(self, node):
+        view = node["view"]
+        if view is None and not node["version"] and not node["items"]:
+            # Lista nuova: la vista vuota è aggiornata e viene mantenuta dalla prima scrittura
+            return {"version": None, "sections": {}, "text": ""}
+        if view is None or not node["version"] or view.get("version") != node["version"]:
+            return None
+        # Un elemento senza sezione (o viceversa) indica scritture concorrenti non riflesse nella vista
+        if view["sections"].keys() != node["items"].keys():
+            return None
+        return view
+
+    def get_view(self, session_id):
+        """Returns the list with its materialized view, or None if the view is missing or stale.
+
+        The result has "items" (key -> item name), "sections" (key ->
+        section, PENDING_SECTION for items never categorized) and "text"
+        (the rendered reply, "" while some items are pending).
+        """
+
+        node = self._get_node(session_id)
+        view = self._fresh_view(node)
+        if view is None:
+            metrics.increment("grocery_view.stale")
+            return None
+        metrics.increment("grocery_view.hits")
+        return {"items": node["items"], "sections": view["sections"], "text": view.get("text", "")}
+
+    def save_view(self, session_id, categories):
+        """Stores the view rebuilt from item name -> section pairs for the current list."""
+
+        node = self._get_node(session_id)
+        version = node["version"] or uuid.uuid4().hex
+        by_name = {normalize_item(item): section for item, section in categories.items()}
+        sections = {key: by_name.get(normalize_item(item), PENDING_SECTION) for key, item in node["items"].items()}
+        view = {"version": version, "sections": sections, "text": render_view(node["items"], sections)}
+        with span("rtdb"):
+            self._list_ref(session_id).update({"version": version, "view": view, "writer": INSTANCE_ID})
+        if self._cache is not None:
+            self._cache.apply(session_id, {}, version, view)
+        metrics.increment("grocery_view.rebuilds")
+
+    def _view_paths(self, node, updates, version):
+        # Aggiorna la vista solo se era aggiornata: altrimenti resta obsoleta e verrà ricostruita
+        view = self._fresh_view(node) if self._categorize is not None else None
+        if view is None:
+            return {}, None
+        items = dict(node["items"])
+        sections = dict(view["sections"])
+        added = [item for item in updates.values() if item is not None]
+        known = self._categorize(added) if added else {}
+        paths = {}
+        for key, item in updates.items():
+            if item is None:
+                items.pop(key, None)
+                sections.pop(key, None)
+                paths[f"view/sections/{key}"] = None
+            else:
+                items[key] = item
+                sections[key] = known.get(item) or PENDING_SECTION
+                paths[f"view/sections/{key}"] = sections[key]
+        view = {"version": version, "sections": sections, "text": render_view(items, sections)}
+        paths["view/version"] = version
+        paths["view/text"] = view["text"]
+        metrics.increment("grocery_view.incremental_updates")
+        return paths, view
+
+    def _write(self, session_id, node, updates):
+        # Un'unica update multi-path con i metadati per i listener delle altre istanze
+        version = uuid.uuid4().hex
+        paths, view = self._view_paths(node, updates, version)
+        paths.update({f"items/{key}": item for key, item in updates.items()})
+        paths["version"] = version
+        paths["updated_at"] = time.time()
+        paths["writer"] = INSTANCE_ID
+        with span("rtdb"):
+            self._list_ref(session_id).update(paths)
+        if self._cache is not None:
+            self._cache.apply(session_id, updates, version, view)
+
+    def add_items(self, session_id, items):
+        """Adds the items that are not in the list yet; returns the ones added."""
+
+        node = self._get_node(session_id)
+        current_items = node["items"]
+        updates = {}
+        items_added = []
+        for item in items:
+            key = encode_key(normalize_item(item))
+            if key and key not in current_items and key not in updates:
+                updates[key] = item
+                items_added.append(item)
+        if updates:
+            self._write(session_id, node, updates)
+        return items_added
+
+    def remove_items(self, session_id, items):
+        """Removes the given items from the list; returns the ones removed.
+
+        Returns None if the list is empty.
+        """
+
+        node = self._get_node(session_id)
+        current_items = node["items"]
+        if not current_items:
+            return None
+        updates = {}
+        items_removed = []
+        for item in items:
+            key = encode_key(normalize_item(item))
+            if key in current_items and key not in updates:
+                updates[key] = None
+                items_removed.append(current_items[key])
+        if updates:
+            self._write(session_id, node, updates)
+        return items_removed
+
+    def clear(self, session_id):
+        """Deletes the whole list; returns False if it was already empty."""
+
+        node = self._get_node(session_id)
+        if not node["items"]:
+            return False
+        self._write(session_id, node, {key: None for key in node["items"]})
+        return True
@@ -0,0 +1,98 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from instrumentation import span
+
+# Dimensione del pool di connessioni keep-alive per ogni upstream
+POOL_SIZE = int(os.environ.get("FOODMATE_HTTP_POOL_SIZE", "10"))
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Timeout (connect, read) in secondi per ogni upstream
+UPSTREAM_TIMEOUTS = {
+    "telegram": (3.05, 10),
+    "dialogflow": (3.05, 30),
+    "edamam": (3.05, 15),
+    "google_oauth": (3.05, 10),
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(upstream):
+    """Returns the shared keep-alive session for an upstream, creating it on first use."""
+
+    session = _sessions.get(upstream)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[upstream] = session
+    return session
+
+
+def _backoff(attempt):
+    # Full jitter: attesa casuale tra 0 e il backoff esponenziale
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(upstream, method, url, idempotent=None, **kwargs):
+    """Sends an HTTP request through the upstream's pooled session.
+
+    Idempotent requests (GET by default) are retried a bounded number of
+    times with jittered backoff on connection errors, timeouts and 429/5xx.
+    The whole call, retries included, is timed as the `upstream` stage of
+    the current request.
+    """
+
+    with span(upstream):
+        return _request(upstream, method, url, idempotent, **kwargs)
+
+
+def _request(upstream, method, url, idempotent, **kwargs):
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD")
+    kwargs.setdefault("timeout", UPSTREAM_TIMEOUTS.get(upstream, DEFAULT_TIMEOUT))
+    session = get_session(upstream)
+    attempts = MAX_RETRIES + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.increment(f"http.{upstream}.errors")
+            if attempt + 1 >= attempts:
+                raise
+            logging.warning(f"Request to {upstream} failed ({e}), retrying")
+        else:
+            metrics.observe(f"http.{upstream}.latency", time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUS_CODES or attempt + 1 >= attempts:
+                return response
+            logging.warning(f"Request to {upstream} returned {response.status_code}, retrying")
+        metrics.increment(f"http.{upstream}.retries")
+        time.sleep(_backoff(attempt))
+
+
+def get(upstream, url, **kwargs):
+    return request(upstream, "GET", url, **kwargs)
+
+
+def post(upstream, url, **kwargs):
+    return request(upstream, "POST", url, **kwargs)
@@ -0,0 +1,148 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+import metrics
+
+# Quota dei payload completi scritti nei log e lunghezza massima di ognuno
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get("FOODMATE_PAYLOAD_LOG_RATE", "0.01"))
+PAYLOAD_LOG_MAX_CHARS = int(os.environ.get("FOODMATE_PAYLOAD_LOG_MAX_CHARS", "2000"))
+# File in formato testo Prometheus (textfile collector) aggiornato con le metriche
+METRICS_FILE = os.environ.get("FOODMATE_METRICS_FILE")
+METRICS_FILE_INTERVAL = 10.0
+
+request_logger = logging.getLogger("foodmate.requests")
+payload_logger = logging.getLogger("foodmate.payloads")
+
+_current_record = contextvars.ContextVar("foodmate_request_record", default=None)
+_last_metrics_export = 0.0
+_export_lock = threading.Lock()
+
+
+def get_correlation_id():
+    """Returns the correlation id of the request being handled, or None."""
+
+    record = _current_record.get()
+    return record["correlation_id"] if record else None
+
+
+@contextlib.contextmanager
+def request_record(kind, correlation_id=None):
+    """Collects the stage timings of a request and logs them as one JSON record.
+
+    If a record is already active (e.g. the webhook processing an update
+    synchronously), stages are added to it instead of starting a new one.
+    """
+
+    if _current_record.get() is not None:
+        yield _current_record.get()
+        return
+
+    record = {"correlation_id": correlation_id or uuid.uuid4().hex, "kind": kind, "stages": {}, "status": "ok"}
+    token = _current_record.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record["status"] = "error"
+        raise
+    finally:
+        _current_record.reset(token)
+        record["duration_ms"] = round(1000 * (time.perf_counter() - start), 2)
+        metrics.observe(f"request.{kind}", record["duration_ms"] / 1000)
+        request_logger.info(json.dumps(record))
+        _maybe_export_metrics()
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Times a stage of the current request (spans of the same stage add up)."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(f"span.{stage}", elapsed)
+        record = _current_record.get()
+        if record is not None:
+            record["stages"][stage] = round(record["stages"].get(stage, 0.0) + 1000 * elapsed, 2)
+
+
+def log_payload(label, payload):
+    """Logs a sampled, size-capped copy of a request or response body."""
+
+    if not payload_logger.isEnabledFor(logging.DEBUG) and random.random() >= PAYLOAD_LOG_SAMPLE_RATE:
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    if len(text) > PAYLOAD_LOG_MAX_CHARS:
+        text = text[:PAYLOAD_LOG_MAX_CHARS] + f"... ({len(text)} chars)"
+    payload_logger.info(json.dumps({"correlation_id": get_correlation_id(), "label": label, "payload": text}))
+
+
+def instrumented_handler(kind):
+    """Decorator for fulfillment handlers: records the request under the correlation
+    id that the webhook put in the Dialogflow payload."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(request):
+            request_data = request.get_json(silent=True) or {}
+            correlation_id = request_data.get("payload", {}).get("correlation_id")
+            with request_record(kind, correlation_id):
+                return func(request)
+
+        return wrapper
+
+    return decorator
+
+
+def _metric_name(name):
+    return "foodmate_" + "".join(char if char.isalnum() else "_" for char in name)
+
+
+def export_prometheus():
+    """Renders all metrics in the Prometheus text exposition format."""
+
+    snapshot = metrics.snapshot()
+    lines = []
+    for name, value in sorted(snapshot["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, value in sorted(snapshot["gauges"].items()):
+        metric = _metric_name(name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    for name, timing in sorted(snapshot["timings"].items()):
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for quantile in ("p50", "p95", "p99"):
+            lines.append(f'{metric}{{quantile="0.{quantile[1:]}"}} {timing[quantile]:.6f}')
+        lines.append(f"{metric}_sum {timing['avg'] * timing['count']:.6f}")
+        lines.append(f"{metric}_count {timing['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _maybe_export_metrics():
+    global _last_metrics_export
+    if not METRICS_FILE:
+        return
+    with _export_lock:
+        now = time.monotonic()
+        if now - _last_metrics_export < METRICS_FILE_INTERVAL:
+            return
+        _last_metrics_export = now
+    try:
+        # Scrittura atomica: il collector non legge mai un file a metà
+        temporary_path = METRICS_FILE + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write(export_prometheus())
+        os.replace(temporary_path, METRICS_FILE)
+    except OSError as e:
+        logging.warning(f"Exporting metrics to {METRICS_FILE} failed: {e}")
@@ -0,0 +1,93 @@
+import json
+import os
+import re
+
+import metrics
+
+# File con le regole del percorso veloce (sovrascrivibile con FOODMATE_FAST_PATH_INTENTS)
+ROUTES_PATH = os.environ.get(
+    "FOODMATE_FAST_PATH_INTENTS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fast_path_intents.json"),
+)
+
+# "/list@FoodmateBot" -> "/list": i comandi nei gruppi riportano il nome del bot
+_BOT_SUFFIX = re.compile(r"^(/\w+)@\w+")
+
+
+def split_items(text):
+    """Splits "milk, mac and cheese, bread" into ["milk", "mac and cheese", "bread"].
+
+    Only commas separate items: "and" and "&" are part of names like
+    "mac and cheese" or "salt & vinegar crisps". Since "milk and eggs" may
+    also be two items, the natural-language routes do not match messages
+    with "and" or "&" and leave them to Dialogflow; slash commands do.
+    """
+
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+class IntentRouter:
+    """Recognizes command-style messages locally, without calling Dialogflow.
+
+    Each route maps a regular expression on the normalized message (lower
+    case, no trailing punctuation) to a fulfillment intent; the optional
+    named groups "items" and "page" become the intent parameters. Routes
+    are tried in order, so more specific ones go first. Messages that match
+    no route are left to Dialogflow.
+    """
+
+    def __init__(self, routes=()):
+        self._routes = [(re.compile(route["pattern"]), route["intent"]) for route in routes]
+
+    @classmethod
+    def from_file(cls, path=ROUTES_PATH):
+        """Builds a router from a JSON file with a list of {"intent", "pattern"} routes."""
+
+        with open(path, "r") as f:
+            return cls(json.load(f)["routes"])
+
+    def intents(self):
+        """Returns the names of the intents the routes lead to."""
+
+        return {intent for _, intent in self._routes}
+
+    def route(self, text):
+        """Returns (intent, parameters) for a command-style message, or None."""
+
+        normalized = _BOT_SUFFIX.sub(r"\1", " ".join(str(text).lower().split())).rstrip(".!?")
+        for pattern, intent in self._routes:
+            match = pattern.match(normalized)
+            if match is None:
+                continue
+            groups = match.groupdict()
+            parameters = {}
+            if groups.get("items"):
+                items = split_items(groups["items"])
+                if not items:
+                    continue
+                parameters["item"] = {"resolvedValue": items}
+            if groups.get("page"):
+                parameters["page"] = {"resolvedValue": int(groups["page"])}
+            metrics.increment("intent_router.fast_path")
+            metrics.increment(f"intent_router.fast_path.{intent}")
+            return intent, parameters
+        metrics.increment("intent_router.dialogflow")
+        return None
+
+
+def observe_latency_saved(fast_path_seconds):
+    """Records the time a fast-path turn saved against the average detectIntent call."""
+
+    # detectIntent comprende già il fulfillment: il risparmio è la differenza con il percorso locale
+    detect_intent = metrics.average("span.detect_intent")
+    if detect_intent is not None:
+        metrics.observe("intent_router.latency_saved", max(0.0, detect_intent - fast_path_seconds))
+
+
+def fast_path_share():
+    """Returns the share of messages answered without calling Dialogflow."""
+
+    counters = metrics.snapshot()["counters"]
+    fast = counters.get("intent_router.fast_path", 0)
+    total = fast + counters.get("intent_router.dialogflow", 0)
+    return fast / total if total else 0.0
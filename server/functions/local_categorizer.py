@@ -0,0 +1,89 @@
+import json
+import os
+import re
+import threading
+
+# File con il lessico sezione -> elementi usato per la categorizzazione locale
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grocery_lexicon.json")
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Parole che al singolare terminano in "s" e non vanno accorciate
+_INVARIABLE = {"molasses", "swiss", "series"}
+
+
+def stem(token):
+    """Reduces an English plural token to its singular form."""
+
+    if len(token) <= 3 or token in _INVARIABLE or token.endswith("ss") or token.endswith("us"):
+        return token
+    if token.endswith("ie"):
+        # "cookie" e "cookies" devono avere la stessa forma
+        return token[:-2] + "y"
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("oes") or token.endswith("ches") or token.endswith("shes") or token.endswith("xes"):
+        return token[:-2]
+    if token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Splits an item name into lowercase singular tokens."""
+
+    return tuple(stem(token) for token in _TOKEN_PATTERN.findall(str(text).lower()))
+
+
+class LocalCategorizer:
+    """Resolves the supermarket section of common items without calling a model.
+
+    Phrases are indexed as tuples of normalized tokens. An item is matched on
+    the longest known phrase at the end of its name (the head noun:
+    "skimmed milk" -> "milk", "chicken breast" -> "chicken breast"). A phrase
+    elsewhere in the name says nothing about the item ("corn flakes" are not
+    vegetables), so such items are left to the model.
+    """
+
+    def __init__(self, lexicon=None):
+        self._index = {}
+        self._max_phrase = 1
+        self._lock = threading.Lock()
+        if lexicon:
+            self.learn_sections(lexicon)
+
+    @classmethod
+    def from_file(cls, path=LEXICON_PATH):
+        """Builds a categorizer from a JSON file mapping sections to items."""
+
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def learn_sections(self, lexicon):
+        """Adds section -> items entries to the index."""
+
+        self.learn({item: section for section, items in lexicon.items() for item in items})
+
+    def learn(self, categories):
+        """Adds item -> section pairs, e.g. past Gemini answers, to the index."""
+
+        with self._lock:
+            for item, section in categories.items():
+                phrase = tokenize(item)
+                if phrase:
+                    self._index[phrase] = section
+                    self._max_phrase = max(self._max_phrase, len(phrase))
+
+    def categorize(self, item):
+        """Returns the section of an item, or None if it is not in the lexicon."""
+
+        tokens = tokenize(item)
+        index = self._index
+        for length in range(min(len(tokens), self._max_phrase), 0, -1):
+            # Solo la frase finale (nome principale)
+            section = index.get(tokens[len(tokens) - length:])
+            if section is not None:
+                return section
+        return None
+
+    def __len__(self):
+        return len(self._index)
@@ -1,22 +1,32 @@
 # Imports
-import firebase_admin
-from firebase_admin import credentials, db
 from firebase_functions import https_fn, options
+import asyncio
+import functools
+import itertools
 import json
 import logging
-import requests
-
-from edamam_nutrition_api_script import get_nutrition_data
-from edamam_recipe_api_script import get_recipe_data
-from gemini_api_script import categorize_grocery_list
-
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-
-# Initialize logging
-logging.basicConfig(level=logging.DEBUG)
+import os
+import threading
+import time
+
+import http_client
+import metrics
+from instrumentation import get_correlation_id, instrumented_handler, log_payload, request_record, span
+
+from edamam_nutrition_api_script import get_nutrition_data, get_nutrition_data_batch
+from edamam_recipe_api_script import get_recipe_data, get_recipes_from_list
+from grocery_categorizer import PENDING_SECTION, CategoryCache, categorize_items_stream, group_by_section, render_sections, resolve_known_items, with_fallback
+from local_categorizer import LocalCategorizer
+from message_coalescer import MessageCoalescer
+from grocery_store import GroceryListCache, GroceryStore
+from intent_router import IntentRouter, observe_latency_saved
+from update_queue import UpdateQueue
+from telegram_streaming import TelegramMessageStream, split_message
+from update_dedup import RTDBDedupBackend, UpdateDeduplicator
+from upstream_guard import OVERLOAD_MESSAGE, UpstreamOverloaded
+
+# Initialize logging (FOODMATE_LOG_LEVEL=DEBUG logs every payload instead of a sample)
+logging.basicConfig(level=os.environ.get("FOODMATE_LOG_LEVEL", "INFO"))
 
 # Helper function to create Dialogflow response
 def create_dialogflow_response(message_text):
@@ -35,6 +45,21 @@ def create_dialogflow_response(message_text):
     }
     return json.dumps(response)
 
+# Helper function to tell the webhook that the reply was already streamed to Telegram
+def create_streamed_dialogflow_response():
+    response = {
+        "fulfillment_response": {
+            "messages": [
+                {
+                    "payload": {
+                        "foodmate_streamed": True
+                    }
+                }
+            ]
+        }
+    }
+    return json.dumps(response)
+
 def load_telegram_key(file_path):
     with open(file_path, "r") as f:
         credentials = json.load(f)
@@ -52,104 +77,278 @@ def load_dialogflow(file_path):
         raise ValueError(f"Missing 'PROJECT_ID' or 'AGENT_ID' in {file_path}.")
     return project_ID, agent_ID
 
-# Initialize Firebase app
-cred = credentials.Certificate("chiave.json")
-firebase_admin.initialize_app(cred, {'databaseURL': 'https://nlp-chatbot-project-420413-default-rtdb.europe-west1.firebasedatabase.app/'})
-
-# Token del bot Telegram
-TELEGRAM_BOT_TOKEN = load_telegram_key("telegram_bot_father_key.json")
-# Informazioni riguardanti il progetto dialogflow
-PROJECT_ID, AGENT_ID = load_dialogflow("dialogflow_infos.json")
 REGION = "europe-west2"  
 LANGUAGE_CODE = 'en'
+# URL base degli upstream (sovrascrivibili per puntare a server locali)
+DIALOGFLOW_API_URL = os.environ.get("DIALOGFLOW_API_URL", f"https://{REGION}-dialogflow.googleapis.com")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+DATABASE_URL = 'https://nlp-chatbot-project-420413-default-rtdb.europe-west1.firebasedatabase.app/'
+
+# Client e configurazioni vengono inizializzati al primo utilizzo, così ogni
+# funzione paga all'avvio solo le dipendenze che usa davvero
+_firebase_lock = threading.Lock()
+
+def get_firebase_app():
+    """Initializes the Firebase app on first use and returns it."""
+
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate("chiave.json")
+            return firebase_admin.initialize_app(cred, {'databaseURL': DATABASE_URL})
+
+def db_reference(path):
+    """Returns a Realtime Database reference, initializing Firebase if needed."""
+
+    from firebase_admin import db
+
+    get_firebase_app()
+    return db.reference(path)
+
+@functools.lru_cache(maxsize=None)
+def get_telegram_bot_token():
+    # Token del bot Telegram
+    return load_telegram_key("telegram_bot_father_key.json")
+
+@functools.lru_cache(maxsize=None)
+def get_dialogflow_infos():
+    # Informazioni riguardanti il progetto dialogflow: (PROJECT_ID, AGENT_ID)
+    return load_dialogflow("dialogflow_infos.json")
+
+@functools.lru_cache(maxsize=None)
+def get_dialogflow_token_manager():
+    """Loads the service account credentials and returns the Dialogflow token manager."""
+
+    from google.oauth2 import service_account
+    from dialogflow_auth import DialogflowTokenManager
+
+    # Caricamento le credenziali di servizio dal file JSON
+    dialogflow_credentials = service_account.Credentials.from_service_account_file(
+        'chiave.json',
+        scopes=['https://www.googleapis.com/auth/cloud-platform']
+    )
+    # Il token viene riutilizzato fino a poco prima della scadenza
+    return DialogflowTokenManager(dialogflow_credentials)
+
+# Modalità del webhook: "sync" elabora l'update nella richiesta HTTP,
+# "async" lo mette in coda e risponde subito a Telegram
+WEBHOOK_MODE = os.environ.get("FOODMATE_WEBHOOK_MODE", "sync")
+WEBHOOK_WORKERS = int(os.environ.get("FOODMATE_WEBHOOK_WORKERS", "4"))
+WEBHOOK_SPOOL_DIR = os.environ.get("FOODMATE_WEBHOOK_SPOOL_DIR")
+# Con FOODMATE_COALESCE=1 (solo in modalità "async") i messaggi ravvicinati di una chat
+# vengono uniti in un'unica richiesta a Dialogflow; restano in memoria fino all'invio in coda
+COALESCE_MESSAGES = os.environ.get("FOODMATE_COALESCE") == "1"
+
+_update_queue = None
+_update_queue_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def get_update_dedup():
+    """Returns the deduplicator of Telegram updates redelivered after a slow response.
+
+    With FOODMATE_DEDUP_SHARED=1 the seen update_ids are shared between
+    instances through the Realtime Database.
+    """
+
+    backend = None
+    if os.environ.get("FOODMATE_DEDUP_SHARED") == "1":
+        backend = RTDBDedupBackend(db_reference("processed_updates"))
+    return UpdateDeduplicator(backend=backend)
+
+def get_update_queue():
+    """Returns the background update queue, starting its workers on first use."""
+
+    global _update_queue
+    if _update_queue is None:
+        # Una sola coda per istanza: due richieste concorrenti non devono avviare due gruppi di worker
+        with _update_queue_lock:
+            if _update_queue is None:
+                _update_queue = UpdateQueue(process_telegram_message, workers=WEBHOOK_WORKERS, spool_dir=WEBHOOK_SPOOL_DIR)
+    return _update_queue
+
+@functools.lru_cache(maxsize=None)
+def get_message_coalescer():
+    """Returns the per-chat debouncer that feeds the update queue."""
+
+    return MessageCoalescer(lambda fields: get_update_queue().submit(fields["chat_id"], fields))
+
+def parse_telegram_update(request_data):
+    """Validates a Telegram update and extracts the message fields.
+
+    Returns (fields, None) for a processable message, or (None, response)
+    with the HTTP response to send back otherwise.
+    """
+
+    message = None
+    update_id = request_data.get('update_id')
+
+    if 'message' in request_data:
+        message = request_data['message']
+    elif 'edited_message' in request_data:
+        message = request_data['edited_message']
+    elif 'channel_post' in request_data:
+        message = request_data['channel_post']
+    elif 'edited_channel_post' in request_data:
+        message = request_data['edited_channel_post']
+    elif 'my_chat_member' in request_data:
+        logging.debug("Chat member update received, no action required.")
+        return None, ({"success": True, "message": "Chat member update received."}, 200)
+    else:
+        logging.error("Invalid message format")
+        return None, ({"success": False, "error": "Invalid message format"}, 400)
+
+    if not message:
+        logging.error("No message found in request data")
+        return None, ({"success": False, "error": "No message found in request data"}, 400)
+
+    fields = {
+        "update_id": update_id,
+        "chat_id": message.get('chat', {}).get('id'),
+        "text": message.get('text'),
+        "user_id": message.get('from', {}).get('id'),
+        "username": message.get('from', {}).get('username', ''),
+        "message_id": message.get('message_id'),
+        "date": message.get('date'),
+    }
 
-# Configura il logging
-logging.basicConfig(level=logging.DEBUG)
+    if not fields["chat_id"] or not fields["text"]:
+        return None, ({"success": False, "error": "Invalid message format"}, 400)
 
-# Caricamento le credenziali di servizio dal file JSON
-DIALOGFLOW_CREDENTIALS = service_account.Credentials.from_service_account_file(
-    'chiave.json',
-    scopes=['https://www.googleapis.com/auth/cloud-platform']
-)
+    return fields, None
 
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
-def telegram_webhook(request):
-    try:
-        request_data = request.get_json()
-        if not request_data:
-            return {"success": False, "error": "Request data is missing"}, 400
+def process_telegram_message(fields):
+    """Sends a parsed Telegram message through Dialogflow and replies on Telegram."""
 
-        logging.debug(f"Request data: {request_data}")
-
-        message = None
-        update_id = request_data.get('update_id')
-
-        if 'message' in request_data:
-            message = request_data['message']
-        elif 'edited_message' in request_data:
-            message = request_data['edited_message']
-        elif 'channel_post' in request_data:
-            message = request_data['channel_post']
-        elif 'edited_channel_post' in request_data:
-            message = request_data['edited_channel_post']
-        elif 'my_chat_member' in request_data:
-            logging.debug("Chat member update received, no action required.")
-            return {"success": True, "message": "Chat member update received."}, 200
-        else:
-            logging.error("Invalid message format")
-            return {"success": False, "error": "Invalid message format"}, 400
+    with request_record("telegram_update", fields.get("correlation_id")):
+        return _process_telegram_message(fields)
 
-        if not message:
-            logging.error("No message found in request data")
-            return {"success": False, "error": "No message found in request data"}, 400
+def run_fast_path(fields, route):
+    """Runs the fulfillment of a locally routed message and returns its response messages."""
 
-        chat_id = message.get('chat', {}).get('id')
-        text = message.get('text')
-        user_id = message.get('from', {}).get('id')
-        username = message.get('from', {}).get('username', '')
-        message_id = message.get('message_id')
-        date = message.get('date')
+    # Comando riconosciuto localmente: il fulfillment viene eseguito senza passare da Dialogflow
+    start = time.perf_counter()
+    with span("fast_path"):
+        payload = create_telegram_payload(fields["text"], fields["user_id"], fields["username"], fields["chat_id"],
+                                          fields["update_id"], fields["message_id"], fields["date"])
+        response_messages = fulfill_locally(str(fields["chat_id"]), *route, payload)
+    observe_latency_saved(time.perf_counter() - start)
+    return response_messages
 
-        # logging.debug(f"chat_id: {chat_id}, text: {text}, user_id: {user_id}, username: {username}, message_id: {message_id}, date: {date}, update_id: {update_id}")
+def get_response_text(response_messages):
+    """Joins the text response messages, or returns None if the reply was already streamed to Telegram."""
 
-        if not chat_id or not text:
-            # logging.error("Invalid message format")
-            return {"success": False, "error": "Invalid message format"}, 400
+    response_texts = []
+    for message in response_messages:
+        if message.get('payload', {}).get('foodmate_streamed'):
+            # Il fulfillment ha già inviato la risposta direttamente a Telegram
+            return None
+        if 'text' in message and 'text' in message['text']:
+            response_texts.extend(message['text']['text'])
 
-        session_id = str(chat_id)
-        
-        # Chiamata a Dialogflow CX con "it" come LANGUAGE_CODE
-        dialogflow_response = detect_intent_texts(session_id, text, user_id, username, chat_id, update_id, message_id, date)
-        logging.debug(f"Dialogflow response: {dialogflow_response}")
+    return ' '.join(response_texts) if response_texts else "I didn't get that. May you try again please?"
+
+def _process_telegram_message(fields):
+    chat_id = fields["chat_id"]
+    session_id = str(chat_id)
+
+    route = get_intent_router().route(fields["text"]) if FAST_PATH_ENABLED else None
+    if route is not None:
+        response_messages = run_fast_path(fields, route)
+    else:
+        # Chiamata a Dialogflow CX
+        with span("detect_intent"):
+            dialogflow_response = detect_intent_texts(session_id, fields["text"], fields["user_id"], fields["username"],
+                                                      chat_id, fields["update_id"], fields["message_id"], fields["date"])
+        log_payload("dialogflow_response", dialogflow_response)
 
         # Estrazione di tutti i messaggi di testo da responseMessages
         response_messages = dialogflow_response.get('queryResult', {}).get('responseMessages', [])
-        response_texts = []
-        for message in response_messages:
-            if 'text' in message and 'text' in message['text']:
-                response_texts.extend(message['text']['text'])
-
-        response_text = ' '.join(response_texts) if response_texts else "I didn't get that. May you try again please?"
 
-        # response_text = dialogflow_response.get('queryResult', {}).get('responseMessages',{}).get('text',{}).get('text', 'I didn't get that. May you try again please?')
+    response_text = get_response_text(response_messages)
+    if response_text is None:
+        return {"ok": True, "streamed": True}
 
-        # Invia risposta a Telegram
+    # Invia risposta a Telegram
+    with span("send_message"):
         telegram_response = send_message_to_telegram(chat_id, response_text)
-        logging.debug(f"Telegram response: {telegram_response}")
-        return {"success": True, "response": telegram_response}
+    return telegram_response
+
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
+def telegram_webhook(request):
+    with request_record("telegram_webhook") as record:
+        return _handle_telegram_webhook(request, record)
+
+def _handle_telegram_webhook(request, record):
+    try:
+        with span("parse"):
+            request_data = request.get_json()
+            if not request_data:
+                return {"success": False, "error": "Request data is missing"}, 400
+            fields, early_response = parse_telegram_update(request_data)
+
+        log_payload("telegram_update", request_data)
+        if early_response:
+            return early_response
+        # Lo stesso id accompagna l'update nella coda e nel payload inviato a Dialogflow
+        fields["correlation_id"] = record["correlation_id"]
+
+        if WEBHOOK_MODE == "async":
+            # Rispondiamo subito a Telegram: l'update viene elaborato in background
+            enqueue = get_message_coalescer().submit if COALESCE_MESSAGES else get_update_queue().submit
+            _, duplicate = get_update_dedup().run_once(fields["update_id"], lambda: enqueue(fields["chat_id"], fields))
+            return {"success": True, "queued": not duplicate, "duplicate": duplicate}, 200
+
+        telegram_response, duplicate = get_update_dedup().run_once(fields["update_id"], lambda: process_telegram_message(fields))
+        return {"success": True, "response": telegram_response, "duplicate": duplicate}
     except Exception as e:
         logging.error(f"Error handling telegram webhook: {e}")
         return {"success": False, "error": str(e)}, 500
 
+def create_telegram_payload(text, user_id, username, chat_id, update_id, message_id, date):
+    """Builds the Telegram payload that Dialogflow forwards to the fulfillment webhooks."""
+
+    return {
+        "data": {
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id,
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": username.split()[0] if username else "",
+                    "last_name": username.split()[-1] if username else "",
+                    "username": username,
+                    "language_code": LANGUAGE_CODE
+                },
+                "chat": {
+                    "id": chat_id,
+                    "first_name": username.split()[0] if username else "",
+                    "last_name": username.split()[-1] if username else "",
+                    "username": username,
+                    "type": "private"
+                },
+                "date": date,
+                "text": text
+            }
+        },
+        "source": "telegram",
+        # Ricevuto dai fulfillment per legare i loro tempi a questa richiesta
+        "correlation_id": get_correlation_id()
+    }
+
 def detect_intent_texts(session_id, text, user_id, username, chat_id, update_id, message_id, date):
     # logging.debug(f"detect_intent_texts called with session_id: {session_id}, text: {text}, user_id: {user_id}, username: {username}, chat_id: {chat_id}, update_id: {update_id}, message_id: {message_id}, date: {date}")
 
-    url = f"https://{REGION}-dialogflow.googleapis.com/v3/projects/{PROJECT_ID}/locations/{REGION}/agents/{AGENT_ID}/sessions/{session_id}:detectIntent"
+    project_id, agent_id = get_dialogflow_infos()
+    url = f"{DIALOGFLOW_API_URL}/v3/projects/{project_id}/locations/{REGION}/agents/{agent_id}/sessions/{session_id}:detectIntent"
 
-    # Aggiorna il token se necessario
-    auth_req = Request()
-    DIALOGFLOW_CREDENTIALS.refresh(auth_req)
-    token = DIALOGFLOW_CREDENTIALS.token
+    # Aggiorna il token solo se prossimo alla scadenza
+    with span("token_refresh"):
+        token = get_dialogflow_token_manager().get_token()
 
     headers = {
         'Authorization': f'Bearer {token}',
@@ -164,78 +363,226 @@ def detect_intent_texts(session_id, text, user_id, username, chat_id, update_id,
             }
         },
         "query_params": {
-            "payload": {
-                "data": {
-                    "update_id": update_id,
-                    "message": {
-                        "message_id": message_id,
-                        "from": {
-                            "id": user_id,
-                            "is_bot": False,
-                            "first_name": username.split()[0] if username else "",
-                            "last_name": username.split()[-1] if username else "",
-                            "username": username,
-                            "language_code": LANGUAGE_CODE
-                        },
-                        "chat": {
-                            "id": chat_id,
-                            "first_name": username.split()[0] if username else "",
-                            "last_name": username.split()[-1] if username else "",
-                            "username": username,
-                            "type": "private"
-                        },
-                        "date": date,
-                        "text": text
-                    }
-                },
-                "source": "telegram"
-            }
+            "payload": create_telegram_payload(text, user_id, username, chat_id, update_id, message_id, date)
         }
     }
     
-    response = requests.post(url, headers=headers, json=data)
-    logging.debug(f"Ricevuta risposta da Dialogflow: {response.status_code} {response.text}")
+    response = http_client.post("dialogflow", url, headers=headers, json=data)
     return response.json()
 
 def send_message_to_telegram(chat_id, text):
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{get_telegram_bot_token()}/sendMessage"
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    # I testi oltre il limite di Telegram vengono divisi in più messaggi
+    for chunk in split_message(text):
+        payload = {
+            'chat_id': chat_id,
+            'text': chunk
+        }
+        response = http_client.post("telegram", url, headers=headers, json=payload)
+    telegram_response = response.json()
+    log_payload("telegram_response", telegram_response)
+    return telegram_response
+
+def edit_message_text(chat_id, message_id, text):
+    url = f"{TELEGRAM_API_URL}/bot{get_telegram_bot_token()}/editMessageText"
     payload = {
         'chat_id': chat_id,
+        'message_id': message_id,
         'text': text
     }
     headers = {
         'Content-Type': 'application/json'
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-    logging.debug(f"Ricevuta risposta da Telegram: {response.status_code} {response.text}")
+    response = http_client.post("telegram", url, headers=headers, json=payload)
     return response.json()
 
-# Reference to grocery list in database
-grocery_list_ref = db.reference("grocery_list")
+def stream_to_telegram(chat_id, texts):
+    """Shows each successive version of a text in the chat, editing the sent messages."""
+
+    stream = TelegramMessageStream(
+        send=lambda text: send_message_to_telegram(chat_id, text).get("result", {}).get("message_id"),
+        edit=lambda message_id, text: edit_message_text(chat_id, message_id, text),
+    )
+    for text in texts:
+        stream.update(text)
+    return stream.finish()
+
+# Versione asincrona della pipeline: un solo processo gestisce molti update in corso
+# senza un thread per richiesta (il client aiohttp viene importato solo da queste funzioni)
+
+# Telegram mostra un'azione della chat per 5 secondi: viene ripetuta finché la risposta non è pronta
+TYPING_REFRESH = 4.5
+
+async def detect_intent_texts_async(session_id, text, user_id, username, chat_id, update_id, message_id, date):
+    import async_http_client
+
+    project_id, agent_id = get_dialogflow_infos()
+    url = f"{DIALOGFLOW_API_URL}/v3/projects/{project_id}/locations/{REGION}/agents/{agent_id}/sessions/{session_id}:detectIntent"
+
+    # Il rinnovo del token è bloccante: avviene in un thread
+    with span("token_refresh"):
+        token = await asyncio.to_thread(get_dialogflow_token_manager().get_token)
+
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json'
+    }
+
+    data = {
+        "query_input": {
+            "language_code": LANGUAGE_CODE,
+            "text": {
+                "text": text,
+            }
+        },
+        "query_params": {
+            "payload": create_telegram_payload(text, user_id, username, chat_id, update_id, message_id, date)
+        }
+    }
+
+    response = await async_http_client.post("dialogflow", url, headers=headers, json=data)
+    return response.json()
+
+async def send_message_to_telegram_async(chat_id, text):
+    import async_http_client
+
+    url = f"{TELEGRAM_API_URL}/bot{get_telegram_bot_token()}/sendMessage"
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    for chunk in split_message(text):
+        payload = {
+            'chat_id': chat_id,
+            'text': chunk
+        }
+        response = await async_http_client.post("telegram", url, headers=headers, json=payload)
+    telegram_response = response.json()
+    log_payload("telegram_response", telegram_response)
+    return telegram_response
+
+async def send_chat_action_async(chat_id, action="typing"):
+    import async_http_client
+
+    url = f"{TELEGRAM_API_URL}/bot{get_telegram_bot_token()}/sendChatAction"
+    payload = {
+        'chat_id': chat_id,
+        'action': action
+    }
+    response = await async_http_client.post("telegram", url, json=payload)
+    return response.json()
+
+async def keep_typing_async(chat_id):
+    """Shows "typing…" in the chat until cancelled."""
+
+    try:
+        while True:
+            await send_chat_action_async(chat_id)
+            metrics.increment("telegram.chat_actions")
+            await asyncio.sleep(TYPING_REFRESH)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # L'indicatore è solo un aiuto: un errore non deve fermare la risposta
+        logging.warning(f"sendChatAction failed for chat {chat_id}: {e}")
+
+async def process_telegram_message_async(fields):
+    """Async version of process_telegram_message that shows "typing…" while the reply is prepared."""
+
+    with request_record("telegram_update", fields.get("correlation_id")):
+        return await _process_telegram_message_async(fields)
+
+async def _process_telegram_message_async(fields):
+    chat_id = fields["chat_id"]
+    session_id = str(chat_id)
+
+    # L'indicatore parte insieme alla richiesta a Dialogflow, non dopo
+    typing = asyncio.create_task(keep_typing_async(chat_id))
+    try:
+        route = get_intent_router().route(fields["text"]) if FAST_PATH_ENABLED else None
+        if route is not None:
+            # I fulfillment sono sincroni: vengono eseguiti in un thread per non bloccare l'event loop
+            response_messages = await asyncio.to_thread(run_fast_path, fields, route)
+        else:
+            with span("detect_intent"):
+                dialogflow_response = await detect_intent_texts_async(session_id, fields["text"], fields["user_id"], fields["username"],
+                                                                      chat_id, fields["update_id"], fields["message_id"], fields["date"])
+            log_payload("dialogflow_response", dialogflow_response)
+            response_messages = dialogflow_response.get('queryResult', {}).get('responseMessages', [])
+    finally:
+        typing.cancel()
+
+    response_text = get_response_text(response_messages)
+    if response_text is None:
+        return {"ok": True, "streamed": True}
+
+    with span("send_message"):
+        return await send_message_to_telegram_async(chat_id, response_text)
+
+# Con FOODMATE_STREAM_GROCERY_VIEW=0 la lista categorizzata viene restituita solo a Dialogflow
+STREAM_GROCERY_VIEW = os.environ.get("FOODMATE_STREAM_GROCERY_VIEW", "1") == "1"
+# Con FOODMATE_GROCERY_VIEW=0 la lista viene categorizzata a ogni lettura invece di usare la vista salvata
+MATERIALIZED_GROCERY_VIEW = os.environ.get("FOODMATE_GROCERY_VIEW", "1") == "1"
+
+@functools.lru_cache(maxsize=None)
+def get_grocery_store():
+    # Liste della spesa nel database, una per ogni chat, con cache locale all'istanza
+    # e (se abilitata) la vista per sezioni aggiornata a ogni scrittura
+    categorize = categorize_known_items if MATERIALIZED_GROCERY_VIEW else None
+    return GroceryStore(db_reference("grocery_lists"), GroceryListCache(), categorize=categorize)
+
+def categorize_known_items(items):
+    """Returns item -> section for the items known to the lexicon or the category cache (no model call)."""
+
+    return resolve_known_items(items, get_category_cache(), get_local_categorizer())[0]
+
+def save_grocery_view(session_id, categories):
+    """Stores the rebuilt view of a list; a failure only costs a rebuild at the next view."""
+
+    try:
+        get_grocery_store().save_view(session_id, categories)
+    except Exception as e:
+        logging.warning(f"Saving the grocery list view of {session_id} failed: {e}")
+
+@functools.lru_cache(maxsize=None)
+def get_category_cache():
+    # Sezioni del supermercato già assegnate agli elementi (condivise tra le istanze)
+    return CategoryCache(db_reference("item_categories"))
+
+@functools.lru_cache(maxsize=None)
+def get_local_categorizer():
+    # Lessico locale per categorizzare gli elementi comuni senza chiamare Gemini
+    return LocalCategorizer.from_file()
+
+def get_chat_id(request_data):
+    """Returns the Telegram chat id carried in the payload of a Dialogflow webhook request."""
+
+    return (request_data or {}).get("payload", {}).get("data", {}).get("message", {}).get("chat", {}).get("id")
+
+def get_session_id(request_data):
+    """Returns the chat session of a Dialogflow webhook request (the Telegram chat id)."""
+
+    session = (request_data or {}).get("sessionInfo", {}).get("session", "")
+    if session:
+        return session.rsplit("/", 1)[-1]
+    chat_id = get_chat_id(request_data)
+    return str(chat_id) if chat_id else "default"
 
 # HTTP REQUEST: add new elements to grocery list
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
-def add_to_grocery_list(request):
+def fulfill_add_to_grocery_list(request_data):
     try:
-        request_data = request.get_json()
         if request_data is None:
             return {"success": False, "error": "Request data is missing"}, 400
 
         parameters = request_data.get("intentInfo", {}).get("parameters", {})
         items_to_add = parameters.get("item", {}).get("resolvedValue", [])
 
-        current_items = grocery_list_ref.get()
-        if current_items is None:
-            current_items = []
-        else:
-            current_items = list(current_items.values())
-
-        items_added = []
-        for item in items_to_add:
-            if item not in current_items:
-                grocery_list_ref.push(item)
-                items_added.append(item)
+        items_added = get_grocery_store().add_items(get_session_id(request_data), items_to_add)
 
         if not items_added:
             response_no_items_added = create_dialogflow_response("No element was added to grocery list. They were all already in.")
@@ -249,33 +596,25 @@ def add_to_grocery_list(request):
         response_error = create_dialogflow_response(f"Error adding new items: {e}")
         return response_error, 500
 
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["post"]))
+@instrumented_handler("add_to_grocery_list")
+def add_to_grocery_list(request):
+    return fulfill_add_to_grocery_list(request.get_json(silent=True))
+
 # HTTP REQUEST: remove (given strings) elements from the grocery list
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["delete"]))
-def remove_from_grocery_list(request):
+def fulfill_remove_from_grocery_list(request_data):
     try:
-        request_data = request.get_json()
         if request_data is None:
             return {"success": False, "error": "Request data is missing"}, 400
 
         parameters = request_data.get("intentInfo", {}).get("parameters", {})
         items_to_remove = parameters.get("item", {}).get("resolvedValue", [])
 
-        current_items = grocery_list_ref.get()
-        if current_items is None:
+        items_removed = get_grocery_store().remove_items(get_session_id(request_data), items_to_remove)
+        if items_removed is None:
             response_no_items_ = create_dialogflow_response("The grocery list is already empty!")
             return response_no_items_
         else:
-            current_items = list(current_items.values())
-            items_removed = []
-
-            for item in items_to_remove:
-                if item in current_items:
-                    query_result = grocery_list_ref.order_by_value().equal_to(item).get()
-                    for key, value in query_result.items():
-                        if value == item:
-                            grocery_list_ref.child(key).delete()
-                            items_removed.append(item)
-
             if not items_removed:
                 response_no_items_removed = create_dialogflow_response("No element was removed from grocery list. They were not in.")
                 return response_no_items_removed
@@ -288,34 +627,73 @@ def remove_from_grocery_list(request):
         response_error = create_dialogflow_response(f"Error removing items: {e}")
         return response_error, 500
 
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["delete"]))
+@instrumented_handler("remove_from_grocery_list")
+def remove_from_grocery_list(request):
+    return fulfill_remove_from_grocery_list(request.get_json(silent=True))
+
 # HTTP REQUEST: view grocery list
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
-def view_grocery_list(request):
+def fulfill_view_grocery_list(request_data):
     try:
-        grocery_list = grocery_list_ref.get()
-        if grocery_list is None or not grocery_list.values():
+        session_id = get_session_id(request_data)
+        grocery_view = get_grocery_store().get_view(session_id) if MATERIALIZED_GROCERY_VIEW else None
+        if grocery_view is not None and grocery_view["text"]:
+            # Vista aggiornata: una sola lettura, nessuna categorizzazione
+            return create_dialogflow_response(grocery_view["text"])
+
+        grocery_list = grocery_view["items"] if grocery_view is not None else get_grocery_store().get_items(session_id)
+        if not grocery_list:
             response_no_items_in_the_list = create_dialogflow_response("The grocery list is empty.")
             return response_no_items_in_the_list
 
         items_in = list(grocery_list.values())
-        response_categorized_items = create_dialogflow_response(categorize_grocery_list(items_in))
+        # Solo gli elementi sconosciuti al lessico e mai visti vengono inviati a Gemini
+        snapshots = categorize_items_stream(items_in, get_category_cache(), get_local_categorizer())
+        categories = next(snapshots)
+
+        chat_id = get_chat_id(request_data)
+        if STREAM_GROCERY_VIEW and chat_id and PENDING_SECTION in categories.values():
+            # La lista viene mostrata subito e aggiornata man mano che Gemini risponde
+            last = [categories]
+            def render_snapshots():
+                for snapshot in itertools.chain([categories], snapshots):
+                    last[0] = snapshot
+                    yield render_sections(group_by_section(snapshot))
+                if PENDING_SECTION in last[0].values():
+                    # Elementi senza risposta del modello: mostrati in "Other"
+                    yield render_sections(group_by_section(with_fallback(last[0])))
+            stream_to_telegram(chat_id, render_snapshots())
+            if MATERIALIZED_GROCERY_VIEW:
+                # Gli elementi senza risposta restano in attesa nella vista e vengono richiesti alla prossima lettura
+                save_grocery_view(session_id, last[0])
+            return create_streamed_dialogflow_response()
+
+        for categories in snapshots:
+            pass
+        if MATERIALIZED_GROCERY_VIEW:
+            save_grocery_view(session_id, categories)
+        response_categorized_items = create_dialogflow_response(render_sections(group_by_section(with_fallback(categories))))
         return response_categorized_items
 
+    except UpstreamOverloaded:
+        return create_dialogflow_response(OVERLOAD_MESSAGE)
     except Exception as e:
         print("Error reading items from grocery list:", e)
         response_error = create_dialogflow_response(f"Error reading items from grocery list: {e}")
         return response_error, 500
 
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
+@instrumented_handler("view_grocery_list")
+def view_grocery_list(request):
+    return fulfill_view_grocery_list(request.get_json(silent=True))
+
 # HTTP REQUEST: clear grocery list
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["delete"]))
-def clear_grocery_list(request):
+def fulfill_clear_grocery_list(request_data):
     try:
-        current_items = grocery_list_ref.get()
-        if current_items is None:
+        if not get_grocery_store().clear(get_session_id(request_data)):
             response_no_items_ = create_dialogflow_response("The grocery list is already empty!")
             return response_no_items_
         else:
-            grocery_list_ref.delete()
             response_success_delete = create_dialogflow_response("All items removed from grocery list successfully.")
             return response_success_delete
     except Exception as e:
@@ -323,19 +701,25 @@ def clear_grocery_list(request):
         response_error = create_dialogflow_response(f"Error removing all items from grocery list: {e}")
         return response_error, 500
 
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["delete"]))
+@instrumented_handler("clear_grocery_list")
+def clear_grocery_list(request):
+    return fulfill_clear_grocery_list(request.get_json(silent=True))
+
 # HTTP REQUEST: get nutrition analysis from Edamam.com API
-@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
-def get_nutrition_analysis_single_ingredient(request):
+def fulfill_get_nutrition_analysis_single_ingredient(request_data):
     try:
-        request_data = request.get_json()
         if request_data is None:
             return {"success": False, "error": "Request data is missing"}, 400
 
         parameters = request_data.get("intentInfo", {}).get("parameters", {})
         item_to_analyze = parameters.get("item", {}).get("resolvedValue", [])
-        logging.debug(f"item to analyze: {item_to_analyze}")
-        nutrition_data = get_nutrition_data(item_to_analyze)
-        logging.debug(f"nutrition_data : {nutrition_data }")
+        if isinstance(item_to_analyze, list) and len(item_to_analyze) > 1:
+            # Più ingredienti: analisi in parallelo con i totali
+            nutrition_data = get_nutrition_data_batch(item_to_analyze)
+        else:
+            nutrition_data = get_nutrition_data(item_to_analyze)
+        log_payload("nutrition_data", nutrition_data)
         response_nutrition_data = create_dialogflow_response(f"{nutrition_data}")
 
         return response_nutrition_data
@@ -344,18 +728,44 @@ def get_nutrition_analysis_single_ingredient(request):
         response_error = create_dialogflow_response(f"Error analyzing nutrition data: {e}")
         return response_error, 500
 
-# HTTP REQUEST: get recipes searching from Edamam.com API
 @https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
-def get_recipes_search(request):
+@instrumented_handler("get_nutrition_analysis_single_ingredient")
+def get_nutrition_analysis_single_ingredient(request):
+    return fulfill_get_nutrition_analysis_single_ingredient(request.get_json(silent=True))
+
+# HTTP REQUEST: get nutrition analysis of the whole grocery list from Edamam.com API
+def fulfill_get_nutrition_analysis_grocery_list(request_data):
+    try:
+        grocery_list = get_grocery_store().get_items(get_session_id(request_data))
+        if not grocery_list:
+            response_no_items_in_the_list = create_dialogflow_response("The grocery list is empty.")
+            return response_no_items_in_the_list
+
+        nutrition_data = get_nutrition_data_batch(list(grocery_list.values()))
+        response_nutrition_data = create_dialogflow_response(f"{nutrition_data}")
+        return response_nutrition_data
+    except Exception as e:
+        print("Error analyzing nutrition data of the grocery list:", e)
+        response_error = create_dialogflow_response(f"Error analyzing nutrition data of the grocery list: {e}")
+        return response_error, 500
+
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
+@instrumented_handler("get_nutrition_analysis_grocery_list")
+def get_nutrition_analysis_grocery_list(request):
+    return fulfill_get_nutrition_analysis_grocery_list(request.get_json(silent=True))
+
+# HTTP REQUEST: get recipes searching from Edamam.com API
+def fulfill_get_recipes_search(request_data):
     try:
-        request_data = request.get_json()
         if request_data is None:
             return {"success": False, "error": "Request data is missing"}, 400
 
         parameters = request_data.get("intentInfo", {}).get("parameters", {})
         item_to_search_recipe = parameters.get("item", {}).get("resolvedValue", [])
+        # Pagina di risultati richiesta ("more recipes"), la prima se non indicata
+        page = int(parameters.get("page", {}).get("resolvedValue", 1) or 1)
 
-        recipe_data = get_recipe_data(item_to_search_recipe)
+        recipe_data = get_recipe_data(item_to_search_recipe, page)
         response_recipe_data = create_dialogflow_response(f"{recipe_data}")
 
         return response_recipe_data
@@ -363,3 +773,70 @@ def get_recipes_search(request):
         print("Error searching recipes data:", e)
         response_error = create_dialogflow_response(f"Error searching recipes data: {e}")
         return response_error, 500
+
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
+@instrumented_handler("get_recipes_search")
+def get_recipes_search(request):
+    return fulfill_get_recipes_search(request.get_json(silent=True))
+
+# HTTP REQUEST: get recipes that use the items of the grocery list
+def fulfill_get_recipes_from_grocery_list(request_data):
+    try:
+        grocery_list = get_grocery_store().get_items(get_session_id(request_data))
+        if not grocery_list:
+            response_no_items_in_the_list = create_dialogflow_response("The grocery list is empty.")
+            return response_no_items_in_the_list
+
+        recipe_data = get_recipes_from_list(list(grocery_list.values()))
+        response_recipe_data = create_dialogflow_response(f"{recipe_data}")
+        return response_recipe_data
+    except Exception as e:
+        print("Error searching recipes for the grocery list:", e)
+        response_error = create_dialogflow_response(f"Error searching recipes for the grocery list: {e}")
+        return response_error, 500
+
+@https_fn.on_request(cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
+@instrumented_handler("get_recipes_from_grocery_list")
+def get_recipes_from_grocery_list(request):
+    return fulfill_get_recipes_from_grocery_list(request.get_json(silent=True))
+
+# Con FOODMATE_FAST_PATH=0 ogni messaggio passa da Dialogflow
+FAST_PATH_ENABLED = os.environ.get("FOODMATE_FAST_PATH", "1") == "1"
+
+# Fulfillment raggiungibili dal percorso veloce, per nome dell'intent
+FAST_PATH_FULFILLMENTS = {
+    "add_to_grocery_list": fulfill_add_to_grocery_list,
+    "remove_from_grocery_list": fulfill_remove_from_grocery_list,
+    "view_grocery_list": fulfill_view_grocery_list,
+    "clear_grocery_list": fulfill_clear_grocery_list,
+    "get_nutrition_analysis_single_ingredient": fulfill_get_nutrition_analysis_single_ingredient,
+    "get_nutrition_analysis_grocery_list": fulfill_get_nutrition_analysis_grocery_list,
+    "get_recipes_search": fulfill_get_recipes_search,
+    "get_recipes_from_grocery_list": fulfill_get_recipes_from_grocery_list,
+}
+
+@functools.lru_cache(maxsize=None)
+def get_intent_router():
+    """Loads the fast-path routes and checks that every intent has a fulfillment."""
+
+    router = IntentRouter.from_file()
+    unknown = router.intents() - FAST_PATH_FULFILLMENTS.keys()
+    if unknown:
+        raise ValueError(f"No fulfillment for fast-path intents: {sorted(unknown)}")
+    return router
+
+def fulfill_locally(session_id, intent, parameters, payload):
+    """Runs the fulfillment of a fast-path intent in-process and returns its response messages."""
+
+    request_data = {
+        "sessionInfo": {"session": session_id},
+        "intentInfo": {"displayName": intent, "parameters": parameters},
+        "payload": payload,
+    }
+    result = FAST_PATH_FULFILLMENTS[intent](request_data)
+    # Stesso formato della risposta di un webhook: stringa JSON, eventualmente con lo status HTTP
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result.get("fulfillment_response", {}).get("messages", [])
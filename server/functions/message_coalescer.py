@@ -0,0 +1,194 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+
+# Finestra di attesa (secondi) dopo l'ultimo messaggio di una chat: iniziale, minima e massima
+COALESCE_WINDOW = float(os.environ.get("FOODMATE_COALESCE_WINDOW", "1.0"))
+COALESCE_MIN_WINDOW = float(os.environ.get("FOODMATE_COALESCE_MIN_WINDOW", "0.3"))
+COALESCE_MAX_WINDOW = float(os.environ.get("FOODMATE_COALESCE_MAX_WINDOW", "3.0"))
+# La finestra è questo multiplo dell'intervallo medio tra i messaggi della chat
+COALESCE_GAP_FACTOR = 1.5
+# Peso dell'ultimo intervallo nella media mobile della velocità di scrittura
+GAP_SMOOTHING = 0.3
+
+# Messaggi che proseguono il precedente: "and eggs", ", bread", "also some rice"
+_CONTINUATION = re.compile(r"^\s*(?:(?:and|also|plus)\b|&|,)\s*", re.I)
+# Richieste che, ripetute, si uniscono in una sola con tutti gli elementi
+MERGEABLE_VERBS = {"add", "remove", "delete", "buy"}
+# Destinazione finale di una richiesta: "add milk to my list", "remove eggs from the shopping list"
+_LIST_SUFFIX = re.compile(r"\s+(?:to|from|on)(?: my| the)?(?: grocery| shopping)? list\W*$", re.I)
+
+
+def _split_suffix(text):
+    suffix = _LIST_SUFFIX.search(text)
+    if suffix is None:
+        return text.strip(), ""
+    return text[:suffix.start()].strip(), text[suffix.start():].rstrip()
+
+
+def _append_items(previous, items):
+    # Gli elementi vanno prima del suffisso "to my list", che resta in fondo
+    previous, previous_suffix = _split_suffix(previous)
+    items, items_suffix = _split_suffix(items)
+    return f"{previous}, {items}{previous_suffix or items_suffix}"
+
+
+def merge_texts(previous, text):
+    """Merges a follow-up message into the previous text, or returns None if it starts a new request.
+
+    "add milk" + "and eggs" -> "add milk, eggs"; "add milk to my list" +
+    "add eggs" -> "add milk, eggs to my list"; "add milk" + "show my list"
+    -> None. Follow-ups are merged only into requests that start with a
+    MERGEABLE_VERBS verb.
+    """
+
+    if " ".join(text.lower().split()) == " ".join(previous.lower().split()):
+        # Messaggio ripetuto
+        return previous
+    previous_verb = previous.strip().split(" ", 1)[0].lower()
+    if previous_verb not in MERGEABLE_VERBS:
+        return None
+    continuation = _CONTINUATION.match(text)
+    if continuation:
+        rest = text[continuation.end():].strip()
+        return _append_items(previous, rest) if rest else previous
+    verb, _, rest = text.strip().partition(" ")
+    if rest and verb.lower() == previous_verb:
+        # Stessa richiesta ripetuta con altri elementi
+        return _append_items(previous, rest)
+    return None
+
+
+class _Burst:
+
+    def __init__(self, fields, now):
+        self.groups = [dict(fields)]
+        self.messages = 1
+        self.first_at = now
+        self.last_at = now
+        self.deadline = None
+
+
+class MessageCoalescer:
+    """Buffers closely spaced messages of a chat and hands them on merged.
+
+    Every message of a chat restarts the chat's wait; when no message
+    arrives for the window, the buffered messages are passed to `handler`
+    as few turns as possible: follow-ups ("and eggs", a repeated "add ...")
+    are merged into the previous message, any other message starts a new
+    turn. The window adapts to each chat: it is COALESCE_GAP_FACTOR times
+    the moving average of the gaps between the messages of its pending
+    burst, within [min_window, max_window]; the average is dropped with the
+    burst. A single thread waits for all deadlines.
+    """
+
+    def __init__(self, handler, window=COALESCE_WINDOW, min_window=COALESCE_MIN_WINDOW, max_window=COALESCE_MAX_WINDOW):
+        self._handler = handler
+        self._window = window
+        self._min_window = min_window
+        self._max_window = max_window
+        self._bursts = {}
+        self._gaps = {}
+        self._deadlines = []
+        self._changed = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def window_for(self, chat_id):
+        """Returns the current wait of a chat after its last message."""
+
+        gap = self._gaps.get(chat_id)
+        if gap is None:
+            return self._window
+        return min(self._max_window, max(self._min_window, COALESCE_GAP_FACTOR * gap))
+
+    def submit(self, chat_id, fields):
+        """Buffers a parsed message; it is handed on when the chat goes quiet."""
+
+        now = time.monotonic()
+        with self._changed:
+            burst = self._bursts.get(chat_id)
+            if burst is None:
+                burst = self._bursts[chat_id] = _Burst(fields, now)
+            else:
+                gap = now - burst.last_at
+                previous = self._gaps.get(chat_id)
+                self._gaps[chat_id] = gap if previous is None else GAP_SMOOTHING * gap + (1 - GAP_SMOOTHING) * previous
+                merged = merge_texts(burst.groups[-1]["text"], fields["text"])
+                if merged is None:
+                    burst.groups.append(dict(fields))
+                else:
+                    # Il turno unito risponde all'ultimo messaggio ricevuto
+                    burst.groups[-1] = dict(fields, text=merged)
+                burst.messages += 1
+                burst.last_at = now
+            burst.deadline = now + self.window_for(chat_id)
+            heapq.heappush(self._deadlines, (burst.deadline, id(burst), chat_id))
+            self._changed.notify()
+        metrics.increment("coalescer.messages")
+
+    def flush(self):
+        """Hands on every buffered message immediately."""
+
+        with self._changed:
+            bursts, self._bursts = self._bursts, {}
+            self._deadlines = []
+            self._gaps = {}
+        for burst in bursts.values():
+            self._hand_on(burst)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    now = time.monotonic()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        deadline, _, chat_id = heapq.heappop(self._deadlines)
+                        burst = self._bursts.get(chat_id)
+                        # Le scadenze superate da un messaggio più recente vengono scartate
+                        if burst is not None and burst.deadline == deadline:
+                            del self._bursts[chat_id]
+                            self._gaps.pop(chat_id, None)
+                            break
+                        continue
+                    self._changed.wait(self._deadlines[0][0] - now if self._deadlines else None)
+            self._hand_on(burst)
+
+    def _hand_on(self, burst):
+        metrics.increment("coalescer.turns", len(burst.groups))
+        metrics.increment("coalescer.coalesced", burst.messages - len(burst.groups))
+        metrics.observe("coalescer.delay", time.monotonic() - burst.first_at)
+        for fields in burst.groups:
+            try:
+                self._handler(fields)
+            except Exception as e:
+                logging.error(f"Handing on coalesced messages of chat {fields.get('chat_id')} failed: {e}")
+
+
+def coalescing_savings():
+    """Estimates what coalescing saved: turns, upstream calls and function-seconds.
+
+    Each merged message saves a whole turn; its cost is the average number
+    of upstream calls and the average duration of the turns processed.
+    """
+
+    snapshot = metrics.snapshot()
+    counters, timings = snapshot["counters"], snapshot["timings"]
+    saved_turns = counters.get("coalescer.coalesced", 0)
+    turn = timings.get("request.telegram_update")
+    upstream_calls = sum(
+        timing["count"] for name, timing in timings.items()
+        if (name.startswith("http.") and name.endswith(".latency")) or name in ("span.rtdb", "span.gemini")
+    )
+    calls_per_turn = upstream_calls / turn["count"] if turn else 0.0
+    return {
+        "messages": counters.get("coalescer.messages", 0),
+        "turns": counters.get("coalescer.turns", 0),
+        "saved_turns": saved_turns,
+        "saved_upstream_calls": saved_turns * calls_per_turn,
+        "saved_function_seconds": saved_turns * turn["avg"] if turn else 0.0,
+    }
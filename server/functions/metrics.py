@@ -0,0 +1,88 @@
+import threading
+from collections import defaultdict, deque
+
+# Numero massimo di campioni conservati per ogni timer (per i percentili)
+MAX_SAMPLES = 1024
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+
+def increment(name, value=1):
+    """Increments a named counter."""
+
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    """Sets a named gauge to its current value."""
+
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """Records a duration (in seconds) for a named timer."""
+
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=MAX_SAMPLES)}
+            _timings[name] = timing
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["samples"].append(seconds)
+
+
+def average(name):
+    """Returns the mean of a named timer, or None if it has no samples.
+
+    Reads only the running total and count: cheap enough for hot paths,
+    unlike snapshot(), which sorts the samples of every timer.
+    """
+
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None or not timing["count"]:
+            return None
+        return timing["total"] / timing["count"]
+
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def snapshot():
+    """Returns a copy of all counters and timer summaries."""
+
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {}
+        for name, timing in _timings.items():
+            samples = sorted(timing["samples"])
+            timings[name] = {
+                "count": timing["count"],
+                "avg": timing["total"] / timing["count"] if timing["count"] else 0.0,
+                "max": timing["max"],
+                "p50": _percentile(samples, 0.50),
+                "p95": _percentile(samples, 0.95),
+                "p99": _percentile(samples, 0.99),
+            }
+    return {"counters": counters, "gauges": gauges, "timings": timings}
+
+
+def reset():
+    """Clears all counters and timers."""
+
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
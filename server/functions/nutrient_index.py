@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+import metrics
+from local_categorizer import tokenize
+
+# Dati nutrizionali (per 100 g) degli alimenti più comuni
+FOODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrient_foods.json")
+# Database SQLite costruito dai dati al primo utilizzo (la cartella delle funzioni è in sola lettura)
+INDEX_DB_PATH = os.environ.get("FOODMATE_NUTRIENT_INDEX_DB", os.path.join(tempfile.gettempdir(), "foodmate-nutrients.sqlite"))
+# Spazio del file mappato in memoria da SQLite
+MMAP_SIZE = 16 * 1024 * 1024
+
+# Grammi per unità di massa e millilitri per unità di volume (unità già normalizzate)
+MASS_UNITS = {"g": 1.0, "kg": 1000.0, "mg": 0.001, "oz": 28.35, "lb": 453.6}
+VOLUME_UNITS = {"ml": 1.0, "l": 1000.0, "cup": 240.0, "tbsp": 15.0, "tsp": 5.0}
+WORD_QUANTITIES = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "half": 0.5, "dozen": 12,
+}
+# Parole che non cambiano l'alimento cercato
+IGNORED_WORDS = {"of", "fresh", "organic", "large", "medium", "small", "ripe", "chopped", "sliced", "diced", "peeled"}
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_FRACTION = re.compile(r"(\d+)/(\d+)")
+
+_COLUMNS = ("name", "kcal", "fat", "net_carbs", "protein", "sodium", "piece_g", "cup_g")
+
+
+def parse_quantity(text):
+    """Splits a normalized ingredient query into (quantity, unit, food).
+
+    "150 g rice" -> (150.0, "g", "rice"), "2 eggs" -> (2.0, None, "eggs"),
+    "half a cup of oats" -> (0.5, "cup", "oats"), "apple" -> (None, None, "apple").
+    """
+
+    tokens = text.split()
+    quantity = None
+    if tokens and _NUMBER.fullmatch(tokens[0]):
+        quantity = float(tokens.pop(0))
+        if tokens and _FRACTION.fullmatch(tokens[0]):
+            # Numero misto: "1 1/2"
+            numerator, denominator = _FRACTION.fullmatch(tokens.pop(0)).groups()
+            quantity += int(numerator) / int(denominator) if int(denominator) else 0
+    elif tokens and _FRACTION.fullmatch(tokens[0]):
+        numerator, denominator = _FRACTION.fullmatch(tokens.pop(0)).groups()
+        quantity = int(numerator) / int(denominator) if int(denominator) else None
+    while len(tokens) > 1 and tokens[0] in WORD_QUANTITIES:
+        # "a dozen", "half a", "two dozen"
+        quantity = (quantity or 1) * WORD_QUANTITIES[tokens.pop(0)]
+
+    unit = None
+    if len(tokens) > 1 and (tokens[0] in MASS_UNITS or tokens[0] in VOLUME_UNITS):
+        unit = tokens.pop(0)
+    return quantity, unit, " ".join(tokens)
+
+
+def food_key(food):
+    """Returns the index key of a food name (singular tokens without filler words)."""
+
+    return " ".join(token for token in tokenize(food) if token not in IGNORED_WORDS)
+
+
+def grams_of(quantity, unit, piece_g, cup_g):
+    """Converts a parsed quantity of a food to grams, or returns None if it cannot."""
+
+    if unit in MASS_UNITS:
+        return (quantity or 1) * MASS_UNITS[unit]
+    if unit in VOLUME_UNITS:
+        # Densità ricavata dal peso di una tazza, altrimenti quella dell'acqua
+        density = cup_g / VOLUME_UNITS["cup"] if cup_g else 1.0
+        return (quantity or 1) * VOLUME_UNITS[unit] * density
+    if piece_g:
+        return (quantity or 1) * piece_g
+    # Senza quantità si riportano i valori per 100 g
+    return 100.0 if quantity is None else None
+
+
+class NutrientIndex:
+    """Local nutrient database of common foods, in a read-mostly SQLite file.
+
+    The file is built from FOODS_PATH on first use (and rebuilt when the
+    data version changes), opened once and shared by every request; reads
+    go through SQLite's memory-mapped I/O. Lookups scale the per-100 g
+    values to the parsed quantity and return the same fields as the Edamam
+    nutrition-data parser. Foods learned from Edamam can be added with
+    learn().
+    """
+
+    def __init__(self, path=INDEX_DB_PATH, foods_path=FOODS_PATH):
+        self._path = path
+        self._foods_path = foods_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            with open(self._foods_path, "r") as f:
+                data = json.load(f)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            if conn.execute("PRAGMA user_version").fetchone()[0] != data["version"]:
+                self._build(conn, data)
+            conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            self._conn = conn
+        return self._conn
+
+    def _build(self, conn, data):
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS foods")
+            conn.execute(
+                "CREATE TABLE foods (key TEXT PRIMARY KEY, name TEXT, kcal REAL, fat REAL, net_carbs REAL,"
+                " protein REAL, sodium REAL, piece_g REAL, cup_g REAL, source TEXT) WITHOUT ROWID"
+            )
+            rows = {food_key(name): (name, *values) for name, values in data["foods"].items()}
+            for alias, name in data["aliases"].items():
+                rows.setdefault(food_key(alias), rows[food_key(name)])
+            conn.executemany(
+                "INSERT INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'local')",
+                [(key, *row) for key, row in rows.items()],
+            )
+            conn.execute(f"PRAGMA user_version = {int(data['version'])}")
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM foods WHERE key = ?", (key,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def lookup(self, ingredient):
+        """Returns the nutrition fields of a normalized ingredient query, or None if unknown."""
+
+        quantity, unit, food = parse_quantity(ingredient)
+        food = self._get(food_key(food)) if food else None
+        grams = grams_of(quantity, unit, food["piece_g"], food["cup_g"]) if food else None
+        if grams is None:
+            metrics.increment("nutrient_index.misses")
+            return None
+        metrics.increment("nutrient_index.hits")
+
+        scale = grams / 100
+        fat, net_carbs, protein = food["fat"] * scale, food["net_carbs"] * scale, food["protein"] * scale
+        return {
+            "food_name": food["name"],
+            "cautions": [],
+            "calories": {"quantity": round(food["kcal"] * scale), "unit": "kcal"},
+            "FAT": {"quantity": round(fat, 2), "unit": "g"},
+            "Carbohydrates (net)": {"quantity": round(net_carbs, 2), "unit": "g"},
+            "Protein": {"quantity": round(protein, 2), "unit": "g"},
+            "Sodium (NA)": {"quantity": round(food["sodium"] * scale, 2), "unit": "mg"},
+            "totalNutrientsKCal": {
+                "ENERC_KCAL": {"label": "Energy", "quantity": round(food["kcal"] * scale), "unit": "kcal"},
+                "PROCNT_KCAL": {"label": "Calories from protein", "quantity": round(4 * protein), "unit": "kcal"},
+                "FAT_KCAL": {"label": "Calories from fat", "quantity": round(9 * fat), "unit": "kcal"},
+                "CHOCDF_KCAL": {"label": "Calories from carbohydrates", "quantity": round(4 * net_carbs), "unit": "kcal"},
+            },
+        }
+
+    def learn(self, ingredient, filtered_data):
+        """Stores an Edamam result in the index, if its weight is known.
+
+        Only queries with an explicit mass ("150 g quinoa") can be turned
+        into per-100 g values; returns whether the food was stored.
+        """
+
+        quantity, unit, food = parse_quantity(ingredient)
+        key = food_key(food)
+        calories = filtered_data.get("calories")
+        if unit not in MASS_UNITS or not quantity or not key or not calories or filtered_data.get("food_name") in (None, "Unknown"):
+            return False
+        per_100g = 100 / (quantity * MASS_UNITS[unit])
+        values = [calories["quantity"] * per_100g]
+        for field in ("FAT", "Carbohydrates (net)", "Protein", "Sodium (NA)"):
+            value = filtered_data.get(field)
+            values.append(value["quantity"] * per_100g if value else 0.0)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # I dati locali non vengono mai sovrascritti
+                conn.execute(
+                    "INSERT OR IGNORE INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, 'edamam')",
+                    (key, filtered_data["food_name"], *values),
+                )
+        metrics.increment("nutrient_index.learned")
+        return True
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import http_client
+import metrics
+from update_queue import UpdateQueue
+
+# Elaborazioni contemporanee (su chat diverse), update per batch e durata del long polling
+POLL_WORKERS = int(os.environ.get("FOODMATE_POLL_WORKERS", "8"))
+POLL_BATCH_SIZE = int(os.environ.get("FOODMATE_POLL_BATCH_SIZE", "100"))
+POLL_TIMEOUT = int(os.environ.get("FOODMATE_POLL_TIMEOUT", "30"))
+# Attesa dopo un errore di getUpdates prima di riprovare
+POLL_ERROR_DELAY = 2.0
+# Modalità asincrona: update elaborati contemporaneamente nello stesso processo
+ASYNC_MAX_INFLIGHT = int(os.environ.get("FOODMATE_ASYNC_MAX_INFLIGHT", "256"))
+
+
+def claim_new_updates(updates, parse, dedup=None):
+    """Parses a batch of updates and returns the fields of those not processed yet.
+
+    With a deduplicator (the webhook's one) every update_id is claimed before
+    it is queued, so a batch delivered again after a crash is not processed
+    twice when the seen update_ids are shared (FOODMATE_DEDUP_SHARED=1).
+    """
+
+    batch = []
+    for update in updates:
+        fields, _ = parse(update)
+        if fields is None:
+            continue
+        if dedup is not None:
+            _, duplicate = dedup.run_once(fields["update_id"], lambda: None)
+            if duplicate:
+                continue
+        batch.append(fields)
+    return batch
+
+
+class TelegramPoller:
+    """Receives Telegram updates with getUpdates long polling instead of the webhook.
+
+    Each batch is parsed with the webhook's parse function and processed by
+    an UpdateQueue: different chats run concurrently, updates of the same
+    chat in order. The offset that confirms a batch to Telegram is sent only
+    once the whole batch has been processed, so updates of a crashed process
+    are delivered again; `dedup` skips those already claimed.
+    """
+
+    def __init__(self, get_updates, parse, handler, workers=POLL_WORKERS, batch_size=POLL_BATCH_SIZE, poll_timeout=POLL_TIMEOUT, dedup=None):
+        self._get_updates = get_updates
+        self._parse = parse
+        self._dedup = dedup
+        self._queue = UpdateQueue(handler, workers=workers)
+        self._batch_size = batch_size
+        self._poll_timeout = poll_timeout
+        self._stopped = threading.Event()
+        self.offset = None
+
+    def poll_once(self):
+        """Fetches and processes one batch; returns the number of updates received."""
+
+        updates = self._get_updates(self.offset, self._batch_size, self._poll_timeout)
+        if not updates:
+            return 0
+        start = time.perf_counter()
+        for fields in claim_new_updates(updates, self._parse, self._dedup):
+            self._queue.submit(fields["chat_id"], fields)
+        self._queue.join()
+        self.offset = max(update["update_id"] for update in updates) + 1
+        metrics.increment("polling.updates", len(updates))
+        metrics.observe("polling.batch_time", time.perf_counter() - start)
+        return len(updates)
+
+    def run(self):
+        """Polls until stop() is called."""
+
+        while not self._stopped.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                metrics.increment("polling.errors")
+                logging.error(f"Polling Telegram updates failed: {e}")
+                self._stopped.wait(POLL_ERROR_DELAY)
+
+    def stop(self):
+        """Stops polling after the batch being processed."""
+
+        self._stopped.set()
+
+
+class AsyncUpdateProcessor:
+    """Processes updates as asyncio tasks in the running event loop.
+
+    Like UpdateQueue, updates of different chats run concurrently and
+    updates of the same chat in order, but without a thread per update:
+    at most max_inflight handlers run at once.
+    """
+
+    def __init__(self, handler, max_inflight=ASYNC_MAX_INFLIGHT):
+        self._handler = handler
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._last_tasks = {}
+
+    def submit(self, chat_id, update):
+        """Schedules an update after the previous one of the same chat."""
+
+        previous = self._last_tasks.get(chat_id)
+        task = asyncio.create_task(self._process(previous, update))
+        self._last_tasks[chat_id] = task
+        task.add_done_callback(lambda done: self._last_tasks.pop(chat_id) if self._last_tasks.get(chat_id) is done else None)
+        metrics.set_gauge("polling.inflight", len(self._last_tasks))
+        return task
+
+    async def _process(self, previous, update):
+        if previous is not None:
+            # L'esito dell'update precedente non conta, solo l'ordine
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            try:
+                await self._handler(update)
+            except Exception as e:
+                metrics.increment("polling.errors")
+                logging.error(f"Processing update {update.get('update_id')} failed: {e}")
+
+    async def join(self):
+        """Waits until every submitted update has been processed."""
+
+        while self._last_tasks:
+            await asyncio.wait(list(self._last_tasks.values()))
+
+
+class AsyncTelegramPoller:
+    """Async version of TelegramPoller: getUpdates and the updates run in one event loop."""
+
+    def __init__(self, get_updates, parse, handler, max_inflight=ASYNC_MAX_INFLIGHT, batch_size=POLL_BATCH_SIZE, poll_timeout=POLL_TIMEOUT, dedup=None):
+        self._get_updates = get_updates
+        self._parse = parse
+        self._dedup = dedup
+        self._processor = AsyncUpdateProcessor(handler, max_inflight=max_inflight)
+        self._batch_size = batch_size
+        self._poll_timeout = poll_timeout
+        self._stopped = False
+        self.offset = None
+
+    async def poll_once(self):
+        """Fetches and processes one batch; returns the number of updates received."""
+
+        updates = await self._get_updates(self.offset, self._batch_size, self._poll_timeout)
+        if not updates:
+            return 0
+        start = time.perf_counter()
+        # Il claim sullo store condiviso è bloccante: fuori dall'event loop
+        batch = await asyncio.to_thread(claim_new_updates, updates, self._parse, self._dedup)
+        for fields in batch:
+            self._processor.submit(fields["chat_id"], fields)
+        await self._processor.join()
+        self.offset = max(update["update_id"] for update in updates) + 1
+        metrics.increment("polling.updates", len(updates))
+        metrics.observe("polling.batch_time", time.perf_counter() - start)
+        return len(updates)
+
+    async def run(self):
+        """Polls until stop() is called."""
+
+        import async_http_client
+
+        try:
+            while not self._stopped:
+                try:
+                    await self.poll_once()
+                except Exception as e:
+                    metrics.increment("polling.errors")
+                    logging.error(f"Polling Telegram updates failed: {e}")
+                    await asyncio.sleep(POLL_ERROR_DELAY)
+        finally:
+            await async_http_client.close()
+
+    def stop(self):
+        """Stops polling after the batch being processed."""
+
+        self._stopped = True
+
+
+def telegram_get_updates(offset, limit, timeout):
+    """Calls getUpdates on the Telegram Bot API and returns the list of updates."""
+
+    import main
+
+    params = {"limit": limit, "timeout": timeout}
+    if offset is not None:
+        params["offset"] = offset
+    url = f"{main.TELEGRAM_API_URL}/bot{main.get_telegram_bot_token()}/getUpdates"
+    # Il timeout di lettura deve superare la durata del long polling
+    response = http_client.get("telegram", url, params=params, timeout=(3.05, timeout + 10))
+    result = response.json()
+    if not result.get("ok"):
+        raise RuntimeError(f"getUpdates failed: {result.get('description', response.status_code)}")
+    return result["result"]
+
+
+async def telegram_get_updates_async(offset, limit, timeout):
+    """Async version of telegram_get_updates."""
+
+    import async_http_client
+    import main
+
+    params = {"limit": limit, "timeout": timeout}
+    if offset is not None:
+        params["offset"] = offset
+    url = f"{main.TELEGRAM_API_URL}/bot{main.get_telegram_bot_token()}/getUpdates"
+    response = await async_http_client.get("telegram", url, params=params, timeout=(3.05, timeout + 10))
+    result = response.json()
+    if not result.get("ok"):
+        raise RuntimeError(f"getUpdates failed: {result.get('description', response.status_code)}")
+    return result["result"]
+
+
+def create_poller(**kwargs):
+    """Returns a poller that runs updates through the same pipeline as telegram_webhook."""
+
+    import main
+
+    kwargs.setdefault("dedup", main.get_update_dedup())
+    return TelegramPoller(telegram_get_updates, main.parse_telegram_update, main.process_telegram_message, **kwargs)
+
+
+def create_async_poller(**kwargs):
+    """Returns an async poller that runs updates through process_telegram_message_async."""
+
+    import main
+
+    kwargs.setdefault("dedup", main.get_update_dedup())
+    return AsyncTelegramPoller(telegram_get_updates_async, main.parse_telegram_update, main.process_telegram_message_async, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the bot with getUpdates long polling.")
+    parser.add_argument("--workers", type=int, default=POLL_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=POLL_BATCH_SIZE)
+    parser.add_argument("--timeout", type=int, default=POLL_TIMEOUT)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="process updates in one event loop")
+    parser.add_argument("--max-inflight", type=int, default=ASYNC_MAX_INFLIGHT)
+    args = parser.parse_args()
+
+    # getUpdates non funziona finché è impostato un webhook (rimuoverlo con deleteWebhook)
+    if args.use_async:
+        poller = create_async_poller(max_inflight=args.max_inflight, batch_size=args.batch_size, poll_timeout=args.timeout)
+        try:
+            asyncio.run(poller.run())
+        except KeyboardInterrupt:
+            poller.stop()
+    else:
+        poller = create_poller(workers=args.workers, batch_size=args.batch_size, poll_timeout=args.timeout)
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            poller.stop()
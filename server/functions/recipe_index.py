@@ -0,0 +1,167 @@
+import heapq
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter
+
+import metrics
+from local_categorizer import tokenize
+from nutrient_index import IGNORED_WORDS, MASS_UNITS, VOLUME_UNITS
+
+# Database SQLite con le ricette scaricate da Edamam (la cartella delle funzioni è in sola lettura)
+INDEX_DB_PATH = os.environ.get("FOODMATE_RECIPE_INDEX_DB", os.path.join(tempfile.gettempdir(), "foodmate-recipes.sqlite"))
+# Versione dello schema: un file con una versione diversa viene ricostruito
+SCHEMA_VERSION = 1
+
+# Unità e quantità che compaiono nelle righe degli ingredienti (già al singolare)
+UNIT_WORDS = set(MASS_UNITS) | set(VOLUME_UNITS) | {
+    "gram", "kilogram", "ounce", "pound", "cup", "tablespoon", "teaspoon", "liter", "litre",
+    "clove", "pinch", "dash", "slice", "can", "handful", "bunch", "piece", "sprig", "stick",
+    "to", "taste", "a", "an", "some", "few", "half", "quarter",
+}
+
+# Identificativi delle ricette nelle liste di posting (interi senza segno a 32 bit)
+_POSTING_TYPE = "I"
+
+
+def ingredient_term(text):
+    """Returns the index term of an ingredient: "2 cups of chopped onions" -> "onion"."""
+
+    return " ".join(
+        token for token in tokenize(text)
+        if not token.isdigit() and token not in UNIT_WORDS and token not in IGNORED_WORDS
+    )
+
+
+def recipe_terms(recipe):
+    """Returns the distinct index terms of a parsed recipe, from its foods or ingredient lines."""
+
+    terms = {ingredient_term(food) for food in recipe.get("foods") or recipe.get("ingredients", [])}
+    terms.discard("")
+    return sorted(terms)
+
+
+class RecipeIndex:
+    """Recipes downloaded from Edamam, with an inverted index from ingredient to recipes.
+
+    Every term has a posting list of recipe ids, kept in memory as a compact
+    array of 32-bit integers and stored as a blob in a SQLite file, so
+    loading the index reads one row per term. Ranking counts, for every
+    recipe, how many items of a list appear in its postings and reads the
+    details only of the best recipes.
+    """
+
+    def __init__(self, path=INDEX_DB_PATH):
+        self._path = path
+        self._conn = None
+        self._postings = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            start = time.perf_counter()
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._build(conn)
+            for term, blob in conn.execute("SELECT term, ids FROM postings"):
+                postings = array(_POSTING_TYPE)
+                postings.frombytes(blob)
+                self._postings[term] = postings
+            self._sizes = dict(conn.execute("SELECT id, size FROM recipes"))
+            self._conn = conn
+            metrics.observe("recipe_index.load_time", time.perf_counter() - start)
+            metrics.set_gauge("recipe_index.recipes", len(self._sizes))
+        return self._conn
+
+    def _build(self, conn):
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS recipes")
+            conn.execute("DROP TABLE IF EXISTS postings")
+            conn.execute("CREATE TABLE recipes (id INTEGER PRIMARY KEY, uri TEXT UNIQUE, size INTEGER, data TEXT)")
+            conn.execute("CREATE TABLE postings (term TEXT PRIMARY KEY, ids BLOB) WITHOUT ROWID")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __len__(self):
+        with self._lock:
+            self._connect()
+            return len(self._sizes)
+
+    def add(self, recipes):
+        """Stores parsed recipes not seen before and indexes their ingredients; returns how many were new."""
+
+        added = 0
+        with self._lock:
+            conn = self._connect()
+            touched = set()
+            with conn:
+                for recipe in recipes:
+                    uri = recipe.get("uri") or recipe.get("recipe_url")
+                    terms = recipe_terms(recipe)
+                    if not uri or not terms:
+                        continue
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO recipes (uri, size, data) VALUES (?, ?, ?)",
+                        (uri, len(terms), json.dumps(dict(recipe, terms=terms))),
+                    )
+                    if not cursor.rowcount:
+                        continue
+                    recipe_id = cursor.lastrowid
+                    self._sizes[recipe_id] = len(terms)
+                    for term in terms:
+                        self._postings.setdefault(term, array(_POSTING_TYPE)).append(recipe_id)
+                        touched.add(term)
+                    added += 1
+                conn.executemany(
+                    "INSERT OR REPLACE INTO postings (term, ids) VALUES (?, ?)",
+                    [(term, self._postings[term].tobytes()) for term in touched],
+                )
+        if added:
+            metrics.increment("recipe_index.added", added)
+            metrics.set_gauge("recipe_index.recipes", len(self._sizes))
+        return added
+
+    def rank(self, items, limit, min_matched=1):
+        """Returns up to `limit` stored recipes that use the most list items.
+
+        Recipes are ordered by the number of items they use, then by the
+        share of their ingredients that are in the list (fewer missing
+        ingredients first). Returns a list of (recipe, matched items).
+        """
+
+        start = time.perf_counter()
+        wanted = {}
+        for item in items:
+            term = ingredient_term(item)
+            if term:
+                wanted.setdefault(term, item)
+
+        with self._lock:
+            conn = self._connect()
+            counts = Counter()
+            for term in wanted:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    counts.update(postings)
+            sizes = self._sizes
+            best = heapq.nlargest(
+                limit,
+                (entry for entry in counts.items() if entry[1] >= min_matched),
+                key=lambda entry: (entry[1], entry[1] / sizes[entry[0]], -entry[0]),
+            )
+            rows = dict(conn.execute(
+                f"SELECT id, data FROM recipes WHERE id IN ({', '.join('?' * len(best))})",
+                [recipe_id for recipe_id, _ in best],
+            )) if best else {}
+
+        ranked = []
+        for recipe_id, _ in best:
+            recipe = json.loads(rows[recipe_id])
+            terms = set(recipe.pop("terms"))
+            ranked.append((recipe, [item for term, item in wanted.items() if term in terms]))
+        metrics.observe("recipe_index.rank_time", time.perf_counter() - start)
+        return ranked
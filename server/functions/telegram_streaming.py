@@ -0,0 +1,81 @@
+import time
+
+# Lunghezza massima di un messaggio Telegram
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+# Intervallo minimo (secondi) tra due modifiche dello stesso messaggio
+MIN_EDIT_INTERVAL = 1.0
+
+
+def split_message(text, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """Splits a text into chunks of at most `limit` characters.
+
+    Chunks end at section boundaries (blank lines) when possible, then at
+    line ends, and only as a last resort in the middle of a line.
+    """
+
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip("\n"))
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class TelegramMessageStream:
+    """Shows a progressively generated text in a Telegram chat.
+
+    The first chunk is sent as soon as there is any text; later versions of
+    the text update the sent messages through editMessageText, at most once
+    every `min_edit_interval` seconds. Text beyond the message length limit
+    continues in additional messages, split at section boundaries.
+
+    `send(text)` must return the message_id of the new message and
+    `edit(message_id, text)` must replace its text.
+    """
+
+    def __init__(self, send, edit, min_edit_interval=MIN_EDIT_INTERVAL, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+        self._send = send
+        self._edit = edit
+        self._min_edit_interval = min_edit_interval
+        self._limit = limit
+        self._message_ids = []
+        self._sent_texts = []
+        self._pending_text = None
+        self._last_edit = 0.0
+
+    def update(self, text):
+        """Shows a new version of the full text, throttling the edits."""
+
+        self._pending_text = text
+        chunks = split_message(text, self._limit) if text.strip() else []
+        new_message = len(chunks) > len(self._message_ids)
+        if new_message or time.monotonic() - self._last_edit >= self._min_edit_interval:
+            self._flush(chunks)
+
+    def finish(self):
+        """Sends the last version of the text, ignoring the throttling."""
+
+        if self._pending_text is not None and self._pending_text.strip():
+            self._flush(split_message(self._pending_text, self._limit))
+        return self._message_ids
+
+    def _flush(self, chunks):
+        changed = False
+        for index, chunk in enumerate(chunks):
+            if index < len(self._message_ids):
+                if chunk != self._sent_texts[index]:
+                    self._edit(self._message_ids[index], chunk)
+                    self._sent_texts[index] = chunk
+                    changed = True
+            else:
+                self._message_ids.append(self._send(chunk))
+                self._sent_texts.append(chunk)
+                changed = True
+        if changed:
+            # Anche un nuovo messaggio conta: la prima modifica arriva dopo l'intervallo minimo
+            self._last_edit = time.monotonic()
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Valore restituito da get() quando la chiave non è in cache
+MISSING = object()
+
+
+class SQLiteCacheTier:
+    """Persistent cache tier stored in a local SQLite file."""
+
+    def __init__(self, path, table):
+        self._table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+
+    def get(self, key, include_expired=False):
+        """Returns (value, expires_at) for a live (or any, with include_expired) entry, or None."""
+
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] < time.time() and not include_expired):
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+
+
+class TTLCache:
+    """In-process LRU cache with per-entry TTL and an optional persistent tier.
+
+    Expired entries are not served by get() but stay in the cache until they
+    are evicted or overwritten, so get_stale() can still return them when
+    the upstream is unavailable. Hits, misses and evictions are counted in
+    metrics under "<name>.".
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=3600, persistent=None):
+        self.name = name
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._persistent = persistent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, stat):
+        self._stats[stat] += 1
+        metrics.increment(f"{self.name}.{stat}")
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def get(self, key):
+        """Returns the cached value for key, or MISSING."""
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= now:
+                self._entries.move_to_end(key)
+                self._count("hits")
+                return entry[0]
+
+        if self._persistent is not None:
+            stored = self._persistent.get(key)
+            if stored is not None:
+                with self._lock:
+                    self._store(key, stored[0], stored[1])
+                    self._count("hits")
+                return stored[0]
+
+        with self._lock:
+            self._count("misses")
+        return MISSING
+
+    def get_stale(self, key):
+        """Returns the last value stored for key even if it has expired, or MISSING."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            metrics.increment(f"{self.name}.stale_hits")
+            return entry[0]
+        if self._persistent is not None:
+            stored = self._persistent.get(key, include_expired=True)
+            if stored is not None:
+                metrics.increment(f"{self.name}.stale_hits")
+                return stored[0]
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key for ttl seconds (the cache default if None)."""
+
+        expires_at = time.time() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self._persistent is not None:
+            self._persistent.set(key, value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._persistent is not None:
+            self._persistent.delete(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters and the current size."""
+
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Numero massimo di update_id ricordati in memoria
+DEDUP_CAPACITY = 10000
+# Dopo quanto tempo (secondi) un update_id viene rimosso dallo store condiviso
+DEDUP_TTL = 24 * 60 * 60
+# Ogni quante registrazioni viene eseguita la pulizia dello store condiviso
+CLEANUP_EVERY = 500
+
+
+class RTDBDedupBackend:
+    """Shares seen update_ids across function instances through an RTDB path.
+
+    Each update_id is stored as a child whose value is the time it was first
+    seen; entries older than the TTL are deleted periodically. The path needs
+    an ".indexOn": ".value" rule for the cleanup query.
+    """
+
+    def __init__(self, ref, ttl=DEDUP_TTL, cleanup_every=CLEANUP_EVERY):
+        self._ref = ref
+        self._ttl = ttl
+        self._cleanup_every = cleanup_every
+        self._claims = 0
+
+    def claim(self, update_id):
+        """Marks an update_id as seen; returns False if another instance already did."""
+
+        now = time.time()
+        claimed = []
+        self._claims += 1
+        if self._claims % self._cleanup_every == 0:
+            self.cleanup()
+
+        def mark_seen(current):
+            claimed.clear()
+            if current is not None and now - current < self._ttl:
+                return current
+            claimed.append(True)
+            return now
+
+        try:
+            self._ref.child(str(update_id)).transaction(mark_seen)
+        except Exception as e:
+            # Se il database non risponde elaboriamo comunque l'update
+            logging.warning(f"Claim of update {update_id} failed: {e}")
+            return True
+        return bool(claimed)
+
+    def release(self, update_id):
+        """Forgets an update_id whose processing failed, so a redelivery can retry it."""
+
+        try:
+            self._ref.child(str(update_id)).delete()
+        except Exception as e:
+            logging.warning(f"Release of update {update_id} failed: {e}")
+
+    def cleanup(self):
+        """Deletes the entries older than the TTL with a single multi-path update."""
+
+        try:
+            expired = self._ref.order_by_value().end_at(time.time() - self._ttl).get() or {}
+            if expired:
+                self._ref.update({key: None for key in expired})
+        except Exception as e:
+            logging.warning(f"Cleanup of processed updates failed: {e}")
+
+
+class _Entry:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class UpdateDeduplicator:
+    """Runs the processing of each Telegram update_id at most once.
+
+    Completed update_ids are kept in a bounded LRU together with their
+    result; a duplicate that arrives while the original is still being
+    processed waits for it and receives the same result.
+    """
+
+    def __init__(self, capacity=DEDUP_CAPACITY, backend=None):
+        self._capacity = capacity
+        self._backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+
+    def hit_rate(self):
+        """Returns the share of update_ids that turned out to be duplicates."""
+
+        with self._lock:
+            return self._hits / self._lookups if self._lookups else 0.0
+
+    def _record(self, duplicate):
+        self._lookups += 1
+        if duplicate:
+            self._hits += 1
+            metrics.increment("update_dedup.hits")
+        else:
+            metrics.increment("update_dedup.misses")
+
+    def run_once(self, update_id, func):
+        """Calls func for a new update_id; returns (result, duplicate)."""
+
+        if update_id is None:
+            return func(), False
+
+        with self._lock:
+            entry = self._entries.get(update_id)
+            duplicate = entry is not None
+            self._record(duplicate)
+            if duplicate:
+                self._entries.move_to_end(update_id)
+            else:
+                entry = _Entry()
+                self._entries[update_id] = entry
+                while len(self._entries) > self._capacity:
+                    self._entries.popitem(last=False)
+
+        if duplicate:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result, True
+
+        if self._backend is not None and not self._backend.claim(update_id):
+            # Già elaborato da un'altra istanza
+            metrics.increment("update_dedup.shared_hits")
+            entry.done.set()
+            return None, True
+
+        try:
+            entry.result = func()
+            return entry.result, False
+        except Exception as e:
+            entry.error = e
+            if self._backend is not None:
+                self._backend.release(update_id)
+            # L'update potrà essere rielaborato alla prossima riconsegna
+            with self._lock:
+                if self._entries.get(update_id) is entry:
+                    del self._entries[update_id]
+            raise
+        finally:
+            entry.done.set()
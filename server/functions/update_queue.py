@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+
+class UpdateQueue:
+    """Queues Telegram updates and drains them with a pool of worker threads.
+
+    Updates of the same chat always go to the same worker, so they are
+    processed in arrival order. If spool_dir is given, every queued update is
+    also written to disk and removed only after it has been processed, so
+    pending work survives a restart of the process.
+    """
+
+    def __init__(self, handler, workers=4, spool_dir=None):
+        self._handler = handler
+        self._shards = [queue.Queue() for _ in range(workers)]
+        self._spool_dir = spool_dir
+        self._sequence = 0
+        self._sequence_lock = threading.Lock()
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        for shard in self._shards:
+            threading.Thread(target=self._worker, args=(shard,), daemon=True).start()
+        if spool_dir:
+            self._replay_spool()
+
+    def _shard_for(self, chat_id):
+        return self._shards[hash(str(chat_id)) % len(self._shards)]
+
+    def _spool_path(self):
+        with self._sequence_lock:
+            self._sequence += 1
+            sequence = self._sequence
+        return os.path.join(self._spool_dir, f"{time.time_ns():020d}-{sequence:08d}.json")
+
+    def _replay_spool(self):
+        for file_name in sorted(os.listdir(self._spool_dir)):
+            path = os.path.join(self._spool_dir, file_name)
+            try:
+                with open(path, "r") as f:
+                    update = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Discarding unreadable spooled update {path}: {e}")
+                os.remove(path)
+                continue
+            self._shard_for(update["chat_id"]).put((time.monotonic(), update, path))
+
+    def submit(self, chat_id, update):
+        """Queues an update for background processing and returns immediately."""
+
+        path = None
+        if self._spool_dir:
+            path = self._spool_path()
+            with open(path, "w") as f:
+                json.dump({"chat_id": chat_id, "update": update}, f)
+        self._shard_for(chat_id).put((time.monotonic(), {"chat_id": chat_id, "update": update}, path))
+        metrics.increment("update_queue.submitted")
+        metrics.set_gauge("update_queue.depth", self.depth())
+
+    def depth(self):
+        """Returns the number of updates waiting to be processed."""
+
+        return sum(shard.qsize() for shard in self._shards)
+
+    def join(self):
+        """Blocks until every queued update has been processed."""
+
+        for shard in self._shards:
+            shard.join()
+
+    def _worker(self, shard):
+        while True:
+            enqueued_at, item, path = shard.get()
+            started_at = time.monotonic()
+            metrics.observe("update_queue.wait_time", started_at - enqueued_at)
+            try:
+                self._handler(item["update"])
+            except Exception as e:
+                metrics.increment("update_queue.errors")
+                logging.error(f"Error processing queued update: {e}")
+            finally:
+                metrics.observe("update_queue.processing_time", time.monotonic() - started_at)
+                metrics.set_gauge("update_queue.depth", self.depth())
+                if path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                shard.task_done()
@@ -0,0 +1,526 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+# Chiamate contemporanee ammesse per upstream, richieste in attesa oltre le
+# quali si rifiuta il lavoro, e attesa massima (secondi) per uno slot libero
+UPSTREAM_LIMITS = {
+    "edamam": {"concurrency": int(os.environ.get("FOODMATE_EDAMAM_CONCURRENCY", "8")), "max_waiting": 32, "max_wait": 5.0},
+    "gemini": {"concurrency": int(os.environ.get("FOODMATE_GEMINI_CONCURRENCY", "4")), "max_waiting": 16, "max_wait": 10.0},
+}
+
+# Apertura del circuito: quota di chiamate fallite o più lente di `slow_call`
+# secondi tra le ultime `window` (almeno `min_calls`), e secondi di apertura
+# prima della chiamata di prova
+CIRCUIT_BREAKERS = {
+    "edamam": {"failure_ratio": 0.5, "slow_call": float(os.environ.get("FOODMATE_EDAMAM_SLOW_CALL", "5")),
+               "window": 20, "min_calls": 5, "open_for": float(os.environ.get("FOODMATE_EDAMAM_OPEN_FOR", "30"))},
+    "gemini": {"failure_ratio": 0.5, "slow_call": float(os.environ.get("FOODMATE_GEMINI_SLOW_CALL", "15")),
+               "window": 10, "min_calls": 3, "open_for": float(os.environ.get("FOODMATE_GEMINI_OPEN_FOR", "30"))},
+}
+# Attesa massima (secondi) di una chiamata hedged, molto sotto il timeout HTTP
+UPSTREAM_DEADLINES = {
+    "edamam": float(os.environ.get("FOODMATE_EDAMAM_DEADLINE", "6")),
+}
+# Upstream per cui si lancia un secondo tentativo se il primo non risponde entro il p95.
+# Gemini risponde in streaming e non viene duplicato: il circuit breaker ne limita la coda
+HEDGED_UPSTREAMS = set(filter(None, os.environ.get("FOODMATE_HEDGED_UPSTREAMS", "edamam").split(",")))
+
+# Risposta mostrata all'utente quando un upstream è sovraccarico
+OVERLOAD_MESSAGE = "I'm receiving a lot of requests right now. Please try again in a few seconds."
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when an upstream has no free slot and its wait queue is full or too slow."""
+
+
+class CircuitOpen(UpstreamOverloaded):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class UpstreamTimeout(UpstreamOverloaded):
+    """Raised when no attempt of a call answered within the upstream deadline."""
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares one execution among identical concurrent calls.
+
+    The first caller for a key runs the function; callers arriving with the
+    same key while it is running wait for it and get the same result (or
+    exception). Nothing is cached once the call has completed.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            metrics.increment(f"{self.name}.coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _StreamCall:
+
+    def __init__(self):
+        self.changed = threading.Condition()
+        self.items = []
+        self.done = False
+        self.error = None
+
+
+class StreamFlight:
+    """Shares one streamed execution among identical concurrent calls.
+
+    The first caller for a key iterates the generator; callers arriving with
+    the same key while it is running receive every item produced so far and
+    then each new one as it arrives, and the same exception if the stream
+    fails. If the first caller stops reading, the stream is still read to
+    the end for the others.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall()
+                self._calls[key] = call
+        if not leader:
+            metrics.increment(f"{self.name}.coalesced")
+            yield from self._follow(call)
+            return
+
+        try:
+            items = func(*args, **kwargs)
+            try:
+                for item in items:
+                    self._publish(call, item)
+                    yield item
+            except GeneratorExit:
+                # Chi ha avviato la chiamata ha smesso di leggere: la risposta serve ancora agli altri
+                try:
+                    for item in items:
+                        self._publish(call, item)
+                except Exception as e:
+                    call.error = e
+                raise
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            with call.changed:
+                call.done = True
+                call.changed.notify_all()
+
+    def _publish(self, call, item):
+        with call.changed:
+            call.items.append(item)
+            call.changed.notify_all()
+
+    def _follow(self, call):
+        position = 0
+        while True:
+            with call.changed:
+                while position == len(call.items) and not call.done:
+                    call.changed.wait()
+                items = call.items[position:]
+                done = call.done
+            position += len(items)
+            yield from items
+            if done:
+                if call.error is not None:
+                    raise call.error
+                return
+
+
+class UpstreamLimiter:
+    """Bounds the concurrent calls to an upstream, with a bounded wait queue.
+
+    A call that finds all slots busy waits up to `max_wait` seconds; if
+    `max_waiting` calls are already waiting, or the wait times out, it is
+    shed with UpstreamOverloaded instead of piling up.
+    """
+
+    def __init__(self, name, concurrency, max_waiting, max_wait):
+        self.name = name
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._max_waiting = max_waiting
+        self._max_wait = max_wait
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _shed(self):
+        metrics.increment(f"{self.name}.shed")
+        raise UpstreamOverloaded(f"{self.name} is overloaded")
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds one of the concurrent slots for the duration of the block."""
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self._max_waiting:
+                    self._shed()
+                self._waiting += 1
+            start = time.perf_counter()
+            try:
+                acquired = self._slots.acquire(timeout=self._max_wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            metrics.observe(f"{self.name}.wait_time", time.perf_counter() - start)
+            if not acquired:
+                self._shed()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def call(self, func, *args, **kwargs):
+        with self.slot():
+            return func(*args, **kwargs)
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing or answering too slowly.
+
+    The outcomes of the last `window` calls are kept; when at least
+    `min_calls` were recorded and the share of failed or slow ones reaches
+    `failure_ratio`, the circuit opens and calls fail immediately with
+    CircuitOpen. After `open_for` seconds a single probe call is let through
+    (half-open): its success closes the circuit, its failure reopens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_ratio, slow_call, window, min_calls, open_for):
+        self.name = name
+        self._failure_ratio = failure_ratio
+        self._slow_call = slow_call
+        self._min_calls = min_calls
+        self._open_for = open_for
+        self._outcomes = collections.deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.set_gauge(f"{self.name}.state", state)
+
+    def _acquire(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._open_for:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        metrics.increment(f"{self.name}.rejected")
+        raise CircuitOpen(f"{self.name} is open")
+
+    def _record(self, probe, ok):
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._outcomes.clear()
+                if ok:
+                    self._set_state(self.CLOSED)
+                else:
+                    self._open()
+                return
+            if self._state != self.CLOSED:
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self._min_calls and failures >= self._failure_ratio * len(self._outcomes):
+                self._outcomes.clear()
+                self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(self.OPEN)
+        metrics.increment(f"{self.name}.opened")
+
+    def call(self, func, is_failure=None):
+        """Calls func() unless the circuit is open.
+
+        Exceptions and results for which is_failure(result) is true count as
+        failures; so do calls slower than the slow-call threshold and
+        timeouts. Calls shed by the local limiter are not counted.
+        """
+
+        probe = self._acquire()
+        start = time.perf_counter()
+        try:
+            result = func()
+        except UpstreamTimeout:
+            self._record(probe, False)
+            raise
+        except UpstreamOverloaded:
+            self._release(probe)
+            raise
+        except Exception:
+            self._record(probe, False)
+            raise
+        ok = time.perf_counter() - start < self._slow_call and not (is_failure is not None and is_failure(result))
+        self._record(probe, ok)
+        return result
+
+    def call_stream(self, func):
+        """Iterates func() unless the circuit is open.
+
+        Like call(), for a streamed answer: the outcome is recorded when the
+        stream ends, so an error while reading it is a failure, and so is a
+        stream that takes longer than the slow-call threshold to complete.
+        A stream closed early by the caller is not counted.
+        """
+
+        probe = self._acquire()
+        start = time.perf_counter()
+        try:
+            yield from func()
+        except UpstreamTimeout:
+            self._record(probe, False)
+            raise
+        except (UpstreamOverloaded, GeneratorExit):
+            self._release(probe)
+            raise
+        except Exception:
+            self._record(probe, False)
+            raise
+        self._record(probe, time.perf_counter() - start < self._slow_call)
+
+    def _release(self, probe):
+        # Chiamata senza esito (rifiutata dal limiter o interrotta): la prova potrà ripartire
+        if probe:
+            with self._lock:
+                self._probing = False
+
+
+class Hedger:
+    """Sends a second attempt when the first has not answered by the p95 latency.
+
+    The p95 is computed over the last `window` successful attempts; until
+    `min_samples` are known calls are not hedged. Whichever attempt
+    succeeds first provides the result. With a deadline, the caller stops
+    waiting after that many seconds (UpstreamTimeout) and the attempts
+    finish in the background.
+    """
+
+    def __init__(self, name, window=200, min_samples=20, quantile=0.95, min_delay=0.05):
+        self.name = name
+        self._latencies = collections.deque(maxlen=window)
+        self._min_samples = min_samples
+        self._quantile = quantile
+        self._min_delay = min_delay
+
+    def delay(self):
+        """Returns the seconds after which a call is hedged, or None if unknown yet."""
+
+        latencies = sorted(self._latencies)
+        if len(latencies) < self._min_samples:
+            return None
+        return max(self._min_delay, latencies[min(len(latencies) - 1, int(self._quantile * len(latencies)))])
+
+    def _timed(self, func):
+        start = time.perf_counter()
+        result = func()
+        self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _submit(self, func):
+        # Il contesto (record della richiesta) segue il tentativo nel thread del pool
+        return _hedge_executor.submit(contextvars.copy_context().run, self._timed, func)
+
+    def call(self, func, deadline=None):
+        delay = self.delay()
+        if delay is None and deadline is None:
+            return self._timed(func)
+
+        start = time.monotonic()
+        attempts = [self._submit(func)]
+        hedge = None
+        if delay is not None and (deadline is None or delay < deadline):
+            done, _ = wait(attempts, timeout=delay)
+            if not done:
+                metrics.increment(f"{self.name}.hedged")
+                hedge = self._submit(func)
+                attempts.append(hedge)
+
+        error = None
+        while attempts:
+            remaining = None if deadline is None else max(0.0, deadline - (time.monotonic() - start))
+            done, _ = wait(attempts, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                metrics.increment(f"{self.name}.timeouts")
+                for attempt in attempts:
+                    attempt.cancel()
+                raise UpstreamTimeout(f"{self.name} did not answer within {deadline} s")
+            for attempt in done:
+                attempts.remove(attempt)
+                if attempt.exception() is None:
+                    if attempt is hedge:
+                        metrics.increment(f"{self.name}.hedge_wins")
+                    return attempt.result()
+                # Un tentativo fallito: vale l'esito dell'altro, se c'è
+                error = attempt.exception()
+        raise error
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("FOODMATE_HEDGE_WORKERS", "32")))
+
+_limiters = {}
+_breakers = {}
+_hedgers = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream):
+    """Returns the shared limiter of an upstream."""
+
+    with _limiters_lock:
+        limiter = _limiters.get(upstream)
+        if limiter is None:
+            limits = UPSTREAM_LIMITS[upstream]
+            limiter = UpstreamLimiter(f"upstream.{upstream}", limits["concurrency"], limits["max_waiting"], limits["max_wait"])
+            _limiters[upstream] = limiter
+        return limiter
+
+
+def get_breaker(upstream):
+    """Returns the shared circuit breaker of an upstream."""
+
+    with _limiters_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = CircuitBreaker(f"upstream.{upstream}.circuit", **CIRCUIT_BREAKERS[upstream])
+            _breakers[upstream] = breaker
+        return breaker
+
+
+def get_hedger(upstream):
+    """Returns the shared hedger of an upstream."""
+
+    with _limiters_lock:
+        hedger = _hedgers.get(upstream)
+        if hedger is None:
+            hedger = Hedger(f"upstream.{upstream}")
+            _hedgers[upstream] = hedger
+        return hedger
+
+
+def is_error_result(result):
+    """Tells whether a result is one of the error dictionaries returned by the API clients."""
+
+    return isinstance(result, dict) and result.get("success") is False
+
+
+def guarded(upstream, key=None, is_failure=is_error_result):
+    """Decorator: coalesces identical in-flight calls, applies the circuit
+    breaker and the limiter of the upstream, and hedges slow calls (giving
+    up after the upstream deadline).
+
+    `key(*args, **kwargs)` computes the coalescing key (by default the
+    repr of the arguments); `is_failure(result)` tells the circuit breaker
+    which returned values are failures.
+    """
+
+    def decorator(func):
+        flight = SingleFlight(f"upstream.{upstream}.{func.__name__}")
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            flight_key = key(*args, **kwargs) if key is not None else repr((args, sorted(kwargs.items())))
+
+            def attempt():
+                return get_limiter(upstream).call(func, *args, **kwargs)
+
+            def call():
+                if upstream in HEDGED_UPSTREAMS:
+                    hedged = lambda: get_hedger(upstream).call(attempt, UPSTREAM_DEADLINES.get(upstream))
+                    return get_breaker(upstream).call(hedged, is_failure)
+                return get_breaker(upstream).call(attempt, is_failure)
+
+            return flight.do(flight_key, call)
+
+        return wrapper
+
+    return decorator
+
+
+def guarded_stream(upstream, key=None):
+    """Decorator for generator functions: shares identical in-flight streams,
+    applies the circuit breaker of the upstream to the whole stream and
+    holds a limiter slot until the stream ends. Streams are not hedged.
+
+    `key(*args, **kwargs)` computes the coalescing key (by default the
+    repr of the arguments).
+    """
+
+    def decorator(func):
+        flight = StreamFlight(f"upstream.{upstream}.{func.__name__}")
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            flight_key = key(*args, **kwargs) if key is not None else repr((args, sorted(kwargs.items())))
+
+            def limited():
+                with get_limiter(upstream).slot():
+                    yield from func(*args, **kwargs)
+
+            return flight.stream(flight_key, get_breaker(upstream).call_stream, limited)
+
+        return wrapper
+
+    return decorator
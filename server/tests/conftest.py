@@ -0,0 +1,68 @@
+"""Makes the Cloud Functions modules and the benchmark stubs importable from the tests."""
+
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ("functions", "benchmark"):
+    path = os.path.join(SERVER_DIR, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_upstreams():
+    """Starts every test with empty metrics and new limiters and circuit breakers."""
+
+    import metrics
+    import upstream_guard
+
+    metrics.reset()
+    for shared in (upstream_guard._limiters, upstream_guard._breakers, upstream_guard._hedgers):
+        shared.clear()
+    yield
+
+
+@pytest.fixture
+def fake_gemini():
+    """Replaces the Gemini model with the in-process fake of the benchmarks."""
+
+    import gemini_api_script
+    from stubs import FakeGeminiModel
+
+    model = FakeGeminiModel()
+    previous, gemini_api_script._model = gemini_api_script._model, model
+    yield model
+    gemini_api_script._model = previous
+
+
+@pytest.fixture(scope="session")
+def harness():
+    """Imports main.py against the local stubs of the benchmarks."""
+
+    from harness import Harness
+
+    harness = Harness()
+    yield harness
+    harness.stop()
+
+
+def fulfillment_request(session_id, items=()):
+    """Builds a Dialogflow webhook request for a fulfillment handler."""
+
+    return {
+        "sessionInfo": {"session": f"projects/test/locations/test/agents/test/sessions/{session_id}"},
+        "intentInfo": {"parameters": {"item": {"resolvedValue": list(items)}}},
+    }
+
+
+def response_text(result):
+    """Returns the text of a fulfillment response."""
+
+    import json
+
+    if isinstance(result, tuple):
+        result = result[0]
+    return json.loads(result)["fulfillment_response"]["messages"][0]["text"]["text"][0]
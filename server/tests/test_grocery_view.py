@@ -0,0 +1,81 @@
+import json
+
+import metrics
+from conftest import fulfillment_request, response_text
+from grocery_categorizer import PENDING_SECTION
+from upstream_guard import UpstreamOverloaded, get_breaker
+
+
+def view(harness, session_id):
+    return response_text(harness.main.fulfill_view_grocery_list(fulfillment_request(session_id)))
+
+
+def test_items_without_an_answer_are_asked_again(harness, fake_gemini):
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("retry", ["zorblax widget"]))
+
+    get_breaker("gemini")._open()
+    assert view(harness, "retry") == "Other:\n- zorblax widget"
+    assert fake_gemini.calls == 0
+
+    # Gemini di nuovo disponibile: la vista salvata non deve conservare il ripiego
+    get_breaker("gemini")._set_state(get_breaker("gemini").CLOSED)
+    section = fake_gemini._section("zorblax widget")
+    assert view(harness, "retry") == f"{section}:\n- zorblax widget"
+    assert fake_gemini.calls == 1
+
+
+def test_repeated_views_make_no_model_calls(harness, fake_gemini, monkeypatch):
+    # Senza vista salvata ogni lettura ricategorizza: le sezioni vengono dalla cache
+    monkeypatch.setattr(harness.main, "MATERIALIZED_GROCERY_VIEW", False)
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("repeat", ["zorblax", "quux"]))
+
+    first = view(harness, "repeat")
+    assert fake_gemini.calls == 1
+    misses = metrics.snapshot()["counters"]["grocery_categorizer.misses"]
+
+    for _ in range(3):
+        assert view(harness, "repeat") == first
+    assert fake_gemini.calls == 1
+    assert metrics.snapshot()["counters"]["grocery_categorizer.misses"] == misses
+
+
+def test_only_new_items_go_to_the_model(harness, fake_gemini, monkeypatch):
+    monkeypatch.setattr(harness.main, "MATERIALIZED_GROCERY_VIEW", False)
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("new", ["flimflam"]))
+    view(harness, "new")
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("new", ["gizmo"]))
+
+    prompts = []
+    generate_content = fake_gemini.generate_content
+    monkeypatch.setattr(fake_gemini, "generate_content", lambda prompt, **kwargs: prompts.append(prompt) or generate_content(prompt, **kwargs))
+    view(harness, "new")
+
+    assert len(prompts) == 1
+    assert '["gizmo"]' in prompts[0]
+
+
+def test_repeated_views_use_the_stored_view(harness, fake_gemini):
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("stored", ["blorp", "snarf"]))
+
+    first = view(harness, "stored")
+    for _ in range(3):
+        assert view(harness, "stored") == first
+
+    assert fake_gemini.calls == 1
+    assert metrics.snapshot()["counters"]["grocery_view.hits"] >= 3
+
+
+def test_load_shed_while_streaming_finishes_the_message(harness, fake_gemini, monkeypatch):
+    harness.main.fulfill_add_to_grocery_list(fulfillment_request("shed", ["zorblax gadget"]))
+
+    def shed(prompt, **kwargs):
+        raise UpstreamOverloaded("gemini is overloaded")
+
+    monkeypatch.setattr(fake_gemini, "generate_content", shed)
+    sent, edited = len(harness.telegram.sent), len(harness.telegram.edited)
+    request_data = dict(fulfillment_request("shed"), payload={"data": {"message": {"chat": {"id": 777}}}})
+    result = harness.main.fulfill_view_grocery_list(request_data)
+
+    assert "foodmate_streamed" in json.dumps(result)
+    assert [message["text"] for message in harness.telegram.sent[sent:]] == [f"{PENDING_SECTION}:\n- zorblax gadget"]
+    assert [message["text"] for message in harness.telegram.edited[edited:]] == ["Other:\n- zorblax gadget"]
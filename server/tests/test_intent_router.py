@@ -0,0 +1,50 @@
+import pytest
+
+from intent_router import IntentRouter, split_items
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter.from_file()
+
+
+def test_split_items_keeps_compound_names():
+    assert split_items("milk, mac and cheese ,salt & vinegar crisps") == ["milk", "mac and cheese", "salt & vinegar crisps"]
+
+
+@pytest.mark.parametrize("text, intent, items", [
+    ("/list@FoodmateBot", "view_grocery_list", None),
+    ("Show my shopping list!", "view_grocery_list", None),
+    ("/add mac and cheese, bread", "add_to_grocery_list", ["mac and cheese", "bread"]),
+    ("add milk, eggs to my list", "add_to_grocery_list", ["milk", "eggs"]),
+    ("add candles to the shopping list", "add_to_grocery_list", ["candles"]),
+    ("/remove milk", "remove_from_grocery_list", ["milk"]),
+    ("delete milk, eggs from my grocery list", "remove_from_grocery_list", ["milk", "eggs"]),
+    ("delete my list", "clear_grocery_list", None),
+    ("/nutrition 2 eggs", "get_nutrition_analysis_single_ingredient", ["2 eggs"]),
+    ("nutrition facts for 100g rice", "get_nutrition_analysis_single_ingredient", ["100g rice"]),
+    ("nutrition of my list", "get_nutrition_analysis_grocery_list", None),
+    ("what can I cook?", "get_recipes_from_grocery_list", None),
+])
+def test_commands_are_routed_locally(router, text, intent, items):
+    routed_intent, parameters = router.route(text)
+
+    assert routed_intent == intent
+    assert parameters.get("item", {}).get("resolvedValue") == items
+
+
+@pytest.mark.parametrize("text", [
+    "delete my account",
+    "remove milk",
+    "remove milk and eggs from my list",
+    "add a reminder for tomorrow",
+    "add milk",
+    "add milk and eggs",
+    "add milk and eggs to my list",
+    "add salt & pepper to my list",
+    "nutrition facts please",
+    "nutrition",
+    "hello there",
+])
+def test_unclear_messages_go_to_dialogflow(router, text):
+    assert router.route(text) is None
@@ -0,0 +1,31 @@
+import pytest
+
+from local_categorizer import LocalCategorizer
+
+
+@pytest.fixture(scope="module")
+def categorizer():
+    return LocalCategorizer.from_file()
+
+
+@pytest.mark.parametrize("item, section", [
+    ("milk", "Dairy & Eggs"),
+    ("Skimmed Milk", "Dairy & Eggs"),
+    ("chicken breasts", "Meat"),
+    ("tomato paste", "Canned & Jarred Goods"),
+])
+def test_items_are_matched_on_their_head_noun(categorizer, item, section):
+    assert categorizer.categorize(item) == section
+
+
+@pytest.mark.parametrize("item", ["corn flakes", "fish sauce", "zorblax widget"])
+def test_items_without_a_known_head_noun_are_left_to_the_model(categorizer, item):
+    assert categorizer.categorize(item) is None
+
+
+def test_learned_answers_extend_the_lexicon():
+    categorizer = LocalCategorizer({"Fruits & Vegetables": ["corn"]})
+    categorizer.learn({"corn flakes": "Breakfast & Cereal"})
+
+    assert categorizer.categorize("corn") == "Fruits & Vegetables"
+    assert categorizer.categorize("organic corn flakes") == "Breakfast & Cereal"
@@ -0,0 +1,60 @@
+import pytest
+
+import time
+
+from message_coalescer import MessageCoalescer, merge_texts
+
+
+@pytest.mark.parametrize("previous, text, merged", [
+    ("add milk", "and eggs", "add milk, eggs"),
+    ("add milk", ", bread", "add milk, bread"),
+    ("add milk", "also some rice", "add milk, some rice"),
+    ("add milk", "& butter", "add milk, butter"),
+    ("add milk", "add eggs", "add milk, eggs"),
+    ("remove milk", "and eggs", "remove milk, eggs"),
+    ("add milk", "Add milk", "add milk"),
+    ("show my list", "show my list", "show my list"),
+    ("add milk to my list", "and eggs", "add milk, eggs to my list"),
+    ("add milk to my list", "add eggs to my list", "add milk, eggs to my list"),
+    ("add milk", "add eggs to the shopping list", "add milk, eggs to the shopping list"),
+    ("remove milk from my list", "and bread", "remove milk, bread from my list"),
+])
+def test_follow_ups_are_merged(previous, text, merged):
+    assert merge_texts(previous, text) == merged
+
+
+@pytest.mark.parametrize("previous, text", [
+    ("add milk", "andouille sausage"),
+    ("add milk", "Andes mints"),
+    ("add milk", "plush toy"),
+    ("add milk", "show my list"),
+    ("add milk", "remove eggs"),
+    ("show my list", "and eggs"),
+    ("nutrition 2 eggs", "and bread"),
+])
+def test_new_requests_are_not_merged(previous, text):
+    assert merge_texts(previous, text) is None
+
+
+def test_merged_list_request_is_routed_with_clean_items():
+    from intent_router import IntentRouter
+
+    intent, parameters = IntentRouter.from_file().route(merge_texts("add milk to my list", "and eggs"))
+
+    assert intent == "add_to_grocery_list"
+    assert parameters["item"]["resolvedValue"] == ["milk", "eggs"]
+
+
+def test_chat_state_is_dropped_with_the_burst():
+    turns = []
+    coalescer = MessageCoalescer(turns.append, window=0.05, min_window=0.05, max_window=0.05)
+
+    coalescer.submit(1, {"chat_id": 1, "text": "add milk"})
+    coalescer.submit(1, {"chat_id": 1, "text": "and eggs"})
+    deadline = time.monotonic() + 2
+    while not turns and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+    assert [turn["text"] for turn in turns] == ["add milk, eggs"]
+    assert coalescer._bursts == {} and coalescer._gaps == {}
@@ -0,0 +1,21 @@
+import metrics
+from intent_router import observe_latency_saved
+
+
+def test_average_reads_the_running_mean():
+    assert metrics.average("span.detect_intent") is None
+
+    for seconds in (0.1, 0.2, 0.3):
+        metrics.observe("span.detect_intent", seconds)
+
+    assert abs(metrics.average("span.detect_intent") - 0.2) < 1e-9
+
+
+def test_latency_saved_against_the_average_detect_intent():
+    observe_latency_saved(0.05)
+    assert "intent_router.latency_saved" not in metrics.snapshot()["timings"]
+
+    metrics.observe("span.detect_intent", 0.25)
+    observe_latency_saved(0.05)
+
+    assert abs(metrics.snapshot()["timings"]["intent_router.latency_saved"]["avg"] - 0.2) < 1e-9
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def nutrition(harness, monkeypatch):
+    # Importato dopo l'avvio degli stub: l'URL di Edamam viene letto all'import
+    import edamam_nutrition_api_script
+
+    monkeypatch.setattr(edamam_nutrition_api_script, "BATCH_DETAILS_THRESHOLD", 2)
+    return edamam_nutrition_api_script
+
+
+def test_batch_results_do_not_answer_single_lookups(nutrition):
+    batch = nutrition.lookup_nutrition_batch(["zorblax paste", "quux flakes"])
+    assert batch[0]["totalNutrientsKCal"] == {}
+
+    single = nutrition.lookup_nutrition_data("zorblax paste")
+    assert single["totalNutrientsKCal"]
+    # Dopo la ricerca singola il risultato completo serve anche le analisi successive
+    assert nutrition.lookup_nutrition_batch(["zorblax paste", "quux flakes"])[0] == single
+
+
+def test_unknown_batch_results_expire_sooner(nutrition):
+    nutrition.lookup_nutrition_batch(["unknown gizmo", "flimflam jam"])
+
+    expires_at = nutrition.nutrition_details_cache._entries["unknown gizmo"][1]
+    assert expires_at <= time.time() + nutrition.NUTRITION_NEGATIVE_CACHE_TTL
+    assert nutrition.nutrition_details_cache._entries["flimflam jam"][1] > time.time() + nutrition.NUTRITION_NEGATIVE_CACHE_TTL
+
+
+def test_batch_counts_each_miss_once(nutrition, monkeypatch):
+    # Sotto la soglia: ricerche singole in parallelo
+    monkeypatch.setattr(nutrition, "BATCH_DETAILS_THRESHOLD", 10)
+    nutrition.lookup_nutrition_batch(["blorp soup", "snarf bar"])
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["nutrition_cache.misses"] == 2
+    assert counters["nutrient_index.misses"] == 2
+
+
+def test_only_units_after_a_quantity_are_respelled(nutrition):
+    assert nutrition.normalize_ingredient("2 Pounds  of flour") == "2 lb of flour"
+    assert nutrition.normalize_ingredient("100g chicken breast") == "100 g chicken breast"
+    assert nutrition.normalize_ingredient("1/2 cups milk") == "1/2 cup milk"
+    assert nutrition.normalize_ingredient("pound cake") == "pound cake"
+    assert nutrition.normalize_ingredient(["gram", "flour"]) == "gram flour"
+
+
+def test_edamam_gets_the_original_text(nutrition, monkeypatch):
+    queries = []
+    fetch = nutrition.fetch_nutrition_data.__wrapped__
+    monkeypatch.setattr(nutrition, "fetch_nutrition_data", lambda ingredient: queries.append(ingredient) or fetch(ingredient))
+
+    result = nutrition.lookup_nutrition_data("Pound Cake")
+
+    assert queries == ["Pound Cake"]
+    assert result["food_name"] == "Pound Cake"
+    assert nutrition.nutrition_cache.get("pound cake") == result
@@ -0,0 +1,61 @@
+import asyncio
+
+from polling_worker import AsyncTelegramPoller, TelegramPoller
+from update_dedup import UpdateDeduplicator
+
+
+class SharedStore:
+    """In-memory stand-in of the RTDB store shared by the instances."""
+
+    def __init__(self):
+        self.seen = set()
+
+    def claim(self, update_id):
+        if update_id in self.seen:
+            return False
+        self.seen.add(update_id)
+        return True
+
+    def release(self, update_id):
+        self.seen.discard(update_id)
+
+
+BATCH = [{"update_id": 10 + i, "chat_id": i % 2, "text": f"message {i}"} for i in range(4)]
+
+
+def parse(update):
+    return dict(update), None
+
+
+def test_batch_redelivered_after_a_crash_is_not_processed_again():
+    store = SharedStore()
+    processed = []
+
+    # Il primo processo elabora il batch e termina prima di confermare l'offset
+    first = TelegramPoller(lambda offset, limit, timeout: BATCH, parse, processed.append,
+                           workers=2, dedup=UpdateDeduplicator(backend=store))
+    assert first.poll_once() == 4
+
+    # Il processo riavviato riceve di nuovo lo stesso batch
+    restarted = TelegramPoller(lambda offset, limit, timeout: BATCH, parse, processed.append,
+                               workers=2, dedup=UpdateDeduplicator(backend=store))
+    assert restarted.poll_once() == 4
+
+    assert sorted(fields["update_id"] for fields in processed) == [10, 11, 12, 13]
+    assert restarted.offset == 14
+
+
+def test_async_poller_skips_claimed_updates():
+    dedup = UpdateDeduplicator()
+    dedup.run_once(11, lambda: None)
+    processed = []
+
+    async def get_updates(offset, limit, timeout):
+        return BATCH
+
+    async def handler(fields):
+        processed.append(fields["update_id"])
+
+    poller = AsyncTelegramPoller(get_updates, parse, handler, dedup=dedup)
+    assert asyncio.run(poller.poll_once()) == 4
+    assert sorted(processed) == [10, 12, 13]
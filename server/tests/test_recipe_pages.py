@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.fixture
+def recipes(harness):
+    # Importato dopo l'avvio degli stub: l'URL di Edamam viene letto all'import
+    import edamam_recipe_api_script
+
+    return edamam_recipe_api_script
+
+
+def test_page_past_the_end_is_not_a_blank_reply(recipes):
+    assert recipes.get_recipe_data("chicken", 50) == recipes.NO_MORE_RECIPES_MESSAGE
+
+
+def test_last_page_is_still_rendered(recipes):
+    # Lo stub restituisce 5 pagine Edamam da 20 ricette
+    reply = recipes.get_recipe_data("chicken", 100 // recipes.RECIPES_PER_PAGE)
+    assert reply.startswith(f"Recipe {100 - recipes.RECIPES_PER_PAGE + 1}:")
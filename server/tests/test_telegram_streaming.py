@@ -0,0 +1,105 @@
+import metrics
+from grocery_categorizer import PENDING_SECTION, CategoryCache, categorize_items_stream
+from local_categorizer import LocalCategorizer
+from telegram_streaming import TelegramMessageStream, split_message
+
+
+def test_split_message_keeps_short_text_whole():
+    assert split_message("Dairy:\n- milk", limit=100) == ["Dairy:\n- milk"]
+
+
+def test_split_message_cuts_at_section_boundaries():
+    sections = [f"Section {number}:\n- item a\n- item b" for number in range(6)]
+    text = "\n\n".join(sections)
+
+    chunks = split_message(text, limit=60)
+
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert "\n\n".join(chunks) == text
+    assert all(chunk.startswith("Section ") for chunk in chunks)
+
+
+def test_split_message_cuts_long_lines():
+    chunks = split_message("x" * 25, limit=10)
+
+    assert chunks == ["x" * 10, "x" * 10, "x" * 5]
+
+
+class FakeChat:
+
+    def __init__(self):
+        self.messages = {}
+        self.edits = 0
+
+    def send(self, text):
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return message_id
+
+    def edit(self, message_id, text):
+        self.edits += 1
+        self.messages[message_id] = text
+
+
+def test_stream_sends_first_text_and_throttles_edits():
+    chat = FakeChat()
+    stream = TelegramMessageStream(chat.send, chat.edit, min_edit_interval=60)
+
+    stream.update("Dairy:\n- milk")
+    stream.update("Dairy:\n- milk\n- cheese")
+    stream.update("Dairy:\n- milk\n- cheese\n- butter")
+
+    assert chat.messages == {1: "Dairy:\n- milk"}
+    assert chat.edits == 0
+    assert stream.finish() == [1]
+    assert chat.messages == {1: "Dairy:\n- milk\n- cheese\n- butter"}
+    assert chat.edits == 1
+
+
+def test_stream_continues_in_new_messages_beyond_the_limit():
+    chat = FakeChat()
+    stream = TelegramMessageStream(chat.send, chat.edit, min_edit_interval=60, limit=30)
+    first = "Dairy:\n- milk\n- cheese"
+    second = first + "\n\nBakery:\n- bread\n- rolls"
+
+    stream.update(first)
+    stream.update(second)
+
+    assert stream.finish() == [1, 2]
+    assert chat.messages == {1: first, 2: "Bakery:\n- bread\n- rolls"}
+
+
+def test_categorize_items_stream_shows_known_items_before_the_model(fake_gemini):
+    cache = CategoryCache()
+    local = LocalCategorizer({"Dairy": ["milk"]})
+
+    snapshots = categorize_items_stream(["milk", "zorblax", "quux"], cache, local)
+    first = next(snapshots)
+
+    assert first == {"milk": "Dairy", "zorblax": PENDING_SECTION, "quux": PENDING_SECTION}
+    assert fake_gemini.calls == 0
+
+    last = first
+    for last in snapshots:
+        pass
+    assert fake_gemini.calls == 1
+    assert PENDING_SECTION not in last.values()
+    assert last["milk"] == "Dairy"
+    assert cache.get("zorblax") == last["zorblax"]
+
+
+def test_categorize_items_stream_adds_one_item_per_streamed_line(fake_gemini):
+    snapshots = list(categorize_items_stream(["zorblax", "quux", "flimflam"], CategoryCache()))
+
+    pending = [list(snapshot.values()).count(PENDING_SECTION) for snapshot in snapshots]
+    assert pending == [3, 2, 1, 0]
+
+
+def test_known_lists_record_the_model_latency_saved(fake_gemini):
+    cache = CategoryCache()
+    list(categorize_items_stream(["zorblax"], cache))
+    model_latency = metrics.average("grocery_categorizer.model_latency")
+
+    assert list(categorize_items_stream(["zorblax"], cache)) == [{"zorblax": cache.get("zorblax")}]
+    assert metrics.average("grocery_categorizer.latency_saved") == model_latency
+    assert fake_gemini.calls == 1
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from update_dedup import UpdateDeduplicator
+
+
+def redelivery_storm(dedup, update_id, process, copies=50):
+    """Delivers the same update_id from many threads at once; returns the outcomes."""
+
+    barrier = threading.Barrier(copies)
+    outcomes = []
+    lock = threading.Lock()
+
+    def deliver():
+        barrier.wait()
+        try:
+            outcome = dedup.run_once(update_id, process)
+        except Exception as e:
+            outcome = e
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=deliver) for _ in range(copies)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_concurrent_duplicates_are_processed_once():
+    dedup = UpdateDeduplicator()
+    calls = []
+    release = threading.Event()
+
+    def process():
+        calls.append(1)
+        # Tiene l'elaborazione in corso finché tutte le copie non sono arrivate
+        release.wait(1)
+        return {"ok": True, "reply": len(calls)}
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    outcomes = redelivery_storm(dedup, 1001, process)
+    timer.cancel()
+
+    assert len(calls) == 1
+    assert all(result == {"ok": True, "reply": 1} for result, _ in outcomes)
+    assert sorted(duplicate for _, duplicate in outcomes) == [False] + [True] * 49
+    assert dedup.hit_rate() == pytest.approx(49 / 50)
+
+
+def test_redelivery_after_a_failure_is_processed_again():
+    dedup = UpdateDeduplicator()
+    attempts = []
+    release = threading.Event()
+
+    def process():
+        attempts.append(1)
+        if len(attempts) == 1:
+            release.wait(1)
+            raise ConnectionError("Dialogflow unreachable")
+        return "answered"
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    outcomes = redelivery_storm(dedup, 1002, process, copies=20)
+    timer.cancel()
+    assert len(attempts) == 1
+    assert all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+
+    assert dedup.run_once(1002, process) == ("answered", False)
+    assert dedup.run_once(1002, process) == ("answered", True)
+    assert len(attempts) == 2
+
+
+class FakeBackend:
+
+    def __init__(self):
+        self.claimed = set()
+        self.released = []
+
+    def claim(self, update_id):
+        if update_id in self.claimed:
+            return False
+        self.claimed.add(update_id)
+        return True
+
+    def release(self, update_id):
+        self.released.append(update_id)
+        self.claimed.discard(update_id)
+
+
+def test_updates_claimed_by_another_instance_are_skipped():
+    backend = FakeBackend()
+    first, second = UpdateDeduplicator(backend=backend), UpdateDeduplicator(backend=backend)
+    calls = []
+
+    assert first.run_once(1003, lambda: calls.append(1) or "done") == ("done", False)
+    assert second.run_once(1003, lambda: calls.append(1) or "done") == (None, True)
+    assert len(calls) == 1
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+import gemini_api_script
+import metrics
+from upstream_guard import UPSTREAM_LIMITS, CircuitBreaker, CircuitOpen, StreamFlight, get_breaker, get_limiter
+
+
+def test_stream_errors_open_the_gemini_circuit(fake_gemini):
+    fake_gemini.fail_after = 1
+
+    for _ in range(3):
+        # L'errore a metà risposta viene assorbito: restano le righe già ricevute
+        assert len(list(gemini_api_script.categorize_grocery_list_stream(["zorblax", "quux"]))) == 1
+
+    assert get_breaker("gemini").state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        list(gemini_api_script.categorize_grocery_list_stream(["zorblax", "quux"]))
+    assert fake_gemini.calls == 3
+
+
+def test_slow_streams_count_as_failures():
+    breaker = CircuitBreaker("test", failure_ratio=0.5, slow_call=0.0, window=4, min_calls=2, open_for=60)
+
+    for _ in range(2):
+        assert list(breaker.call_stream(lambda: iter([1, 2]))) == [1, 2]
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stream_closed_early_is_not_counted():
+    breaker = CircuitBreaker("test", failure_ratio=0.5, slow_call=60, window=4, min_calls=1, open_for=60)
+
+    stream = breaker.call_stream(lambda: iter([1, 2, 3]))
+    assert next(stream) == 1
+    stream.close()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert list(breaker.call_stream(lambda: iter([1]))) == [1]
+
+
+def test_identical_concurrent_streams_share_one_model_call(fake_gemini):
+    fake_gemini.chunk_latency = 0.05
+    barrier = threading.Barrier(5)
+    answers = []
+
+    def view():
+        barrier.wait()
+        answers.append(list(gemini_api_script.categorize_grocery_list_stream(["zorblax widget", "quux"])))
+
+    threads = [threading.Thread(target=view) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fake_gemini.calls == 1
+    assert len(answers) == 5
+    assert all(answer == answers[0] and len(answer) == 2 for answer in answers)
+    assert metrics.snapshot()["counters"]["upstream.gemini.request_categories_stream.coalesced"] == 4
+
+
+def test_stream_followers_get_the_error_of_the_shared_call():
+    flight = StreamFlight("test")
+    release = threading.Event()
+
+    def failing():
+        yield 1
+        release.wait()
+        raise ConnectionError("broken stream")
+
+    leader = flight.stream("key", failing)
+    assert next(leader) == 1
+    follower = flight.stream("key", failing)
+    assert next(follower) == 1
+    release.set()
+
+    with pytest.raises(ConnectionError):
+        list(leader)
+    with pytest.raises(ConnectionError):
+        list(follower)
+
+
+def test_limiter_slot_is_held_until_the_stream_ends(fake_gemini):
+    stream = gemini_api_script.categorize_grocery_list_stream(["zorblax", "quux"])
+    next(stream)
+
+    slots = get_limiter("gemini")._slots
+    held = [slots.acquire(blocking=False) for _ in range(UPSTREAM_LIMITS["gemini"]["concurrency"])]
+    assert held.count(False) == 1
+
+    for acquired in held:
+        if acquired:
+            slots.release()
+    list(stream)
+    assert slots.acquire(blocking=False)
+    slots.release()